@@ -0,0 +1,226 @@
+# app/admission.py — admission control: token bucket po korisniku + globalni raspoređivač upstream poziva
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+import asyncio, math, os, time
+
+from app import tracing
+
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "60"))  # zahtjeva u minuti po korisniku (0 = isključeno)
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "100000"))  # procijenjenih tokena u minuti (0 = isključeno)
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "32"))
+UPSTREAM_QUEUE_MAX = int(os.getenv("UPSTREAM_QUEUE_MAX", "256"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "5"))
+
+# prioriteti: manji broj ide prvi
+STREAM, QUERY, BATCH = 0, 1, 2
+_PRIORITY_NAMES = {STREAM: "stream", QUERY: "query", BATCH: "batch"}
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, per_minute: float, capacity: float) -> None:
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, n: float) -> float:
+        """Sekunde do trenutka kad će biti `n` tokena (0 = odmah)."""
+        n = min(n, self.capacity)  # veći zahtjev od kapaciteta nikad ne bi prošao
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+class UserLimiter:
+    """Dva bucketa po korisniku (zahtjevi, tokeni); oba se provjere prije nego se išta potroši."""
+
+    def __init__(self) -> None:
+        self._users: "OrderedDict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]]" = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+        self.waited = 0
+        self.refunded = 0
+
+    def _buckets(self, user_id: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            buckets = (
+                TokenBucket(RATE_LIMIT_RPM, RATE_LIMIT_BURST) if RATE_LIMIT_RPM > 0 else None,
+                TokenBucket(RATE_LIMIT_TPM, RATE_LIMIT_TPM) if RATE_LIMIT_TPM > 0 else None,
+            )
+            self._users[user_id] = buckets
+            while len(self._users) > RATE_LIMIT_MAX_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return buckets
+
+    def check(self, user_id: str, tokens: int = 0, requests: int = 1) -> None:
+        """Troši budžet ili diže 429 s Retry-After."""
+        now = time.monotonic()
+        req, tok = self._buckets(user_id)
+        wait = 0.0
+        for bucket, n in ((req, requests), (tok, tokens)):
+            if bucket is not None and n:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_for(n))
+        if wait > 0:
+            self.limited += 1
+            raise _too_many("rate_limited", wait)
+        for bucket, n in ((req, requests), (tok, tokens)):
+            if bucket is not None and n:
+                bucket.tokens -= min(n, bucket.capacity)
+        self.allowed += 1
+
+    def refund(self, user_id: str, tokens: int = 0, requests: int = 1) -> None:
+        """Vraća budžet zahtjeva koji je prošao `check`, ali nije otišao upstreamu (shed u scheduleru)."""
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            return
+        now = time.monotonic()
+        for bucket, n in zip(buckets, (requests, tokens)):
+            if bucket is not None and n:
+                bucket.refill(now)
+                bucket.tokens = min(bucket.capacity, bucket.tokens + min(n, bucket.capacity))
+        self.refunded += 1
+
+    async def wait(self, user_id: str, tokens: int) -> None:
+        """Troši `tokens` iz token bucketa; umjesto 429 čeka da se napuni (batch)."""
+        while tokens:
+            _, tok = self._buckets(user_id)
+            if tok is None:
+                return
+            tok.refill(time.monotonic())
+            delay = tok.wait_for(tokens)
+            if delay <= 0:
+                tok.tokens -= min(tokens, tok.capacity)
+                return
+            self.waited += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "rpm": RATE_LIMIT_RPM,
+            "tpm": RATE_LIMIT_TPM,
+            "users": len(self._users),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "waited": self.waited,
+            "refunded": self.refunded,
+        }
+
+class UpstreamScheduler:
+    """
+    Najviše UPSTREAM_CONCURRENCY upstream poziva istovremeno. Čekači su po
+    prioritetu, a unutar prioriteta round-robin po korisniku (fair queuing),
+    pa jedan korisnik s puno zahtjeva ne izgladnjuje ostale. Puna ili spora
+    queue → brzi 429 umjesto timeouta.
+    """
+
+    def __init__(self, concurrency: int = UPSTREAM_CONCURRENCY, queue_max: int = UPSTREAM_QUEUE_MAX) -> None:
+        self.concurrency = concurrency
+        self.queue_max = queue_max
+        self.active = 0
+        # prioritet -> korisnik -> čekači (futures) redom dolaska
+        self._queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {p: OrderedDict() for p in _PRIORITY_NAMES}
+        self.queued = 0
+        self._hold = 1.0  # EWMA trajanja slota (s), za Retry-After
+        self.granted = 0
+        self.shed = 0
+
+    def _retry_after(self) -> float:
+        return self._hold * (self.queued + 1) / max(1, self.concurrency)
+
+    async def acquire(self, user_id: str, priority: int = QUERY, timeout: Optional[float] = UPSTREAM_QUEUE_TIMEOUT) -> None:
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self.granted += 1
+            return
+        if priority != BATCH and self.queued >= self.queue_max:
+            self.shed += 1
+            raise _too_many("upstream_overloaded", self._retry_after())
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(fut)
+        self.queued += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # slot je dodijeljen baš u trenutku odustajanja → vrati ga
+                self.release()
+            else:
+                fut.cancel()
+                self._forget(priority, user_id, fut)
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed += 1
+                raise _too_many("upstream_overloaded", self._retry_after())
+            raise
+        self.granted += 1
+        tracing.add("queue", time.perf_counter() - t0)
+
+    def _forget(self, priority: int, user_id: str, fut: asyncio.Future) -> None:
+        waiters = self._queues[priority].get(user_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(fut)
+            self.queued -= 1
+        except ValueError:
+            return
+        if not waiters:
+            del self._queues[priority][user_id]
+
+    def release(self, held: Optional[float] = None) -> None:
+        if held is not None:
+            self._hold += 0.1 * (held - self._hold)
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, waiters = next(iter(users.items()))
+                fut = waiters.popleft()
+                self.queued -= 1
+                # korisnik ide na kraj reda (round-robin)
+                del users[user_id]
+                if waiters:
+                    users[user_id] = waiters
+                if not fut.done():
+                    fut.set_result(None)  # slot prelazi izravno na čekača, active ostaje isti
+                    return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, priority: int = QUERY, timeout: Optional[float] = UPSTREAM_QUEUE_TIMEOUT):
+        await self.acquire(user_id, priority, timeout)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - t0)
+
+    def stats(self) -> dict:
+        waiting: List[int] = [sum(len(w) for w in self._queues[p].values()) for p in sorted(self._queues)]
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": {_PRIORITY_NAMES[p]: n for p, n in zip(sorted(self._queues), waiting)},
+            "granted": self.granted,
+            "shed": self.shed,
+            "avg_hold_s": round(self._hold, 3),
+        }
+
+user_limiter = UserLimiter()
+upstream_scheduler = UpstreamScheduler()
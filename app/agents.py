@@ -0,0 +1,335 @@
+# app/agents.py — definicije agenata u Supabaseu + in-process registry s prekompiliranim system prompt templateima
+from collections import OrderedDict
+from string import Formatter
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio, contextvars, datetime, os, sys, time, weakref
+
+from fastapi import APIRouter, Depends, HTTPException
+from postgrest.exceptions import APIError
+from postgrest.types import CountMethod
+from pydantic import BaseModel, Field
+
+from app import db
+from app.auth import get_current_user, AuthedUser
+from app.tracing import TracedRoute
+
+DEFAULT_SYSTEM_PROMPT = os.getenv("AI_SYSTEM_PROMPT", "You are a helpful assistant.")
+AGENTS_SYNC_INTERVAL = float(os.getenv("AGENTS_SYNC_INTERVAL", "30"))  # s; provjera verzija u pozadini
+AGENTS_MISS_RESYNC = float(os.getenv("AGENTS_MISS_RESYNC", "2"))  # nepoznat id → sync tek ako je stariji od ovoga
+AGENTS_CACHE_USERS = int(os.getenv("AGENTS_CACHE_USERS", "10000"))  # korisnika čiji su agenti u memoriji
+AGENTS_MAX_PER_USER = int(os.getenv("AGENTS_MAX_PER_USER", "200"))
+AGENT_PROMPT_MAX_CHARS = int(os.getenv("AGENT_PROMPT_MAX_CHARS", "16000"))
+AGENT_FIELDS = "id,user_id,name,system_prompt,model,temperature,max_tokens,stop,version"
+
+# --- templatei ---
+
+class Template:
+    """
+    `{ime}` polja (bez format specova), `{{`/`}}` za doslovne zagrade.
+    Parsira se jednom; isti izvor dijele svi agenti (intern po tekstu).
+    """
+
+    __slots__ = ("source", "parts", "fields", "static", "__weakref__")
+
+    def __init__(self, source: str) -> None:
+        parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if field is not None and (not field.isidentifier() or spec or conversion):
+                raise ValueError(f"Invalid template field: {{{field}}}")
+            parts.append((literal, field))
+        self.source = source
+        self.parts = tuple(parts)
+        self.fields = frozenset(f for _, f in parts if f is not None)
+        # bez polja → render je samo vraćanje stringa
+        self.static = "".join(lit for lit, _ in parts) if not self.fields else None
+
+    def render(self, variables: Dict[str, str]) -> str:
+        if self.static is not None:
+            return self.static
+        missing = self.fields.difference(variables)
+        if missing:
+            raise KeyError(", ".join(sorted(missing)))
+        return "".join(lit + (variables[f] if f is not None else "") for lit, f in self.parts)
+
+_templates: "weakref.WeakValueDictionary[str, Template]" = weakref.WeakValueDictionary()
+
+def compile_template(source: str) -> Template:
+    tpl = _templates.get(source)
+    if tpl is None:
+        tpl = _templates[source] = Template(source)
+    return tpl
+
+# --- agenti ---
+
+class Agent:
+    __slots__ = ("id", "user_id", "name", "version", "template", "model", "temperature", "max_tokens", "stop")
+
+    def __init__(self, row: dict) -> None:
+        self.id = str(row["id"])
+        self.user_id = row.get("user_id")
+        self.name = row.get("name") or ""
+        self.version = int(row.get("version") or 1)
+        self.template = compile_template(row.get("system_prompt") or DEFAULT_SYSTEM_PROMPT)
+        self.model = sys.intern(row["model"]) if row.get("model") else None
+        self.temperature = row.get("temperature")
+        self.max_tokens = row.get("max_tokens")
+        self.stop = tuple(row.get("stop") or ())
+
+    def system_prompt(self, variables: Optional[Dict[str, str]] = None) -> str:
+        """System prompt za jedan zahtjev; `date` i `agent` su uvijek dostupni."""
+        if self.template.static is not None:
+            return self.template.static
+        values = dict(variables or {})
+        values["agent"] = self.name
+        values["date"] = datetime.date.today().isoformat()
+        try:
+            return self.template.render(values)
+        except KeyError as e:
+            raise HTTPException(status_code=422, detail=f"Missing template variable: {e.args[0]}")
+
+    def info(self) -> dict:
+        return {
+            "id": self.id, "name": self.name, "version": self.version, "system_prompt": self.template.source,
+            "variables": sorted(self.template.fields), "model": self.model, "temperature": self.temperature,
+            "max_tokens": self.max_tokens, "stop": list(self.stop),
+        }
+
+# zadani agent za zahtjeve bez agent_id (prije je system prompt bio literal u handlerima)
+DEFAULT_AGENT = Agent({"id": "default", "name": "default", "system_prompt": DEFAULT_SYSTEM_PROMPT})
+
+class _UserAgents:
+    __slots__ = ("ids", "synced_at")
+
+    def __init__(self) -> None:
+        self.ids: Set[str] = set()
+        self.synced_at = 0.0
+
+class AgentRegistry:
+    """
+    Agenti po id-u, učitani po korisniku (RLS → korisnikov JWT) pri prvom
+    zahtjevu na ovom workeru. Poslije toga resolve je dict lookup; svakih
+    AGENTS_SYNC_INTERVAL u pozadini se povuku samo (id, version) i ponovo
+    učitaju/kompiliraju samo redovi kojima se verzija promijenila.
+    """
+
+    def __init__(self) -> None:
+        self._agents: Dict[str, Agent] = {}
+        self._users: "OrderedDict[str, _UserAgents]" = OrderedDict()
+        self._syncing: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.syncs = 0
+        self.compiled = 0
+        self.sync_errors = 0
+
+    async def resolve(self, user: AuthedUser, agent_id: Optional[str]) -> Agent:
+        if not agent_id:
+            return DEFAULT_AGENT
+        ua = self._users.get(user.id)
+        if ua is None:
+            await self._sync(user)  # hladan start: jednom po korisniku po workeru
+        else:
+            self._users.move_to_end(user.id)
+            if time.monotonic() - ua.synced_at > AGENTS_SYNC_INTERVAL:
+                self._sync_background(user)
+        agent = self._agents.get(agent_id)
+        if agent is None or agent.user_id != user.id:
+            # možda je upravo kreiran na drugom workeru
+            ua = self._users.get(user.id)
+            if ua is not None and time.monotonic() - ua.synced_at > AGENTS_MISS_RESYNC:
+                await self._sync(user)
+                agent = self._agents.get(agent_id)
+            if agent is None or agent.user_id != user.id:
+                raise HTTPException(status_code=404, detail="Agent not found")
+        self.hits += 1
+        return agent
+
+    def agents(self, user_id: str) -> List[Agent]:
+        ua = self._users.get(user_id)
+        return [self._agents[i] for i in ua.ids if i in self._agents] if ua else []
+
+    async def load(self, user: AuthedUser) -> List[Agent]:
+        ua = self._users.get(user.id)
+        if ua is None or time.monotonic() - ua.synced_at > AGENTS_SYNC_INTERVAL:
+            await self._sync(user)
+        return self.agents(user.id)
+
+    # --- sinkronizacija s tablicom ---
+    def _sync_task(self, user: AuthedUser) -> asyncio.Task:
+        # jedan sync po korisniku u letu; prazan kontekst da pozadinski sync ne ulazi u Server-Timing
+        task = self._syncing.get(user.id)
+        if task is None or task.done():
+            task = self._syncing[user.id] = asyncio.create_task(self._fetch(user), context=contextvars.Context())
+            task.add_done_callback(lambda t, uid=user.id: self._sync_done(uid, t))
+        return task
+
+    def _sync_done(self, user_id: str, task: asyncio.Task) -> None:
+        if self._syncing.get(user_id) is task:
+            del self._syncing[user_id]
+        if not task.cancelled():
+            task.exception()  # pozadinski sync: greška je već u sync_errors
+
+    async def _sync(self, user: AuthedUser) -> None:
+        await asyncio.shield(self._sync_task(user))
+
+    def _sync_background(self, user: AuthedUser) -> None:
+        self._sync_task(user)
+
+    async def _fetch(self, user: AuthedUser) -> None:
+        sb = db.session(user.token)
+        try:
+            res = await sb.table("agents").select("id,version").eq("user_id", user.id).limit(AGENTS_MAX_PER_USER).execute()
+            versions = {str(r["id"]): int(r.get("version") or 1) for r in res.data or []}
+            changed = [i for i, v in versions.items() if i not in self._agents or self._agents[i].version != v]
+            rows = []
+            if changed:
+                full = await sb.table("agents").select(AGENT_FIELDS).eq("user_id", user.id).in_("id", changed).execute()
+                rows = full.data or []
+        except APIError as e:
+            self.sync_errors += 1
+            raise HTTPException(status_code=500, detail=f"DB select error: {e.message or e}")
+        except Exception:
+            self.sync_errors += 1
+            raise
+        self.syncs += 1
+        ua = self._user(user.id)
+        for gone in ua.ids.difference(versions):
+            self._agents.pop(gone, None)
+        for row in rows:
+            self._put(row)
+        ua.ids = set(versions)
+        ua.synced_at = time.monotonic()
+
+    def _user(self, user_id: str) -> _UserAgents:
+        ua = self._users.get(user_id)
+        if ua is None:
+            ua = self._users[user_id] = _UserAgents()
+            while len(self._users) > AGENTS_CACHE_USERS:
+                _, old = self._users.popitem(last=False)
+                for i in old.ids:
+                    self._agents.pop(i, None)
+        self._users.move_to_end(user_id)
+        return ua
+
+    def _put(self, row: dict) -> Agent:
+        try:
+            agent = Agent(row)
+        except ValueError:
+            agent = Agent({**row, "system_prompt": DEFAULT_SYSTEM_PROMPT})  # neispravan template zapisan mimo API-ja
+        self._agents[agent.id] = agent
+        self.compiled += 1
+        return agent
+
+    # --- izmjene kroz /agents (odmah vidljive na ovom workeru) ---
+    def put(self, row: dict) -> Agent:
+        agent = self._put(row)
+        ua = self._users.get(agent.user_id)
+        if ua is not None:
+            ua.ids.add(agent.id)
+        return agent
+
+    def drop(self, user_id: str, agent_id: str) -> None:
+        self._agents.pop(agent_id, None)
+        ua = self._users.get(user_id)
+        if ua is not None:
+            ua.ids.discard(agent_id)
+
+    def stats(self) -> dict:
+        return {
+            "agents": len(self._agents),
+            "users": len(self._users),
+            "templates": len(_templates),
+            "hits": self.hits,
+            "syncs": self.syncs,
+            "compiled": self.compiled,
+            "sync_errors": self.sync_errors,
+        }
+
+agent_registry = AgentRegistry()
+
+# --- /agents ---
+
+router = APIRouter(prefix="/agents", tags=["agents"], route_class=TracedRoute)
+
+class AgentCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=200)
+    system_prompt: str = Field(..., min_length=1, max_length=AGENT_PROMPT_MAX_CHARS,
+                               description="template, npr. 'You are {agent}. Today is {date}. Answer in {language}.'")
+    model: Optional[str] = None
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
+    max_tokens: Optional[int] = Field(None, ge=32, le=4096)
+    stop: Optional[List[str]] = Field(None, max_length=4)
+
+class AgentUpdate(BaseModel):
+    name: Optional[str] = Field(None, min_length=1, max_length=200)
+    system_prompt: Optional[str] = Field(None, min_length=1, max_length=AGENT_PROMPT_MAX_CHARS)
+    model: Optional[str] = None
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
+    max_tokens: Optional[int] = Field(None, ge=32, le=4096)
+    stop: Optional[List[str]] = Field(None, max_length=4)
+
+def _check_template(source: Optional[str]) -> None:
+    if source is not None:
+        try:
+            compile_template(source)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+def _db_error(action: str, e: APIError) -> HTTPException:
+    return HTTPException(status_code=500, detail=f"DB {action} error: {e.message or e}")
+
+@router.post("")
+async def create_agent(payload: AgentCreate, user: AuthedUser = Depends(get_current_user)):
+    _check_template(payload.system_prompt)
+    sb = db.session(user.token)
+    try:
+        # registry sinkronizira najviše AGENTS_MAX_PER_USER agenata; više od toga bi tiho ispalo (404)
+        count = await sb.table("agents").select("id", count=CountMethod.exact).eq("user_id", user.id).limit(1).execute()
+    except APIError as e:
+        raise _db_error("select", e)
+    if (count.count or 0) >= AGENTS_MAX_PER_USER:
+        raise HTTPException(status_code=409, detail=f"Agent limit reached ({AGENTS_MAX_PER_USER})")
+    try:
+        res = await sb.table("agents").insert(
+            {**payload.model_dump(), "user_id": user.id, "version": 1}
+        ).execute()
+    except APIError as e:
+        raise _db_error("insert", e)
+    return {"agent": agent_registry.put(res.data[0]).info()}
+
+@router.get("")
+async def list_agents(user: AuthedUser = Depends(get_current_user)):
+    return {"agents": sorted((a.info() for a in await agent_registry.load(user)), key=lambda a: a["name"])}
+
+@router.get("/{agent_id}")
+async def get_agent(agent_id: str, user: AuthedUser = Depends(get_current_user)):
+    return {"agent": (await agent_registry.resolve(user, agent_id)).info()}
+
+@router.patch("/{agent_id}")
+async def update_agent(agent_id: str, payload: AgentUpdate, user: AuthedUser = Depends(get_current_user)):
+    """Svaka izmjena diže `version`; uvjet na staru verziju → istovremena izmjena s drugog workera je 409."""
+    changes = payload.model_dump(exclude_unset=True)
+    _check_template(changes.get("system_prompt"))
+    agent = await agent_registry.resolve(user, agent_id)
+    if not changes:
+        return {"agent": agent.info()}
+    try:
+        res = await (
+            db.session(user.token).table("agents")
+            .update({**changes, "version": agent.version + 1, "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()})
+            .eq("id", agent_id).eq("user_id", user.id).eq("version", agent.version).execute()
+        )
+    except APIError as e:
+        raise _db_error("update", e)
+    if not res.data:
+        agent_registry._sync_background(user)
+        raise HTTPException(status_code=409, detail="Agent was changed concurrently, retry")
+    return {"agent": agent_registry.put(res.data[0]).info()}
+
+@router.delete("/{agent_id}")
+async def delete_agent(agent_id: str, user: AuthedUser = Depends(get_current_user)):
+    try:
+        await db.session(user.token).table("agents").delete().eq("id", agent_id).eq("user_id", user.id).execute()
+    except APIError as e:
+        raise _db_error("delete", e)
+    agent_registry.drop(user.id, agent_id)
+    return {"deleted": agent_id}
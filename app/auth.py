@@ -1,24 +1,154 @@
-# app/auth.py
+# app/auth.py — lokalna JWT validacija (secret / JWKS) + cache, Supabase get_user kao fallback
+from collections import OrderedDict
+from typing import Optional, Tuple
+import asyncio, os, time
+
+import httpx
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import jwt, JWTError
 from pydantic import BaseModel
-from supabase_service import supabase
+from supabase_service import supabase, SUPABASE_URL
+from app import metrics, tracing
 
 security = HTTPBearer()
 
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+SUPABASE_JWT_AUD = os.getenv("SUPABASE_JWT_AUD", "authenticated")
+AUTH_REMOTE_FALLBACK = os.getenv("AUTH_REMOTE_FALLBACK", "1") == "1"  # 0 = samo lokalna validacija
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_JWKS_TTL = float(os.getenv("AUTH_JWKS_TTL", "600"))
+AUTH_JWKS_MIN_REFETCH = float(os.getenv("AUTH_JWKS_MIN_REFETCH", "30"))  # nepoznat kid ne okida fetch češće od ovoga
+AUTH_JWKS_TIMEOUT = float(os.getenv("AUTH_JWKS_TIMEOUT", "5"))
+AUTH_LEEWAY = int(os.getenv("AUTH_LEEWAY", "30"))
+
+_ASYMMETRIC = ("RS256", "ES256")
+
 class AuthedUser(BaseModel):
     id: str
     token: str
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> AuthedUser:
-    """
-    Validacija user JWT-a preko Supabase-a. Vraća (user_id, token).
-    """
-    token = credentials.credentials
+class _Unverifiable(Exception):
+    """Token se ne može provjeriti lokalno (nema secreta / ključa) — ide na fallback."""
+
+# token -> (user_id, exp); LRU, istekli unosi se izbacuju pri čitanju
+_verified: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_jwks: dict = {"keys": {}, "fetched_at": 0.0}
+_jwks_lock = asyncio.Lock()
+_jwks_client: Optional[httpx.AsyncClient] = None
+
+def _cache_get(token: str) -> Optional[str]:
+    hit = _verified.get(token)
+    if hit is None:
+        return None
+    user_id, exp = hit
+    if exp <= time.time():
+        _verified.pop(token, None)
+        return None
+    _verified.move_to_end(token)
+    return user_id
+
+def _cache_put(token: str, user_id: str, exp: float) -> None:
+    _verified[token] = (user_id, exp)
+    _verified.move_to_end(token)
+    while len(_verified) > AUTH_CACHE_SIZE:
+        _verified.popitem(last=False)
+
+def _jwks_due(kid: Optional[str]) -> bool:
+    age = time.monotonic() - _jwks["fetched_at"]
+    if kid in _jwks["keys"]:
+        return age >= AUTH_JWKS_TTL
+    # nepoznat kid (rotacija ili smeće): najviše jedan fetch po AUTH_JWKS_MIN_REFETCH, inače odmah fallback
+    return age >= AUTH_JWKS_MIN_REFETCH
+
+async def _jwks_key(kid: Optional[str]) -> Optional[dict]:
+    if _jwks_due(kid):
+        async with _jwks_lock:
+            # netko je možda već osvježio dok smo čekali lock
+            if _jwks_due(kid):
+                global _jwks_client
+                if _jwks_client is None:
+                    _jwks_client = httpx.AsyncClient(timeout=AUTH_JWKS_TIMEOUT)
+                try:
+                    r = await _jwks_client.get(SUPABASE_JWKS_URL)
+                    r.raise_for_status()
+                    _jwks["keys"] = {k.get("kid"): k for k in r.json().get("keys", [])}
+                except Exception:
+                    pass
+                _jwks["fetched_at"] = time.monotonic()
+    return _jwks["keys"].get(kid)
+
+async def shutdown() -> None:
+    global _jwks_client
+    client, _jwks_client = _jwks_client, None
+    if client is not None:
+        await client.aclose()
+
+async def _verify_local(token: str) -> Tuple[str, float]:
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    alg = header.get("alg")
+    if alg == "HS256" and SUPABASE_JWT_SECRET:
+        key = SUPABASE_JWT_SECRET
+    elif alg in _ASYMMETRIC:
+        key = await _jwks_key(header.get("kid"))
+        if key is None:
+            raise _Unverifiable()
+    else:
+        raise _Unverifiable()
+    try:
+        claims = jwt.decode(
+            token, key, algorithms=[alg], audience=SUPABASE_JWT_AUD,
+            options={"leeway": AUTH_LEEWAY},
+        )
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    if not claims.get("sub") or not claims.get("exp"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return claims["sub"], float(claims["exp"])
+
+async def _verify_remote(token: str) -> Tuple[str, float]:
     try:
-        res = supabase.auth.get_user(token)
-        if res.user is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return AuthedUser(id=res.user.id, token=token)
+        res = await run_in_threadpool(supabase.auth.get_user, token)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    if res is None or res.user is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    try:
+        exp = float(jwt.get_unverified_claims(token).get("exp") or 0)
+    except JWTError:
+        exp = 0.0
+    return res.user.id, exp
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> AuthedUser:
+    """
+    Validacija user JWT-a lokalno (SUPABASE_JWT_SECRET ili JWKS), s cacheom
+    provjerenih tokena do njihovog `exp`. Supabase get_user se zove samo ako
+    token nije moguće provjeriti lokalno i AUTH_REMOTE_FALLBACK=1. Vraća (user_id, token).
+    """
+    with tracing.phase("auth"):
+        return await _authenticate(credentials.credentials)
+
+async def _authenticate(token: str) -> AuthedUser:
+    user_id = _cache_get(token)
+    metrics.cache_lookups_total.labels("auth", "miss" if user_id is None else "hit").inc()
+    if user_id is not None:
+        return AuthedUser(id=user_id, token=token)
+    t0 = time.perf_counter()
+    try:
+        user_id, exp = await _verify_local(token)
+        metrics.supabase_auth_seconds.labels("local").observe(time.perf_counter() - t0)
+    except _Unverifiable:
+        if not AUTH_REMOTE_FALLBACK:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        t0 = time.perf_counter()
+        try:
+            user_id, exp = await _verify_remote(token)
+        finally:
+            metrics.supabase_auth_seconds.labels("remote").observe(time.perf_counter() - t0)
+    _cache_put(token, user_id, exp)
+    return AuthedUser(id=user_id, token=token)
@@ -0,0 +1,169 @@
+# app/auth_api.py — /auth signup / login / refresh preko dijeljenog async klijenta prema Supabase Authu (GoTrue)
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio, os, time
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app import auth, tracing
+from app.tracing import TracedRoute
+from supabase_service import SUPABASE_URL, SUPABASE_KEY
+
+AUTH_URL = f"{SUPABASE_URL.rstrip('/')}/auth/v1"
+AUTH_UPSTREAM_CONCURRENCY = int(os.getenv("AUTH_UPSTREAM_CONCURRENCY", "16"))  # istovremeni pozivi prema GoTrueu
+AUTH_UPSTREAM_QUEUE_MAX = int(os.getenv("AUTH_UPSTREAM_QUEUE_MAX", "500"))  # više čekača → odmah 503
+AUTH_UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("AUTH_UPSTREAM_QUEUE_TIMEOUT", "10"))
+AUTH_UPSTREAM_TIMEOUT = float(os.getenv("AUTH_UPSTREAM_TIMEOUT", "10"))
+AUTH_MAX_CONNECTIONS = int(os.getenv("AUTH_MAX_CONNECTIONS", "32"))
+# refresh token u HttpOnly cookieju (browser klijenti ga ne drže u JS-u); /auth/refresh ga čita ako nema tijela
+AUTH_REFRESH_COOKIE = os.getenv("AUTH_REFRESH_COOKIE", "0") == "1"
+AUTH_REFRESH_COOKIE_NAME = os.getenv("AUTH_REFRESH_COOKIE_NAME", "sb_refresh")
+AUTH_REFRESH_COOKIE_MAX_AGE = int(os.getenv("AUTH_REFRESH_COOKIE_MAX_AGE", str(30 * 24 * 3600)))
+
+class SignupPayload(BaseModel):
+    email: str
+    password: str
+
+class LoginPayload(BaseModel):
+    email: str
+    password: str
+
+class RefreshPayload(BaseModel):
+    refresh_token: Optional[str] = None
+
+class AuthUpstream:
+    """
+    Jedan pooled httpx klijent + ograničen broj istovremenih poziva. Navala
+    (npr. login na početku smjene) čeka u redu do AUTH_UPSTREAM_QUEUE_TIMEOUT
+    umjesto da otvara stotine konekcija; predug red → brzi 503.
+    """
+
+    def __init__(self) -> None:
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sem = asyncio.Semaphore(AUTH_UPSTREAM_CONCURRENCY)
+        self.active = 0
+        self.waiting = 0
+        self.calls = 0
+        self.rejected = 0
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=AUTH_URL,
+                headers={"apikey": SUPABASE_KEY},
+                limits=httpx.Limits(max_connections=AUTH_MAX_CONNECTIONS, max_keepalive_connections=AUTH_MAX_CONNECTIONS),
+                timeout=AUTH_UPSTREAM_TIMEOUT,
+            )
+        return self._client
+
+    async def shutdown(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def _overloaded(self) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(status_code=503, detail="auth_upstream_overloaded", headers={"Retry-After": "1"})
+
+    async def post(self, path: str, body: dict) -> httpx.Response:
+        if self.waiting >= AUTH_UPSTREAM_QUEUE_MAX:
+            raise self._overloaded()
+        self.waiting += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), AUTH_UPSTREAM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise self._overloaded()
+        finally:
+            self.waiting -= 1
+        tracing.add("queue", time.perf_counter() - t0)
+        self.active += 1
+        try:
+            with tracing.phase("upstream", "auth"):
+                self.calls += 1
+                return await self.client().post(path, json=body, extensions=tracing.httpx_extensions("auth"))
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="Auth upstream timeout")
+        except httpx.HTTPError:
+            raise HTTPException(status_code=502, detail="Auth upstream unavailable")
+        finally:
+            self.active -= 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": AUTH_UPSTREAM_CONCURRENCY,
+            "active": self.active,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "rejected": self.rejected,
+        }
+
+auth_upstream = AuthUpstream()
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        yield
+    finally:
+        await auth_upstream.shutdown()
+        await auth.shutdown()
+
+router = APIRouter(prefix="/auth", tags=["auth"], lifespan=lifespan, route_class=TracedRoute)
+
+def _error(r: httpx.Response, status: int, default: str) -> HTTPException:
+    if r.status_code == 429:
+        return HTTPException(status_code=429, detail="Too many auth requests",
+                             headers={"Retry-After": r.headers.get("retry-after", "5")})
+    try:
+        body = r.json()
+        detail = body.get("error_description") or body.get("msg") or body.get("message") or default
+    except ValueError:
+        detail = default
+    return HTTPException(status_code=status, detail=detail)
+
+def _session_response(session: dict) -> JSONResponse:
+    # svjež access token ide odmah u cache validacije: prvi sljedeći zahtjev ne dekodira JWT
+    user_id = (session.get("user") or {}).get("id")
+    if session.get("access_token") and user_id and session.get("expires_at"):
+        auth._cache_put(session["access_token"], user_id, float(session["expires_at"]))
+    response = JSONResponse(session)
+    if AUTH_REFRESH_COOKIE and session.get("refresh_token"):
+        response.set_cookie(
+            AUTH_REFRESH_COOKIE_NAME, session["refresh_token"], max_age=AUTH_REFRESH_COOKIE_MAX_AGE,
+            httponly=True, secure=True, samesite="strict", path="/auth",
+        )
+    return response
+
+@router.post("/signup")
+async def signup(payload: SignupPayload):
+    r = await auth_upstream.post("/signup", {"email": payload.email, "password": payload.password})
+    if r.status_code != 200:
+        raise _error(r, 400, "Signup failed")
+    body = r.json()
+    # s potvrdom emaila GoTrue vraća samo korisnika; bez nje sesiju s korisnikom unutra
+    if "access_token" in body:
+        return {"user": body.get("user"), "session": body}
+    return {"user": body, "session": None}
+
+@router.post("/login")
+async def login(payload: LoginPayload):
+    """Prijavi i vraća access + refresh token iz Supabase Autha."""
+    r = await auth_upstream.post("/token?grant_type=password", {"email": payload.email, "password": payload.password})
+    if r.status_code != 200:
+        raise _error(r, 401, "Invalid login credentials")
+    return _session_response(r.json())
+
+@router.post("/refresh")
+async def refresh(request: Request, payload: Optional[RefreshPayload] = None):
+    """Nova sesija iz refresh tokena (tijelo ili HttpOnly cookie), bez ponovnog slanja lozinke."""
+    token = (payload.refresh_token if payload else None) or request.cookies.get(AUTH_REFRESH_COOKIE_NAME)
+    if not token:
+        raise HTTPException(status_code=400, detail="Missing refresh_token")
+    r = await auth_upstream.post("/token?grant_type=refresh_token", {"refresh_token": token})
+    if r.status_code != 200:
+        raise _error(r, 401, "Invalid or expired refresh token")
+    return _session_response(r.json())
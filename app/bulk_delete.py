@@ -0,0 +1,180 @@
+# app/bulk_delete.py — brisanje historije u ograničenim chunkovima (sinkrono ili kao pozadinski job s progresom)
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+import asyncio, os, time, uuid
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from postgrest.types import CountMethod
+
+from app.db import ScopedPostgrest, quote_value
+from app.search_index import search_index
+
+HISTORY_DELETE_CHUNK = int(os.getenv("HISTORY_DELETE_CHUNK", "500"))  # redova po DELETE-u (kratki lockovi)
+HISTORY_DELETE_PAUSE_MS = float(os.getenv("HISTORY_DELETE_PAUSE_MS", "0"))  # pauza između chunkova
+HISTORY_DELETE_JOB_TTL = float(os.getenv("HISTORY_DELETE_JOB_TTL", "3600"))
+HISTORY_DELETE_MAX_JOBS = int(os.getenv("HISTORY_DELETE_MAX_JOBS", "1000"))
+
+@dataclass(frozen=True)
+class DeleteFilter:
+    """Svi uvjeti su opcionalni; bez ijednog briše se cijela korisnikova historija."""
+    before: Optional[str] = None  # created_at < before
+    after: Optional[str] = None  # created_at >= after
+    q: Optional[str] = None  # podniz u promptu ili odgovoru (ilike)
+
+    def __post_init__(self) -> None:
+        # neispravan datum bi inače tek PostgREST odbio (APIError → 500)
+        for name, value in (("before", self.before), ("after", self.after)):
+            if value:
+                try:
+                    datetime.fromisoformat(value)
+                except ValueError:
+                    raise HTTPException(status_code=422, detail=f"Invalid `{name}`: expected ISO 8601 date/time")
+
+    def apply(self, query):
+        if self.before:
+            query = query.lt("created_at", self.before)
+        if self.after:
+            query = query.gte("created_at", self.after)
+        if self.q:
+            # doslovan podniz: LIKE wildcardi (% _) i escape znak se escapeaju, * je PostgREST wildcard
+            term = self.q.replace("*", "").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            like = quote_value("*" + term + "*")
+            query = query.or_(f"prompt.ilike.{like},response.ilike.{like}")
+        return query
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in (("before", self.before), ("after", self.after), ("q", self.q)) if v}
+
+async def count_matching(sb: ScopedPostgrest, user_id: str, flt: DeleteFilter) -> Optional[int]:
+    res = await flt.apply(sb.table("queries").select("id", count=CountMethod.exact).eq("user_id", user_id)).limit(1).execute()
+    return res.count
+
+async def delete_chunk(sb: ScopedPostgrest, user_id: str, flt: DeleteFilter, size: int) -> int:
+    """Jedan chunk: najstarijih `size` id-eva koji odgovaraju filteru → DELETE ... WHERE id IN (...)."""
+    res = await (
+        flt.apply(sb.table("queries").select("id").eq("user_id", user_id))
+        .order("created_at")
+        .limit(size)
+        .execute()
+    )
+    ids = [r["id"] for r in (res.data or [])]
+    if not ids:
+        return 0
+    deleted = await sb.table("queries").delete().eq("user_id", user_id).in_("id", ids).execute()
+    await search_index.remove(user_id, [r["id"] for r in (deleted.data or [])])
+    return len(deleted.data or [])
+
+class DeleteJob:
+    def __init__(self, user_id: str, flt: DeleteFilter, total: Optional[int]) -> None:
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filter = flt
+        self.total = total
+        self.deleted = 0
+        self.chunks = 0
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.expires_at = time.monotonic() + HISTORY_DELETE_JOB_TTL
+        self.task: Optional[asyncio.Task] = None
+
+    def progress(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filter": self.filter.as_dict(),
+            "deleted": self.deleted,
+            "total": self.total,
+            "progress": round(min(1.0, self.deleted / self.total), 4) if self.total else (1.0 if self.status == "done" else 0.0),
+            "chunks": self.chunks,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+async def delete_all(sb: ScopedPostgrest, user_id: str, flt: DeleteFilter, job: Optional[DeleteJob] = None) -> int:
+    """Briše chunk po chunk dok ima redova; svaki DELETE je ograničen na HISTORY_DELETE_CHUNK."""
+    total, size = 0, HISTORY_DELETE_CHUNK
+    while True:
+        n = await delete_chunk(sb, user_id, flt, size)
+        total += n
+        if job is not None:
+            job.deleted, job.chunks = total, job.chunks + 1
+        # kraći chunk = gotovo; 0 obrisanih uz pronađene id-eve (npr. RLS) ne smije vrtjeti petlju
+        if n < size:
+            return total
+        if HISTORY_DELETE_PAUSE_MS:
+            await asyncio.sleep(HISTORY_DELETE_PAUSE_MS / 1000)
+
+class DeleteJobs:
+    def __init__(self) -> None:
+        self._jobs: "OrderedDict[str, DeleteJob]" = OrderedDict()
+
+    async def start(self, sb: ScopedPostgrest, user_id: str, flt: DeleteFilter) -> DeleteJob:
+        self._evict()
+        if len(self._jobs) >= HISTORY_DELETE_MAX_JOBS:
+            raise HTTPException(status_code=503, detail="Too many delete jobs", headers={"Retry-After": "30"})
+        job = DeleteJob(user_id, flt, await count_matching(sb, user_id, flt))
+        self._jobs[job.id] = job
+
+        async def run() -> None:
+            try:
+                await delete_all(sb, user_id, flt, job)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                raise
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+            finally:
+                job.finished_at = time.time()
+
+        job.task = asyncio.create_task(run())
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[DeleteJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id or job.expires_at <= time.monotonic():
+            return None
+        return job
+
+    def cancel(self, job_id: str, user_id: str) -> Optional[DeleteJob]:
+        job = self.get(job_id, user_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+            job.status = "cancelled"
+        return job
+
+    async def shutdown(self) -> None:
+        tasks = [j.task for j in self._jobs.values() if j.task is not None and not j.task.done()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for jid in [jid for jid, j in self._jobs.items() if j.expires_at <= now and j.status != "running"]:
+            del self._jobs[jid]
+
+    def stats(self) -> dict:
+        running = sum(1 for j in self._jobs.values() if j.status == "running")
+        return {"jobs": len(self._jobs), "running": running}
+
+delete_jobs = DeleteJobs()
+
+async def delete_history(sb: ScopedPostgrest, user_id: str, flt: DeleteFilter, background: bool):
+    """Zajedničko za DELETE /ai/history: sinkrono do kraja, ili 202 + job za polling."""
+    if not background:
+        return {"deleted": await delete_all(sb, user_id, flt), "filter": flt.as_dict()}
+    job = await delete_jobs.start(sb, user_id, flt)
+    return JSONResponse(status_code=202, content=job.progress(), headers={"Location": f"/ai/history/delete-jobs/{job.id}"})
+
+def job_progress(job_id: str, user_id: str, cancel: bool = False) -> dict:
+    job = delete_jobs.cancel(job_id, user_id) if cancel else delete_jobs.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.progress()
@@ -0,0 +1,82 @@
+# app/cache.py — exact-match cache odgovora za determinističke upite (LRU + TTL + memorijski budžet)
+from collections import OrderedDict
+from typing import Optional, Tuple
+import hashlib, json, os, time
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_TEMPERATURE = float(os.getenv("CACHE_MAX_TEMPERATURE", "0.2"))  # iznad ovoga se ne kešira
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_ENTRY_OVERHEAD = 200  # približno: ključ, tuple, OrderedDict čvor
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+def cache_key(model: str, prompt: str, system: str, temperature: Optional[float], max_tokens: int,
+              stop: Tuple[str, ...] = ()) -> str:
+    parts = [model, normalize_prompt(prompt), system, temperature, max_tokens]
+    if stop:
+        parts.append(list(stop))  # bez stop sekvenci ključ ostaje isti kao prije
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (answer, model, size, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, str, int, float]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cacheable(self, temperature: Optional[float]) -> bool:
+        return CACHE_ENABLED and (temperature or 0.0) <= CACHE_MAX_TEMPERATURE
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[3] <= time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key: str, answer: str, model: str) -> None:
+        if not answer:
+            return
+        size = len(answer.encode("utf-8")) + len(key) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (answer, model, size, time.monotonic() + self.ttl)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old, _ = next(iter(self._entries.items()))
+            self._drop(old)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+response_cache = ResponseCache()
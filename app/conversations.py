@@ -0,0 +1,338 @@
+# app/conversations.py — razgovori na serveru: kontekst unutar token budžeta + inkrementalni rolling summary
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import asyncio, contextvars, datetime, os, time, uuid
+
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from app import db
+from app.auth import AuthedUser
+from app.db import quote_value
+from app.model_router import estimate_tokens
+
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "3000"))  # summary + raniji turnovi
+CONVERSATION_RECENT_TOKENS = int(os.getenv("CONVERSATION_RECENT_TOKENS", "1500"))  # doslovno nakon sažimanja
+CONVERSATION_LOAD_TURNS = int(os.getenv("CONVERSATION_LOAD_TURNS", "50"))  # turnova pri učitavanju iz Supabasea
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "2000"))
+# cache hit se provjerava jednim upitom najviše jednom u ovoliko s (0 = svaki hit; više = manje upita, ali stanje s
+# drugog workera može kasniti toliko)
+CONVERSATION_REVALIDATE_S = float(os.getenv("CONVERSATION_REVALIDATE_S", "0"))
+# turnovi ovog workera koji možda još nisu u Supabaseu (write-behind red, spool retry) ulaze u svako učitavanje
+CONVERSATION_PENDING_TTL = float(os.getenv("CONVERSATION_PENDING_TTL", "120"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL") or os.getenv("AI_MODEL", "openrouter/auto")
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and an assistant. "
+    "Keep facts, decisions, names and open questions; drop pleasantries. "
+    f"Answer with the new summary only, at most {SUMMARY_MAX_TOKENS} tokens."
+)
+
+# (user_id, summary prompt, tekst za sažeti) → novi summary; poziva se izvan request patha
+Summarizer = Callable[[str, str, str], Awaitable[str]]
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _not_found() -> HTTPException:
+    return HTTPException(status_code=404, detail="Conversation not found")
+
+def _db_error(e: APIError) -> HTTPException:
+    # PostgREST odbija sam upit (loš id, 22xxx / PGRST1xx): takav razgovor ne postoji; ostalo je kvar baze
+    code = str(e.code or "")
+    if code.startswith(("22", "PGRST1")):
+        return _not_found()
+    return HTTPException(status_code=502, detail=f"DB error: {e.message or e}")
+
+def _order_key(created_at: str, row_id: str) -> Tuple[datetime.datetime, str]:
+    # poredak kao u bazi (created_at, id); timestamp bez zone je UTC
+    ts = datetime.datetime.fromisoformat(created_at)
+    return (ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)), row_id
+
+class Turn:
+    """Jedan `queries` red razgovora; id i created_at se dodjeljuju ovdje, prije write-behind upisa."""
+
+    __slots__ = ("id", "created_at", "prompt", "response", "tokens")
+
+    def __init__(self, prompt: str, response: str, row_id: Optional[str] = None, created_at: Optional[str] = None) -> None:
+        self.id = row_id or str(uuid.uuid4())
+        self.created_at = created_at or _now()
+        self.prompt = prompt
+        self.response = response
+        self.tokens = estimate_tokens(prompt) + estimate_tokens(response) + 8  # + overhead poruka
+
+    def key(self) -> Tuple[datetime.datetime, str]:
+        return _order_key(self.created_at, self.id)
+
+class Conversation:
+    """
+    `turns` su samo turnovi iza granice summaryja (najstariji prvi); `until`
+    je (created_at, id) zadnjeg sažetog turna i perzistira se uz summary.
+    """
+
+    def __init__(self, conv_id: str, user_id: str, summary: str = "", summarized: int = 0,
+                 until: Optional[Tuple[str, str]] = None) -> None:
+        self.id = conv_id
+        self.user_id = user_id
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary)
+        self.summarized = summarized
+        self.until = until
+        self.turns: Deque[Turn] = deque()
+        self.token: Optional[str] = None  # zadnji korisnikov JWT, za upis summaryja pod RLS-om
+        self.updated_at: Optional[str] = None  # conversations.updated_at kakav je u bazi
+        self.stale = False  # drugi worker je pomaknuo summary → sljedeći get učitava ponovo
+        self.checked_at = time.monotonic()  # zadnja provjera prema bazi (učitavanje ili _fresh)
+        self.compacting: Optional[asyncio.Task] = None
+
+    def pending_tokens(self) -> int:
+        return sum(t.tokens for t in self.turns)
+
+    def messages(self, system: str, prompt: str, budget: int = CONVERSATION_CONTEXT_TOKENS) -> Tuple[List[dict], int]:
+        """
+        system + summary + najnoviji turnovi koji stanu u budžet + novi prompt.
+        Vraća (messages, procijenjeni tokeni konteksta bez novog prompta).
+        """
+        room = budget - self.summary_tokens
+        picked: List[Turn] = []
+        for turn in reversed(self.turns):
+            if turn.tokens > room:
+                break
+            picked.append(turn)
+            room -= turn.tokens
+        msgs = [{"role": "system", "content": system}]
+        if self.summary:
+            msgs.append({"role": "system", "content": "Summary of the earlier conversation:\n" + self.summary})
+        for turn in reversed(picked):
+            msgs.append({"role": "user", "content": turn.prompt})
+            msgs.append({"role": "assistant", "content": turn.response})
+        msgs.append({"role": "user", "content": prompt})
+        return msgs, budget - room
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "summary": self.summary or None,
+            "summarized_turns": self.summarized,
+            "recent_turns": [{"prompt": t.prompt, "response": t.response} for t in self.turns],
+            "pending_tokens": self.pending_tokens(),
+        }
+
+class ConversationStore:
+    def __init__(self) -> None:
+        self._cache: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._loading: dict = {}
+        # conv_id → turnovi zabilježeni na ovom workeru u zadnjih CONVERSATION_PENDING_TTL s
+        self._recent: Dict[str, List[Tuple[float, Turn]]] = {}
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+        self.compactions = 0
+        self.compaction_conflicts = 0
+        self.compaction_errors = 0
+
+    # --- cache / učitavanje ---
+    async def _cached(self, user: AuthedUser, conv_id: str) -> Optional[Conversation]:
+        conv = self._cache.get(conv_id)
+        if conv is None or conv.user_id != user.id:
+            return None
+        if conv.stale or (time.monotonic() - conv.checked_at >= CONVERSATION_REVALIDATE_S
+                          and not await self._fresh(user, conv)):
+            # turn ili summary s drugog workera: ponovo iz baze (+ turnovi ovog workera koji čekaju upis)
+            self.reloads += 1
+            del self._cache[conv_id]
+            return None
+        self._cache.move_to_end(conv_id)
+        return conv
+
+    async def _fresh(self, user: AuthedUser, conv: Conversation) -> bool:
+        """Jedan indeksirani upit: najnoviji turn u bazi + updated_at razgovora (embed preko FK)."""
+        res = await (
+            db.session(user.token).table("queries").select("id,conversations(updated_at)")
+            .eq("user_id", user.id).eq("conversation_id", conv.id)
+            .order("created_at", desc=True).order("id", desc=True).limit(1).execute()
+        )
+        if not res.data:
+            conv.checked_at = time.monotonic()
+            return True  # nema upisanih turnova: ništa nije moglo doći s drugog workera
+        row = res.data[0]
+        parent = row.get("conversations") or {}
+        if isinstance(parent, list):
+            parent = parent[0] if parent else {}
+        if parent.get("updated_at") != conv.updated_at:
+            return False
+        latest = str(row["id"])
+        if (conv.until is not None and latest == conv.until[1]) or any(t.id == latest for t in conv.turns):
+            conv.checked_at = time.monotonic()
+            return True
+        return False
+
+    def _put(self, conv: Conversation) -> None:
+        self._cache[conv.id] = conv
+        self._cache.move_to_end(conv.id)
+        while len(self._cache) > CONVERSATION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    async def create(self, user: AuthedUser) -> Conversation:
+        conv = Conversation(str(uuid.uuid4()), user.id)
+        try:
+            res = await db.session(user.token).table("conversations").insert(
+                {"id": conv.id, "user_id": user.id, "summary": "", "summarized_turns": 0, "updated_at": _now()}
+            ).execute()
+        except APIError as e:
+            raise _db_error(e)
+        conv.updated_at = (res.data or [{}])[0].get("updated_at")
+        conv.token = user.token
+        self._put(conv)
+        return conv
+
+    async def get(self, user: AuthedUser, conv_id: str) -> Conversation:
+        try:
+            conv_id = str(uuid.UUID(conv_id))
+        except ValueError:
+            raise _not_found()  # ne ide u bazu: PostgREST bi ga odbio (22P02)
+        try:
+            conv = await self._cached(user, conv_id)
+            if conv is None:
+                # istovremeni zahtjevi za isti razgovor dijele jedno učitavanje
+                lkey = (user.id, conv_id)
+                task = self._loading.get(lkey)
+                if task is None:
+                    task = self._loading[lkey] = asyncio.ensure_future(self._load(user, conv_id))
+                    task.add_done_callback(lambda _: self._loading.pop(lkey, None))
+                conv = await asyncio.shield(task)
+            else:
+                self.hits += 1
+        except APIError as e:
+            raise _db_error(e)
+        if conv is None or conv.user_id != user.id:
+            raise _not_found()
+        conv.token = user.token
+        return conv
+
+    async def _load(self, user: AuthedUser, conv_id: str) -> Optional[Conversation]:
+        self.loads += 1
+        sb = db.session(user.token)
+        res = await (
+            sb.table("conversations").select("id,user_id,summary,summarized_turns,summary_until_at,summary_until_id,updated_at")
+            .eq("id", conv_id).eq("user_id", user.id).limit(1).execute()
+        )
+        if not res.data:
+            return None
+        row = res.data[0]
+        until = (row["summary_until_at"], str(row["summary_until_id"])) if row.get("summary_until_id") else None
+        conv = Conversation(row["id"], row["user_id"], row.get("summary") or "", int(row.get("summarized_turns") or 0), until)
+        conv.updated_at = row.get("updated_at")
+        # samo turnovi iza granice summaryja: brisanja historije ne pomiču granicu
+        query = sb.table("queries").select("id,created_at,prompt,response").eq("user_id", user.id).eq("conversation_id", conv_id)
+        if until:
+            c, i = quote_value(until[0]), quote_value(until[1])
+            query = query.or_(f"created_at.gt.{c},and(created_at.eq.{c},id.gt.{i})")
+        turns = await query.order("created_at", desc=True).order("id", desc=True).limit(CONVERSATION_LOAD_TURNS).execute()
+        loaded = [Turn(r.get("prompt") or "", r.get("response") or "", str(r["id"]), r["created_at"]) for r in turns.data or []]
+        self._fill(conv, loaded)
+        self._put(conv)
+        return conv
+
+    def _fill(self, conv: Conversation, loaded: List[Turn]) -> None:
+        """Učitani turnovi + oni s ovog workera koji još čekaju upis, sortirano po (created_at, id)."""
+        seen = {t.id for t in loaded}
+        floor = _order_key(*conv.until) if conv.until else None
+        pending = [t for t in self._pending(conv.id) if t.id not in seen and (floor is None or t.key() > floor)]
+        conv.turns = deque(sorted(loaded + pending, key=Turn.key))
+
+    def _pending(self, conv_id: str) -> List[Turn]:
+        recent = self._recent.get(conv_id)
+        if not recent:
+            return []
+        horizon = time.monotonic() - CONVERSATION_PENDING_TTL
+        recent[:] = [(at, t) for at, t in recent if at > horizon]
+        if not recent:
+            del self._recent[conv_id]
+        return [t for _, t in recent]
+
+    # --- turnovi i sažimanje ---
+    def record(self, conv: Conversation, prompt: str, response: str, summarize: Summarizer) -> Turn:
+        """Novi turn u cache; kad turnovi ne stanu u budžet, u pozadini se najstariji sažmu."""
+        turn = Turn(prompt, response)
+        conv.turns.append(turn)
+        self._pending(conv.id)  # usput očisti stare
+        self._recent.setdefault(conv.id, []).append((time.monotonic(), turn))
+        if conv.pending_tokens() + conv.summary_tokens > CONVERSATION_CONTEXT_TOKENS and (
+            conv.compacting is None or conv.compacting.done()
+        ):
+            # prazan kontekst: poziv za sažimanje ne ulazi u Server-Timing zahtjeva koji ga je pokrenuo
+            conv.compacting = asyncio.create_task(self._compact(conv, summarize), context=contextvars.Context())
+        return turn
+
+    async def _compact(self, conv: Conversation, summarize: Summarizer) -> None:
+        # najstariji turnovi dok ono što ostane doslovno ne padne ispod CONVERSATION_RECENT_TOKENS
+        fold: List[Turn] = []
+        remaining = conv.pending_tokens()
+        for turn in conv.turns:
+            if remaining <= CONVERSATION_RECENT_TOKENS:
+                break
+            fold.append(turn)
+            remaining -= turn.tokens
+        if not fold:
+            return
+        text = "\n".join(f"User: {t.prompt}\nAssistant: {t.response}" for t in fold)
+        if conv.summary:
+            text = f"Current summary:\n{conv.summary}\n\nNew turns:\n{text}"
+        try:
+            summary = (await summarize(conv.user_id, SUMMARY_PROMPT, text)).strip()
+        except Exception:
+            self.compaction_errors += 1
+            return
+        if not summary:
+            self.compaction_errors += 1
+            return
+        if not conv.token:
+            return
+        last, prev = fold[-1], conv.until
+        # uvjet na staru granicu: ako je drugi worker u međuvremenu sažeo isti razgovor, ovaj summary se odbacuje
+        query = db.session(conv.token).table("conversations").update({
+            "summary": summary,
+            "summarized_turns": conv.summarized + len(fold),
+            "summary_until_at": last.created_at,
+            "summary_until_id": last.id,
+            "updated_at": _now(),
+        }).eq("id", conv.id).eq("user_id", conv.user_id)
+        query = query.eq("summary_until_id", prev[1]) if prev else query.is_("summary_until_id", "null")
+        try:
+            res = await query.execute()
+        except Exception:
+            self.compaction_errors += 1  # bez promjene; sljedeći turn preko budžeta pokušava ponovo
+            return
+        if not res.data:
+            self.compaction_conflicts += 1
+            conv.stale = True
+            return
+        # turnovi dodani za vrijeme sažimanja ostaju; skidaju se samo sažeti (s početka)
+        for _ in fold:
+            conv.turns.popleft()
+        conv.summary, conv.summary_tokens = summary, estimate_tokens(summary)
+        conv.summarized += len(fold)
+        conv.until = (last.created_at, last.id)
+        conv.updated_at = res.data[0].get("updated_at")
+        self.compactions += 1
+
+    async def shutdown(self) -> None:
+        tasks = [c.compacting for c in self._cache.values() if c.compacting is not None and not c.compacting.done()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "compactions": self.compactions,
+            "compaction_conflicts": self.compaction_conflicts,
+            "compaction_errors": self.compaction_errors,
+        }
+
+conversations = ConversationStore()
@@ -0,0 +1,83 @@
+# app/db.py — request-scoped PostgREST sesije (korisnikov JWT) nad jednim pooled async transportom
+from typing import Optional
+import os
+
+import httpx
+from fastapi import Depends
+from postgrest import AsyncPostgrestClient
+
+from app.auth import get_current_user, AuthedUser
+from supabase_service import SUPABASE_URL, SUPABASE_KEY
+
+REST_URL = f"{SUPABASE_URL.rstrip('/')}/rest/v1"
+
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "50"))
+DB_MAX_KEEPALIVE = int(os.getenv("DB_MAX_KEEPALIVE", "20"))
+DB_KEEPALIVE_EXPIRY = float(os.getenv("DB_KEEPALIVE_EXPIRY", "30"))
+DB_HTTP2 = os.getenv("DB_HTTP2", "1") == "1"
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "15"))
+# samo za pozadinske upise bez korisnika u requestu (spool replay); RLS se zaobilazi, user_id je već u redu
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+_transport: Optional[httpx.AsyncHTTPTransport] = None
+
+def get_transport() -> httpx.AsyncHTTPTransport:
+    global _transport
+    if _transport is None:
+        _transport = httpx.AsyncHTTPTransport(
+            http2=DB_HTTP2,
+            limits=httpx.Limits(
+                max_connections=DB_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_MAX_KEEPALIVE,
+                keepalive_expiry=DB_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _transport
+
+async def shutdown() -> None:
+    global _transport
+    transport, _transport = _transport, None
+    if transport is not None:
+        await transport.aclose()
+
+class ScopedPostgrest(AsyncPostgrestClient):
+    """
+    PostgREST klijent za jedan request: vlastiti headeri (Authorization),
+    a konekcije dolaze iz zajedničkog transporta. Ne zatvara transport.
+    """
+
+    def create_session(self, base_url, headers, timeout, verify=True) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            transport=get_transport(),
+            follow_redirects=True,
+        )
+
+    async def aclose(self) -> None:
+        # transport je dijeljen — zatvara ga samo shutdown()
+        pass
+
+def quote_value(value: str) -> str:
+    # PostgREST logički izrazi: vrijednosti s ':' '+' ',' moraju biti u navodnicima
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def session(token: str) -> ScopedPostgrest:
+    return ScopedPostgrest(
+        REST_URL,
+        headers={"apiKey": SUPABASE_KEY, "Authorization": f"Bearer {token}"},
+        timeout=DB_TIMEOUT,
+    )
+
+def service_session() -> ScopedPostgrest:
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY nije postavljen")
+    return ScopedPostgrest(
+        REST_URL,
+        headers={"apiKey": SUPABASE_SERVICE_ROLE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"},
+        timeout=DB_TIMEOUT,
+    )
+
+async def get_db(user: AuthedUser = Depends(get_current_user)) -> ScopedPostgrest:
+    return session(user.token)
@@ -1,6 +1,12 @@
 # app/debug.py
-from fastapi import APIRouter
-import os, urllib.parse
+from collections import Counter
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+import asyncio, hmac, os, sys, threading, time, urllib.parse
+
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")  # bez njega je /debug/profile isključen (404)
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
 
 router = APIRouter(prefix="/debug", tags=["debug"])
 
@@ -24,3 +30,57 @@ def env():
         "supabase_anon_tail": tail(anon),
         "openai_key_tail": tail(openai),
     }
+
+# --- sampling profiler ---
+_profiling = threading.Lock()
+
+def _frame(code, lineno: int) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno})"
+
+def sample_stacks(seconds: float, interval: float, only: Optional[int] = None) -> Counter:
+    """
+    Svakih `interval` s uzme stack svih threadova (ili samo `only`) iz
+    sys._current_frames(). Rezultat: "root;...;leaf" → broj uzoraka.
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for tid, frame in sys._current_frames().items():
+            if tid == me or (only is not None and tid != only):
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            frames.append(names.get(tid, str(tid)))
+            stacks[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+@router.get("/profile", include_in_schema=False)
+async def profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    all_threads: bool = Query(False, description="default samo event loop thread"),
+    x_debug_token: Optional[str] = Header(None),
+):
+    """
+    Sampling profiler za N sekundi; vraća collapsed stackove (flamegraph.pl,
+    speedscope, inferno). Traži X-Debug-Token = DEBUG_TOKEN; jedan po procesu.
+    """
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token, DEBUG_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not _profiling.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    try:
+        # profiler radi u threadu; event loop za to vrijeme normalno poslužuje promet
+        loop_thread = None if all_threads else threading.get_ident()
+        stacks = await asyncio.to_thread(sample_stacks, min(seconds, PROFILE_MAX_SECONDS), interval_ms / 1000, loop_thread)
+    finally:
+        _profiling.release()
+    body = "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+    return PlainTextResponse(body)
@@ -0,0 +1,221 @@
+# app/hedging.py — hedged zahtjevi: ako primarni model kasni (percentil latencije), paralelno probaj fallback model
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio, os
+
+from app.model_router import model_router
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_FALLBACK_MODELS = [m.strip() for m in os.getenv("HEDGE_FALLBACK_MODELS", "").split(",") if m.strip()]
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "10"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))  # dok nema dovoljno uzoraka
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))  # najviše ~5% dodatnih upstream poziva
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "5"))
+
+_END = object()
+
+def _failed(item) -> bool:
+    # prvi element streama koji nije token: greška ili kraj bez ijednog tokena
+    return isinstance(item, Exception) or item is _END
+
+class LatencyWindow:
+    """Zadnjih N latencija po modelu; percentil se računa na zahtjev."""
+
+    def __init__(self, size: int = 200) -> None:
+        self.size = size
+        self._samples: Dict[str, deque] = {}
+
+    def record(self, model: str, seconds: float) -> None:
+        window = self._samples.get(model)
+        if window is None:
+            window = self._samples[model] = deque(maxlen=self.size)
+        window.append(seconds)
+
+    def percentile(self, model: str, p: float) -> Optional[float]:
+        window = self._samples.get(model)
+        if not window or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(window)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class Hedger:
+    def __init__(self) -> None:
+        self.latency = LatencyWindow()  # query: ukupno vrijeme
+        self.ttft = LatencyWindow()  # stream: vrijeme do prvog tokena
+        # budžet: svaki primarni zahtjev donosi HEDGE_BUDGET, hedge troši 1
+        self._budget = HEDGE_BUDGET_BURST
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def delay(self, window: LatencyWindow, model: str) -> float:
+        p = window.percentile(model, HEDGE_PERCENTILE)
+        d = HEDGE_DEFAULT_DELAY if p is None else p
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, d))
+
+    def fallback_for(self, model: str) -> Optional[str]:
+        for m in HEDGE_FALLBACK_MODELS:
+            if m != model and model_router.healthy(m):
+                return m
+        return None
+
+    def _admit(self) -> None:
+        self.requests += 1
+        self._budget = min(HEDGE_BUDGET_BURST, self._budget + HEDGE_BUDGET)
+
+    def _spend(self) -> bool:
+        if self._budget < 1:
+            self.budget_denied += 1
+            return False
+        self._budget -= 1
+        self.hedged += 1
+        return True
+
+    async def query(
+        self, model: str, call: Callable[[str], Awaitable[Tuple[int, str]]]
+    ) -> Tuple[str, int, str, bool]:
+        """
+        Pokreće `call(model)`; ako ne završi unutar delaya, pokreće i `call(fallback)`.
+        Pobjeđuje prvi uspješan odgovor, gubitnik se otkazuje. Vraća (model, status, answer, hedged).
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+
+        async def timed(m: str) -> Tuple[str, int, str]:
+            t0 = loop.time()
+            status, answer = await call(m)
+            if status == 200:
+                self.latency.record(m, loop.time() - t0)
+            return m, status, answer
+
+        def outcome(t: asyncio.Task) -> Tuple[str, int, str]:
+            try:
+                return t.result()
+            except Exception as e:
+                return (model if t is primary else fallback, 502, str(e))
+
+        primary = asyncio.create_task(timed(model))
+        done, _ = await asyncio.wait({primary}, timeout=self.delay(self.latency, model))
+        if done and outcome(primary)[1] == 200:
+            m, status, answer = primary.result()
+            return m, status, answer, False
+        # primarni kasni ili je odmah pao (greška, circuit_open) → fallback, ako budžet dopušta
+        fallback = self.fallback_for(model)
+        if fallback is None or not self._spend():
+            m, status, answer = await primary
+            return m, status, answer, False
+
+        hedge = asyncio.create_task(timed(fallback))
+        pending = {hedge} if done else {primary, hedge}
+        failed: Optional[Tuple[str, int, str]] = outcome(primary) if done else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    result = outcome(t)
+                    if result[1] == 200:
+                        if t is hedge:
+                            self.hedge_wins += 1
+                        return result[0], result[1], result[2], True
+                    if t is primary or failed is None:
+                        failed = result
+            return failed[0], failed[1], failed[2], True
+        finally:
+            for t in pending:
+                t.cancel()
+
+    async def stream(
+        self, model: str, open_stream: Callable[[str], AsyncIterator[str]]
+    ) -> Tuple[str, AsyncIterator[str], bool]:
+        """
+        Za stream odlučuje prvi token: ako primarni ne da token unutar delaya
+        (ili prije toga padne), starta se fallback i ostaje onaj koji prvi
+        pošalje token. Vraća (model, tokeni, hedged).
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+
+        def contender(m: str) -> Tuple[asyncio.Task, asyncio.Queue]:
+            queue: asyncio.Queue = asyncio.Queue()
+
+            async def pump() -> None:
+                t0 = loop.time()
+                first = True
+                try:
+                    async for text in open_stream(m):
+                        if first:
+                            self.ttft.record(m, loop.time() - t0)
+                            first = False
+                        queue.put_nowait(text)
+                except Exception as e:
+                    queue.put_nowait(e)
+                queue.put_nowait(_END)
+
+            return asyncio.create_task(pump()), queue
+
+        async def first_item(queue: asyncio.Queue):
+            return await queue.get()
+
+        contenders: List[Tuple[str, asyncio.Task, asyncio.Queue]] = [(model, *contender(model))]
+        waiters = {asyncio.create_task(first_item(contenders[0][2])): 0}
+        done, _ = await asyncio.wait(waiters, timeout=self.delay(self.ttft, model))
+        hedged = False
+        if not done or _failed(next(iter(done)).result()):
+            fallback = self.fallback_for(model)
+            if fallback is not None and self._spend():
+                hedged = True
+                contenders.append((fallback, *contender(fallback)))
+                waiters[asyncio.create_task(first_item(contenders[1][2]))] = 1
+        firsts: Dict[int, object] = {}
+        winner: Optional[int] = None
+        pending = set(waiters)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for w in done:
+                    firsts[waiters[w]] = w.result()
+                # oba mogu završiti u istoj rundi: pravi token pobjeđuje grešku / prazan stream bez obzira na redoslijed
+                ok = [idx for idx, item in firsts.items() if not _failed(item)]
+                if ok:
+                    winner = min(ok)
+        finally:
+            for w in pending:
+                w.cancel()
+        if winner is None:
+            winner = 0  # nitko nije dao token: ishod primarnog (greška ili prazan stream)
+        first = firsts.get(winner, _END)
+        for idx, (_, task, _) in enumerate(contenders):
+            if idx != winner:
+                task.cancel()
+        if winner == 1:
+            self.hedge_wins += 1
+        win_model, win_task, win_queue = contenders[winner]
+
+        async def tokens() -> AsyncIterator[str]:
+            item = first
+            try:
+                while item is not _END:
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                    item = await win_queue.get()
+            finally:
+                win_task.cancel()
+
+        return win_model, tokens(), hedged
+
+    def stats(self) -> dict:
+        return {
+            "enabled": HEDGE_ENABLED,
+            "fallback_models": HEDGE_FALLBACK_MODELS,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+        }
+
+hedger = Hedger()
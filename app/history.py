@@ -1,11 +1,24 @@
-# app/history.py — /ai/history endpoints (list + delete)
-from fastapi import APIRouter, Depends, HTTPException
+# app/history.py — /ai/history endpoints (list, delete, export, search) + keyset paginacija i ETag
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from postgrest.types import CountMethod
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import AsyncIterator, Iterable, Optional, List, Tuple
 from app.auth import get_current_user, AuthedUser
-from supabase_service import supabase
+from app.bulk_delete import DeleteFilter, delete_history, job_progress
+from app.search_index import search_index
+from app.db import get_db, quote_value, ScopedPostgrest
+from app.tracing import TracedRoute
+import base64, csv, hashlib, io, json, os, time, zlib
 
-router = APIRouter(prefix="/ai", tags=["ai-history"])
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "200"))
+HISTORY_EXPORT_PAGE = int(os.getenv("HISTORY_EXPORT_PAGE", "500"))
+HISTORY_FIELDS = ("id", "user_id", "prompt", "response", "created_at")
+_KEY_FIELDS = ("id", "created_at")  # uvijek u projekciji, trebaju za cursor
+
+# bez prefiksa: montira ga app/main.py pod svojim /ai routerom
+router = APIRouter(tags=["ai-history"], route_class=TracedRoute)
 
 class HistoryItem(BaseModel):
     id: str
@@ -14,24 +27,215 @@ class HistoryItem(BaseModel):
     response: str
     created_at: Optional[str] = None
 
-@router.get("/history")
-def list_history(limit: int = 20, user: AuthedUser = Depends(get_current_user)) -> dict:
-    supabase.postgrest.auth(user.token)
-    res = (
-        supabase.table("queries")
-        .select("*")
-        .eq("user_id", user.id)
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_fields(fields: Optional[str], allowed: Tuple[str, ...] = HISTORY_FIELDS) -> List[str]:
+    if not fields:
+        return list(allowed)
+    cols = [c.strip() for c in fields.split(",") if c.strip()]
+    unknown = [c for c in cols if c not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return [c for c in allowed if c in cols or c in _KEY_FIELDS]
+
+def after_cursor(query, cursor: Optional[str]):
+    """Keyset uvjet za poredak (created_at desc, id desc): sve strogo iza cursora."""
+    if not cursor:
+        return query
+    created_at, row_id = decode_cursor(cursor)
+    c, i = quote_value(created_at), quote_value(row_id)
+    return query.or_(f"created_at.lt.{c},and(created_at.eq.{c},id.lt.{i})")
+
+async def history_etag(sb: ScopedPostgrest, user_id: str, *parts) -> str:
+    """
+    Jeftin validator: najnoviji (created_at, id) + ukupan broj redova, jedan
+    indeksirani upit bez tijela odgovora. Redovi se ne mijenjaju (samo insert/delete),
+    pa se svaka promjena vidi ovdje.
+    """
+    res = await (
+        sb.table("queries")
+        .select("id,created_at", count=CountMethod.exact)
+        .eq("user_id", user_id)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(1)
+        .execute()
+    )
+    head = (res.data or [{}])[0]
+    raw = json.dumps([user_id, head.get("created_at"), head.get("id"), res.count, *parts], default=str)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+async def history_page(
+    request: Request, sb: ScopedPostgrest, user_id: str, limit: int, cursor: Optional[str], fields: Optional[str]
+) -> Response:
+    """Jedna stranica historije (najnovije prvo) s `next_cursor`; 304 ako se ništa nije promijenilo."""
+    cols = parse_fields(fields)
+    etag = await history_etag(sb, user_id, limit, cursor, cols)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    query = (
+        sb.table("queries")
+        .select(",".join(cols))
+        .eq("user_id", user_id)
+    )
+    res = await (
+        after_cursor(query, cursor)
         .order("created_at", desc=True)
-        .limit(limit)
+        .order("id", desc=True)
+        .limit(limit + 1)
         .execute()
     )
-    return {"items": res.data or []}
+    rows = res.data or []
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return JSONResponse(content={"items": rows[:limit], "next_cursor": next_cursor}, headers=headers)
+
+# --- export: keyset stranice → enkoder → (gzip) → StreamingResponse, memorija ~ jedna stranica ---
+
+EXPORT_COLUMNS = ["id", "created_at", "prompt", "response"]
+EXPORT_MEDIA = {
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+async def iter_history(
+    sb: ScopedPostgrest, user_id: str, cols: Iterable[str] = EXPORT_COLUMNS, page_size: int = HISTORY_EXPORT_PAGE
+) -> AsyncIterator[List[dict]]:
+    """Sve stranice korisnikove historije (najnovije prvo), jedna po jedna."""
+    select = ",".join(dict.fromkeys([*cols, *_KEY_FIELDS]))
+    cursor = None
+    while True:
+        query = sb.table("queries").select(select).eq("user_id", user_id)
+        res = await (
+            after_cursor(query, cursor)
+            .order("created_at", desc=True)
+            .order("id", desc=True)
+            .limit(page_size)
+            .execute()
+        )
+        rows = res.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        cursor = encode_cursor(rows[-1])
+
+async def _encode_csv(pages: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in pages:
+        for r in rows:
+            writer.writerow(["" if r.get(c) is None else r.get(c) for c in EXPORT_COLUMNS])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+async def _encode_json(pages: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    sep = "["
+    async for rows in pages:
+        chunk = ",".join(json.dumps({c: r.get(c) for c in EXPORT_COLUMNS}, ensure_ascii=False) for r in rows)
+        yield (sep + chunk).encode("utf-8")
+        sep = ","
+    yield b"[]" if sep == "[" else b"]"
+
+async def _encode_ndjson(pages: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    async for rows in pages:
+        yield "".join(json.dumps({c: r.get(c) for c in EXPORT_COLUMNS}, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+_ENCODERS = {"csv": _encode_csv, "json": _encode_json, "ndjson": _encode_ndjson}
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip header
+    async for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+def export_stream(sb: ScopedPostgrest, user_id: str, fmt: str, gzip: bool = False) -> AsyncIterator[bytes]:
+    body = _ENCODERS[fmt](iter_history(sb, user_id))
+    return _gzip(body) if gzip else body
+
+def export_response(sb: ScopedPostgrest, user_id: str, fmt: str, gzip: bool = False) -> StreamingResponse:
+    filename = f"history.{fmt}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_stream(sb, user_id, fmt, gzip),
+        media_type="application/gzip" if gzip else EXPORT_MEDIA[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+# --- pretraga: lokalni FTS5 indeks (app/search_index.py), Supabase samo za rebuild ---
+
+async def search_history(sb: ScopedPostgrest, user_id: str, q: str, limit: int, offset: int) -> dict:
+    if not search_index.available:
+        raise HTTPException(status_code=503, detail="Search index unavailable")
+    t0 = time.perf_counter()
+    if not await search_index.is_built(user_id):
+        # prvi put za korisnika: indeks iz Supabasea (keyset stranice), poslije samo inkrementalno
+        await search_index.rebuild(user_id, iter_history(sb, user_id))
+    hits = await search_index.search(user_id, q, limit + 1, offset) or []
+    return {
+        "items": hits[:limit],
+        "next_offset": offset + limit if len(hits) > limit else None,
+        "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+
+async def rebuild_search(sb: ScopedPostgrest, user_id: str) -> dict:
+    if not search_index.available:
+        raise HTTPException(status_code=503, detail="Search index unavailable")
+    return {"indexed": await search_index.rebuild(user_id, iter_history(sb, user_id))}
+
+@router.get("/history/search")
+async def history_search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    user: AuthedUser = Depends(get_current_user),
+    sb: ScopedPostgrest = Depends(get_db),
+) -> dict:
+    """Rangirani pogoci (bm25) sa snippetima iz lokalnog FTS5 indeksa; bez skeniranja preko PostgRESTa."""
+    return await search_history(sb, user.id, q, limit, offset)
+
+@router.post("/history/search/rebuild")
+async def search_rebuild(user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)) -> dict:
+    return await rebuild_search(sb, user.id)
+
+@router.get("/history")
+async def list_history(
+    request: Request,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: AuthedUser = Depends(get_current_user),
+    sb: ScopedPostgrest = Depends(get_db),
+):
+    """Keyset paginacija: `?cursor=` iz prethodnog `next_cursor`, `?fields=prompt,created_at` za listu bez odgovora."""
+    return await history_page(request, sb, user.id, limit, cursor, fields)
 
 @router.delete("/history/{item_id}")
-def delete_one(item_id: str, user: AuthedUser = Depends(get_current_user)) -> dict:
-    supabase.postgrest.auth(user.token)
-    res = (
-        supabase.table("queries")
+async def delete_one(item_id: str, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)) -> dict:
+    res = await (
+        sb.table("queries")
         .delete()
         .eq("id", item_id)
         .eq("user_id", user.id)
@@ -39,21 +243,38 @@ def delete_one(item_id: str, user: AuthedUser = Depends(get_current_user)) -> di
     )
     if res.data == []:
         raise HTTPException(status_code=404, detail="Not found or not yours")
+    await search_index.remove(user.id, [item_id])
     return {"deleted": item_id}
 
 @router.delete("/history")
-def delete_all(user: AuthedUser = Depends(get_current_user)) -> dict:
-    supabase.postgrest.auth(user.token)
-    # meki limit: brišemo max 200 da izbjegnemo greške
-    res = (
-        supabase.table("queries")
-        .select("id")
-        .eq("user_id", user.id)
-        .limit(200)
-        .execute()
-    )
-    ids = [r["id"] for r in (res.data or [])]
-    if not ids:
-        return {"deleted": 0}
-    supabase.table("queries").delete().in_("id", ids).execute()
-    return {"deleted": len(ids)}
+async def delete_all(
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    q: Optional[str] = None,
+    background: bool = False,
+    user: AuthedUser = Depends(get_current_user),
+    sb: ScopedPostgrest = Depends(get_db),
+):
+    # chunkovi od HISTORY_DELETE_CHUNK dok ima redova; ?background=1 → job + polling
+    return await delete_history(sb, user.id, DeleteFilter(before, after, q), background)
+
+# exporti se streamaju stranicu po stranicu (keyset), bez učitavanja cijele historije; ?gzip=1 za .gz
+@router.get("/history/export.json")
+async def export_json(gzip: bool = False, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    return export_response(sb, user.id, "json", gzip)
+
+@router.get("/history/export.csv")
+async def export_csv(gzip: bool = False, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    return export_response(sb, user.id, "csv", gzip)
+
+@router.get("/history/export.ndjson")
+async def export_ndjson(gzip: bool = False, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    return export_response(sb, user.id, "ndjson", gzip)
+
+@router.get("/history/delete-jobs/{job_id}")
+async def delete_job_status(job_id: str, user: AuthedUser = Depends(get_current_user)) -> dict:
+    return job_progress(job_id, user.id)
+
+@router.delete("/history/delete-jobs/{job_id}")
+async def delete_job_cancel(job_id: str, user: AuthedUser = Depends(get_current_user)) -> dict:
+    return job_progress(job_id, user.id, cancel=True)
@@ -0,0 +1,207 @@
+# app/history_writer.py — write-behind red za upis u "queries" (bulk insert po veličini / vremenu) + spool replayer
+from typing import Dict, List, Optional, Tuple
+import asyncio, os, time, uuid
+
+from postgrest.exceptions import APIError
+
+from app import db, metrics
+from app.search_index import search_index
+from app.spool import SPOOL_ENABLED, SPOOL_IDEMPOTENCY_COLUMN, spool
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "50"))
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "200"))
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "5000"))
+HISTORY_ENQUEUE_TIMEOUT = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT", "0.1"))  # backpressure prije dropa
+HISTORY_SHUTDOWN_TIMEOUT = float(os.getenv("HISTORY_SHUTDOWN_TIMEOUT", "10"))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "1"))
+
+# (token, row) — brzi put upisuje pod korisnikovim JWT-om (RLS); None = service-role sesija (replay iz spoola)
+_Item = Tuple[Optional[str], dict]
+
+def _permanent(e: Exception) -> bool:
+    """Greška koju ponovni pokušaj ne popravlja (loš red: 22/23/42xxx, PGRST1/2xx); auth, mreža i 5xx su prolazne."""
+    if not isinstance(e, APIError):
+        return False
+    code = str(e.code or "")
+    if code == "42501" or code.startswith("PGRST3"):
+        return False  # RLS / JWT
+    return code[:2] in ("22", "23", "42") or code.startswith(("PGRST1", "PGRST2"))
+
+class HistoryWriter:
+    def __init__(self) -> None:
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._replayer: Optional[asyncio.Task] = None
+        # replay ne smije ovisiti o korisnikovom JWT-u (istekne), pa spool traži service-role ključ
+        self.spooled = SPOOL_ENABLED and bool(db.SUPABASE_SERVICE_ROLE_KEY)
+        self.enqueued = 0
+        self.deferred = 0  # queue pun, ali red je u spoolu → replayer
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "deferred": self.deferred,
+            "spool": spool.stats() if self.spooled else None,
+        }
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=HISTORY_QUEUE_MAX)
+        if self.spooled:
+            try:
+                # crash recovery: sve što nije potvrđeno prije pada ide replayeru
+                await asyncio.to_thread(spool.recover)
+                self._replayer = asyncio.create_task(self._replay())
+            except OSError:
+                self.spooled = False  # disk nedostupan: radimo kao prije, samo u memoriji
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # sentinel: worker isprazni red pa izađe
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._task, HISTORY_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            if not self.spooled:
+                self._drop("shutdown", self._queue.qsize())
+        self._task = None
+        if self._replayer is not None:
+            # nepotvrđeni zapisi ostaju na disku za sljedeći start
+            self._replayer.cancel()
+            await asyncio.gather(self._replayer, return_exceptions=True)
+            self._replayer = None
+            spool.close()
+
+    def _drop(self, reason: str, n: int = 1) -> None:
+        self.dropped += n
+        metrics.history_writes_dropped_total.labels(reason).inc(n)
+
+    async def submit(self, token: str, row: dict) -> bool:
+        """
+        Sa spoolom: red je na disku prije povratka, a queue je samo brzi put
+        (pun queue → replayer ga pošalje kasnije). Bez spoola: kad je queue pun,
+        čeka najviše HISTORY_ENQUEUE_TIMEOUT pa odbacuje.
+        """
+        if self._queue is None:
+            self._drop("not_started")
+            return False
+        if self.spooled:
+            row.setdefault(SPOOL_IDEMPOTENCY_COLUMN, str(uuid.uuid4()))
+            try:
+                await spool.append(row)
+            except OSError:
+                self.spooled = False
+        try:
+            self._queue.put_nowait((token, row))
+        except asyncio.QueueFull:
+            if self.spooled:
+                self.deferred += 1
+                return True
+            try:
+                await asyncio.wait_for(self._queue.put((token, row)), HISTORY_ENQUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._drop("queue_full")
+                return False
+        self.enqueued += 1
+        return True
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch: List[_Item] = [item]
+            deadline = time.monotonic() + HISTORY_FLUSH_MS / 1000
+            while len(batch) < HISTORY_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+        # shutdown: ono što je ostalo u redu ide u zadnje batcheve
+        rest: List[_Item] = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                rest.append(item)
+        for i in range(0, len(rest), HISTORY_BATCH_SIZE):
+            await self._flush(rest[i:i + HISTORY_BATCH_SIZE])
+
+    async def _flush(self, batch: List[_Item]) -> None:
+        by_token: Dict[str, List[dict]] = {}
+        for token, row in batch:
+            by_token.setdefault(token, []).append(row)
+        for token, rows in by_token.items():
+            await self._write(token, rows)
+        self.batches += 1
+
+    async def _write(self, token: Optional[str], rows: List[dict]) -> None:
+        keys = [str(r[SPOOL_IDEMPOTENCY_COLUMN]) for r in rows] if self.spooled else []
+        spool.inflight.update(keys)
+        try:
+            res = await self._insert(token, rows)
+        except Exception as e:
+            permanent = _permanent(e)
+            if permanent and len(rows) > 1:
+                # jedan loš red ne smije odvući cijeli batch u dead.log: svaki red posebno
+                for row in rows:
+                    await self._write(token, [row])
+                return
+            self.failed += len(rows)
+            if self.spooled:
+                dead = spool.dead
+                spool.failed(keys, permanent)  # ostaje u spoolu, replayer pokušava s backoffom
+                if spool.dead > dead:
+                    metrics.history_writes_dropped_total.labels("dead_letter").inc(spool.dead - dead)
+            else:
+                # bez spoola nema retryja: red je izgubljen
+                metrics.history_writes_dropped_total.labels("insert_failed").inc(len(rows))
+            return
+        self.written += len(rows)
+        spool.ack(keys)
+        try:
+            await search_index.add(res.data or [])  # Supabase vraća redove s id / created_at
+        except Exception:
+            pass
+
+    async def _insert(self, token: Optional[str], rows: List[dict]):
+        table = (db.session(token) if token else db.service_session()).table("queries")
+        t0 = time.perf_counter()
+        try:
+            if self.spooled:
+                # idempotentno: ponovljeni zapis (retry, replay nakon pada) se ignorira
+                return await table.upsert(rows, on_conflict=SPOOL_IDEMPOTENCY_COLUMN, ignore_duplicates=True).execute()
+            return await table.insert(rows).execute()
+        finally:
+            metrics.supabase_insert_seconds.labels("history_writer").observe(time.perf_counter() - t0)
+
+    async def _replay(self) -> None:
+        while True:
+            rows = spool.due(HISTORY_BATCH_SIZE)
+            if not rows:
+                await asyncio.sleep(SPOOL_REPLAY_INTERVAL)
+                continue
+            await self._flush([(None, row) for row in rows])
+
+history_writer = HistoryWriter()
@@ -0,0 +1,144 @@
+# app/items.py — /items CRUD nad pooled PostgREST transportom + bulk create/update i keyset paginacija
+from typing import Dict, List, Optional, Tuple
+import asyncio, json, os
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from postgrest.exceptions import APIError
+from pydantic import BaseModel, Field
+
+from app.auth import get_current_user, AuthedUser
+from app.db import get_db, ScopedPostgrest
+from app.history import after_cursor, encode_cursor, parse_fields
+from app.tracing import TracedRoute
+
+ITEMS_PAGE_SIZE = int(os.getenv("ITEMS_PAGE_SIZE", "50"))
+ITEMS_PAGE_MAX = int(os.getenv("ITEMS_PAGE_MAX", "500"))
+ITEMS_BULK_MAX = int(os.getenv("ITEMS_BULK_MAX", "500"))  # redova po bulk zahtjevu
+ITEMS_BULK_CONCURRENCY = int(os.getenv("ITEMS_BULK_CONCURRENCY", "4"))  # paralelni PATCH-evi za različite izmjene
+ITEMS_FIELDS = ("id", "user_id", "title", "description", "done", "created_at")
+
+router = APIRouter(prefix="/items", tags=["items"], route_class=TracedRoute)
+
+class ItemCreate(BaseModel):
+    title: str
+    description: str
+    done: bool = False
+
+class ItemUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    done: Optional[bool] = None
+
+class ItemPatch(ItemUpdate):
+    id: str
+
+class ItemsCreate(BaseModel):
+    items: List[ItemCreate] = Field(..., min_length=1, max_length=ITEMS_BULK_MAX)
+
+class ItemsUpdate(BaseModel):
+    items: List[ItemPatch] = Field(..., min_length=1, max_length=ITEMS_BULK_MAX)
+
+def _db_error(action: str, e: APIError) -> HTTPException:
+    return HTTPException(status_code=500, detail=f"DB {action} error: {e.message or e}")
+
+def _changes(item: ItemUpdate) -> dict:
+    return item.model_dump(exclude_none=True, exclude={"id"})
+
+@router.post("")
+async def create_item(item: ItemCreate, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    try:
+        res = await sb.table("items").insert({**item.model_dump(), "user_id": user.id}).execute()
+    except APIError as e:
+        raise _db_error("insert", e)
+    return {"item": res.data[0] if res.data else None}
+
+@router.post("/bulk")
+async def create_items(payload: ItemsCreate, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    """Svi redovi jednim INSERT-om (jedan round trip); sve ili ništa."""
+    rows = [{**item.model_dump(), "user_id": user.id} for item in payload.items]
+    try:
+        res = await sb.table("items").insert(rows).execute()
+    except APIError as e:
+        raise _db_error("insert", e)
+    return {"items": res.data or [], "created": len(res.data or [])}
+
+@router.get("")
+async def list_items(
+    limit: int = Query(ITEMS_PAGE_SIZE, ge=1, le=ITEMS_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor iz prethodne stranice"),
+    fields: Optional[str] = Query(None, description="npr. id,title,done (id i created_at su uvijek uključeni)"),
+    done: Optional[bool] = None,
+    user: AuthedUser = Depends(get_current_user),
+    sb: ScopedPostgrest = Depends(get_db),
+):
+    """Itemi korisnika, najnoviji prvo, keyset paginacija po (created_at, id)."""
+    cols = parse_fields(fields, ITEMS_FIELDS)
+    query = sb.table("items").select(",".join(cols)).eq("user_id", user.id)
+    if done is not None:
+        query = query.eq("done", str(done).lower())
+    try:
+        res = await (
+            after_cursor(query, cursor)
+            .order("created_at", desc=True)
+            .order("id", desc=True)
+            .limit(limit + 1)
+            .execute()
+        )
+    except APIError as e:
+        raise _db_error("select", e)
+    rows = res.data or []
+    return {"items": rows[:limit], "next_cursor": encode_cursor(rows[limit - 1]) if len(rows) > limit else None}
+
+async def update_items(sb: ScopedPostgrest, user_id: str, patches: List[ItemPatch]) -> Tuple[List[dict], List[str]]:
+    """
+    Itemi s istim izmjenama (npr. done=true za 200 id-eva) idu jednim
+    PATCH ... WHERE id IN (...); različite izmjene su zasebni PATCH-evi,
+    najviše ITEMS_BULK_CONCURRENCY istovremeno. Vraća (ažurirani, nepronađeni id-evi).
+    """
+    merged: Dict[str, dict] = {}
+    for p in patches:
+        merged.setdefault(p.id, {}).update(_changes(p))
+    groups: Dict[str, Tuple[dict, List[str]]] = {}
+    for item_id, changes in merged.items():
+        if changes:
+            key = json.dumps(changes, sort_keys=True)
+            groups.setdefault(key, (changes, []))[1].append(item_id)
+    sem = asyncio.Semaphore(ITEMS_BULK_CONCURRENCY)
+
+    async def patch(changes: dict, ids: List[str]) -> List[dict]:
+        async with sem:
+            res = await sb.table("items").update(changes).eq("user_id", user_id).in_("id", ids).execute()
+            return res.data or []
+
+    try:
+        done = await asyncio.gather(*(patch(c, ids) for c, ids in groups.values()))
+    except APIError as e:
+        raise _db_error("update", e)
+    updated = [row for rows in done for row in rows]
+    found = {str(r.get("id")) for r in updated}
+    missing = [i for i, changes in merged.items() if changes and i not in found]
+    return updated, missing
+
+@router.patch("/bulk")
+async def patch_items(payload: ItemsUpdate, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    updated, missing = await update_items(sb, user.id, payload.items)
+    return {"updated": updated, "missing": missing}
+
+@router.patch("/{item_id}")
+async def update_item(item_id: str, item: ItemUpdate, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    changes = _changes(item)
+    if not changes:
+        return {"updated": []}
+    try:
+        res = await sb.table("items").update(changes).eq("id", item_id).eq("user_id", user.id).execute()
+    except APIError as e:
+        raise _db_error("update", e)
+    return {"updated": res.data or []}
+
+@router.delete("/{item_id}")
+async def delete_item(item_id: str, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    try:
+        await sb.table("items").delete().eq("id", item_id).eq("user_id", user.id).execute()
+    except APIError as e:
+        raise _db_error("delete", e)
+    return {"deleted": item_id}
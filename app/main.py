@@ -1,21 +1,59 @@
 # app/ai.py — OpenRouter + history + export (sa max_tokens limiterom)
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse, Response
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List
-import os, json, httpx, csv, io
+from typing import Dict, Optional, List, Literal, Tuple
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import asyncio, os, json, time
+import httpx
 
 from app.auth import get_current_user, AuthedUser
-from supabase_service import supabase
+from app.auth_api import auth_upstream
+from app import auth, history, openrouter, db, streaming
+from app.db import get_db, ScopedPostgrest
+from app.history_writer import history_writer
+from app.spool import spool
+from app.bulk_delete import delete_jobs
+from app.search_index import search_index
+from app.resume import StreamSession, stream_registry, event_id
+from app.cache import response_cache, cache_key
+from app.neardup import NEARDUP_ENABLED, NEARDUP_SCOPE, neardup_index
+from app.admission import BATCH, QUERY, STREAM, upstream_scheduler, user_limiter
+from app.model_router import ROUTER_ALIASES, estimate_tokens, model_router
+from app.hedging import HEDGE_ENABLED, hedger
+from app.singleflight import SINGLEFLIGHT_ENABLED, query_flights, stream_flights
+from app.conversations import SUMMARY_MAX_TOKENS, SUMMARY_MODEL, Conversation, Turn, conversations
+from app.agents import Agent, agent_registry
+from app import metrics, tracing
+from app.tracing import TracedRoute
 
-router = APIRouter(prefix="/ai", tags=["ai"])
+@asynccontextmanager
+async def lifespan(app):
+    async with openrouter.lifespan(app):
+        await history_writer.start()
+        try:
+            yield
+        finally:
+            await conversations.shutdown()
+            await history_writer.stop()
+            await delete_jobs.shutdown()
+            await db.shutdown()
+            await auth.shutdown()
+            search_index.close()
+
+router = APIRouter(prefix="/ai", tags=["ai"], lifespan=lifespan, route_class=TracedRoute)
 
 OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
 DEFAULT_MODEL = os.getenv("AI_MODEL", "openrouter/auto")
 APP_URL = os.getenv("APP_URL", "https://agent-builder-01-1.onrender.com")
 APP_NAME = os.getenv("APP_NAME", "she-ona")
 DEFAULT_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS", "512"))  # siguran limit
+DEFAULT_TEMPERATURE = 0.2
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_PERSIST_CHUNK = int(os.getenv("BATCH_PERSIST_CHUNK", "100"))
 
 def _headers():
     return {
@@ -27,146 +65,549 @@ def _headers():
 
 class PromptPayload(BaseModel):
     prompt: str = Field(..., min_length=1)
-    temperature: Optional[float] = Field(0.2, ge=0.0, le=1.0)
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0, description="default iz agenta, inače 0.2")
     model: Optional[str] = Field(None, description="npr. openrouter/auto ili qwen/qwen-2.5-7b-instruct:free")
     max_tokens: Optional[int] = Field(None, ge=32, le=4096, description="maks. izlaznih tokena (default 512)")
+    cache: Literal["use", "bypass", "refresh"] = Field("use", description="bypass = bez cachea, refresh = ignoriraj pogodak i prepiši")
+    hedge: Optional[bool] = Field(None, description="hedging na fallback model (default HEDGE_ENABLED)")
+    conversation_id: Optional[str] = Field(None, description="id iz POST /ai/conversations; kontekst slaže server")
+    agent_id: Optional[str] = Field(None, description="agent iz /agents: system prompt, model, temperature, max_tokens, stop")
+    variables: Optional[Dict[str, str]] = Field(None, description="vrijednosti za {polja} u system prompt templateu agenta")
+
+@dataclass(frozen=True)
+class Settings:
+    """Parametri jednog poziva: zahtjev > agent > env defaulti."""
+    model: str
+    system: str
+    temperature: Optional[float]
+    max_tokens: int
+    stop: Tuple[str, ...] = ()
+
+def _settings(agent: Agent, variables: Optional[Dict[str, str]], model: Optional[str] = None,
+              temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> Settings:
+    if temperature is None:
+        temperature = agent.temperature if agent.temperature is not None else DEFAULT_TEMPERATURE
+    return Settings(
+        model=_resolve_model(model or agent.model),
+        system=agent.system_prompt(variables),
+        temperature=temperature,
+        max_tokens=max_tokens or agent.max_tokens or DEFAULT_MAX_TOKENS,
+        stop=agent.stop,
+    )
+
+async def _request_settings(payload: PromptPayload, user: AuthedUser) -> Settings:
+    # agent je iz in-process registryja; DB samo kod prvog zahtjeva korisnika na workeru
+    agent = await agent_registry.resolve(user, payload.agent_id)
+    return _settings(agent, payload.variables, payload.model, payload.temperature, payload.max_tokens)
+
+def _chat_body(model: str, prompt: str, s: Settings, stream: bool = False, messages: Optional[List[dict]] = None) -> dict:
+    data = {
+        "model": model,
+        "messages": messages or [
+            {"role": "system", "content": s.system},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": s.temperature,
+        "max_tokens": s.max_tokens,  # <= ključna promjena
+    }
+    if s.stop:
+        data["stop"] = list(s.stop)
+    if stream:
+        data["stream"] = True
+    return data
 
-async def _save_query(user: AuthedUser, prompt: str, response: str) -> None:
+async def _complete(data: dict) -> Tuple[int, str]:
+    """Jedan ne-stream poziv prema OpenRouteru → (status, answer ili tekst greške)."""
+    model = data["model"]
+    if not model_router.allow(model):
+        return 503, "circuit_open"
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
     try:
-        supabase.postgrest.auth(user.token)
-        supabase.table("queries").insert({
-            "user_id": user.id,
-            "prompt": prompt,
-            "response": response
-        }).execute()
-    except Exception:
-        pass
+        with tracing.phase("upstream", model):
+            r = await openrouter.get_client().post(
+                openrouter.OPENROUTER_URL, headers=_headers(), json=data, extensions=tracing.httpx_extensions(model))
+    except httpx.HTTPError:
+        model_router.record_error(model, 502)
+        metrics.openrouter_responses_total.labels(model, "502").inc()
+        raise
+    except asyncio.CancelledError:
+        model_router.abandon(model)
+        raise
+    metrics.openrouter_responses_total.labels(model, str(r.status_code)).inc()
+    if r.status_code != 200:
+        model_router.record_error(model, r.status_code)
+        return r.status_code, r.text
+    resp = r.json()
+    answer = (resp.get("choices") or [{}])[0].get("message", {}).get("content", "") or ""
+    duration, tokens = loop.time() - t0, estimate_tokens(answer)
+    model_router.record_success(model, duration, tokens)
+    _observe_generation(model, "query", duration, tokens)
+    return 200, answer
+
+def _observe_generation(model: str, mode: str, duration: float, tokens: int) -> None:
+    metrics.openrouter_generation_seconds.labels(model, mode).observe(duration)
+    if duration > 0 and tokens:
+        metrics.openrouter_tokens_per_second.labels(model, mode).observe(tokens / duration)
+
+def _cache_hit(kind: str, hit) -> None:
+    metrics.cache_lookups_total.labels(kind, "miss" if hit is None else "hit").inc()
+
+# gaugevi se čitaju iz stats() tek pri scrapeu
+metrics.registry.gauge("upstream_active", "Upstream pozivi u tijeku", lambda: upstream_scheduler.active)
+metrics.registry.gauge("upstream_queued", "Zahtjevi koji čekaju upstream slot", lambda: sum(upstream_scheduler.stats()["queued"].values()))
+metrics.registry.gauge("history_queue_depth", "History redovi u write-behind redu", lambda: history_writer.stats()["queued"])
+metrics.registry.gauge("history_spool_depth", "Nepotvrđeni redovi u spoolu", lambda: spool.stats()["depth"] if history_writer.spooled else 0)
+
+def _admit(user: AuthedUser, prompt: str, max_tokens: int, context_tokens: int = 0) -> int:
+    # budžet zahtjeva + procijenjenih tokena (kontekst + prompt + max odgovor); troši se samo kad ide prema upstreamu
+    tokens = context_tokens + estimate_tokens(prompt) + max_tokens
+    user_limiter.check(user.id, tokens)
+    return tokens  # za refund ako scheduler odbaci zahtjev
+
+def _resolve_model(requested: Optional[str]) -> str:
+    # "auto/fastest" → trenutno najbrži zdravi model; ostali nazivi prolaze nepromijenjeni
+    return model_router.resolve((requested or DEFAULT_MODEL).strip(), DEFAULT_MODEL)
+
+def _upstream_error(status: int, detail: str, model: str) -> JSONResponse:
+    headers = {"Retry-After": str(model_router.retry_after(model))} if detail == "circuit_open" else None
+    return JSONResponse(status_code=status, content={"error": "openrouter_error", "detail": detail}, headers=headers)
+
+async def _save_query(user: AuthedUser, prompt: str, response: str, conv: Optional[Conversation] = None,
+                      turn: Optional[Turn] = None) -> None:
+    # upis ide u pozadinski red (bulk insert), ne čeka se Supabase; "persist" je spool + enqueue
+    row = {
+        "user_id": user.id,
+        "prompt": prompt,
+        "response": response
+    }
+    if conv is not None and turn is not None:
+        # id i created_at turna su poznati prije upisa: granica summaryja ne čeka write-behind
+        row.update(conversation_id=conv.id, id=turn.id, created_at=turn.created_at)
+    with tracing.phase("persist"):
+        await history_writer.submit(user.token, row)
+
+async def _conversation(payload: PromptPayload, user: AuthedUser, s: Settings) -> Tuple[Optional[Conversation], Optional[List[dict]], int]:
+    """(razgovor, messages, tokeni konteksta); bez conversation_id običan jednokratni prompt."""
+    if not payload.conversation_id:
+        return None, None, 0
+    with tracing.phase("context"):
+        conv = await conversations.get(user, payload.conversation_id)
+        messages, context_tokens = conv.messages(s.system, payload.prompt)
+    return conv, messages, context_tokens
+
+async def _summarize(user_id: str, instructions: str, text: str) -> str:
+    # sažimanje starijih turnova ide u pozadini, najnižim prioritetom (kao batch)
+    data = {
+        "model": SUMMARY_MODEL,
+        "messages": [{"role": "system", "content": instructions}, {"role": "user", "content": text}],
+        "temperature": 0,
+        "max_tokens": SUMMARY_MAX_TOKENS,
+    }
+    async with upstream_scheduler.slot(user_id, BATCH, timeout=None):
+        status, answer = await _complete(data)
+    if status != 200:
+        raise RuntimeError(f"summary failed: {status}")
+    return answer
+
+@router.get("/models")
+async def list_models():
+    """Keširani OpenRouter katalog + trenutne EWMA ocjene i stanje breakera po modelu."""
+    catalog = await model_router.catalog(openrouter.get_client(), _headers())
+    return {**catalog, "aliases": sorted(ROUTER_ALIASES), "scores": model_router.snapshot()}
 
 @router.get("/health-check")
 def health_check():
     ok = bool(OPENROUTER_KEY)
-    return {"ok": ok, "provider": "openrouter", "default_model": DEFAULT_MODEL, "default_max_tokens": DEFAULT_MAX_TOKENS}
+    return {
+        "ok": ok, "provider": "openrouter", "default_model": DEFAULT_MODEL, "default_max_tokens": DEFAULT_MAX_TOKENS,
+        "history_writer": history_writer.stats(),
+        "delete_jobs": delete_jobs.stats(),
+        "search": search_index.stats(),
+        "auth_upstream": auth_upstream.stats(),
+        "cache": response_cache.stats(),
+        "neardup": neardup_index.stats(),
+        "hedging": hedger.stats(),
+        "router": model_router.snapshot(),
+        "admission": {"users": user_limiter.stats(), "upstream": upstream_scheduler.stats()},
+        "singleflight": {"query": query_flights.stats(), "stream": stream_flights.stats()},
+        "conversations": conversations.stats(),
+        "agents": agent_registry.stats(),
+    }
+
+def _cache_key(payload: PromptPayload, s: Settings) -> Optional[str]:
+    if payload.cache == "bypass" or not response_cache.cacheable(s.temperature):
+        return None
+    return cache_key(s.model, payload.prompt, s.system, s.temperature, s.max_tokens, s.stop)
+
+def _neardup_scope(s: Settings, user: AuthedUser):
+    owner = user.id if NEARDUP_SCOPE == "user" else "*"
+    return (s.model, s.system, s.temperature, s.max_tokens, s.stop, owner)
+
+def _neardup_lookup(payload: PromptPayload, s: Settings, user: AuthedUser):
+    if not NEARDUP_ENABLED:
+        return None
+    return neardup_index.lookup(_neardup_scope(s, user), payload.prompt)
+
+def _neardup_add(payload: PromptPayload, s: Settings, user: AuthedUser, answer: str) -> None:
+    if NEARDUP_ENABLED:
+        neardup_index.add(_neardup_scope(s, user), payload.prompt, answer, s.model)
+
+def _flight_key(kind: str, payload: PromptPayload, s: Settings, hedge: bool) -> Optional[str]:
+    if not SINGLEFLIGHT_ENABLED:
+        return None
+    # hedgani poziv može vratiti fallback model, pa ga ne dijeli s običnim (i obrnuto)
+    return kind + (":hedge:" if hedge else ":") + cache_key(s.model, payload.prompt, s.system, s.temperature, s.max_tokens, s.stop)
 
 @router.post("/query")
 async def ai_query(payload: PromptPayload, user: AuthedUser = Depends(get_current_user)):
     if not OPENROUTER_KEY:
         raise HTTPException(status_code=500, detail="Server nema OPENROUTER_API_KEY")
-    model = (payload.model or DEFAULT_MODEL).strip()
-    max_tokens = payload.max_tokens or DEFAULT_MAX_TOKENS
+    s = await _request_settings(payload, user)
+    model, max_tokens = s.model, s.max_tokens
+    conv, messages, context_tokens = await _conversation(payload, user, s)
+    # odgovor u razgovoru ovisi o kontekstu: bez cachea, near-dupa i dijeljenja poziva
+    key = _cache_key(payload, s) if conv is None else None
+    if key and payload.cache == "use":
+        hit = response_cache.get(key)
+        _cache_hit("response", hit)
+        if hit is not None:
+            await _save_query(user, payload.prompt, hit[0])
+            return {"answer": hit[0], "model": hit[1], "cached": True}
+        near = _neardup_lookup(payload, s, user)
+        if NEARDUP_ENABLED:
+            _cache_hit("neardup", near)
+        if near is not None:
+            await _save_query(user, payload.prompt, near[0])
+            return {"answer": near[0], "model": near[1], "cached": True, "approximate": True, "similarity": near[2]}
 
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": payload.prompt},
-        ],
-        "temperature": payload.temperature,
-        "max_tokens": max_tokens,  # <= ključna promjena
-    }
-    async with httpx.AsyncClient(timeout=60) as client:
-        r = await client.post("https://openrouter.ai/api/v1/chat/completions", headers=_headers(), json=data)
-    if r.status_code != 200:
-        return JSONResponse(status_code=r.status_code, content={"error": "openrouter_error", "detail": r.text})
-    resp = r.json()
-    answer = (resp.get("choices") or [{}])[0].get("message", {}).get("content", "") or ""
-    await _save_query(user, payload.prompt, answer)
-    return {"answer": answer, "model": model}
+    charged = _admit(user, payload.prompt, max_tokens, context_tokens)
+    hedge = payload.hedge if payload.hedge is not None else HEDGE_ENABLED
+
+    async def upstream(m: str) -> Tuple[int, str]:
+        return await _complete(_chat_body(m, payload.prompt, s, messages=messages))
+
+    async def call():
+        async with upstream_scheduler.slot(user.id, QUERY):
+            if hedge:
+                won, status, answer, hedged = await hedger.query(model, upstream)
+            else:
+                (status, answer), won, hedged = await upstream(model), model, False
+        if status != 200:
+            return won, status, answer, hedged
+        # cache ključ je vezan uz traženi model; odgovor fallback modela se ne kešira
+        if key and won == model:
+            response_cache.put(key, answer, model)
+            _neardup_add(payload, s, user, answer)
+        return won, 200, answer, hedged
+
+    # identični upiti u letu dijele jedan poziv; history red se i dalje sprema za svakog korisnika.
+    # Slot u scheduleru traži samo leader: ako je on odbačen (429), isti 429 dobiju i svi pridruženi —
+    # poziv nije otišao upstreamu ni za koga, pa svatko dobiva natrag svoj budžet (svaki je prošao vlastiti _admit).
+    fkey = _flight_key("query", payload, s, hedge) if conv is None else None
+    try:
+        won, status, answer, hedged = await (query_flights.run(fkey, call) if fkey else call())
+    except HTTPException as e:
+        if e.status_code == 429:
+            user_limiter.refund(user.id, charged)
+        raise
+    if status != 200:
+        return _upstream_error(status, answer, won)
+    if conv is not None:
+        turn = conversations.record(conv, payload.prompt, answer, _summarize)
+        await _save_query(user, payload.prompt, answer, conv, turn)
+        extra = {"conversation_id": conv.id, "context_tokens": context_tokens}
+    else:
+        await _save_query(user, payload.prompt, answer)
+        extra = {}
+    if hedge:
+        return {"answer": answer, "model": won, "requested_model": model, "hedged": hedged, **extra}
+    return {"answer": answer, "model": won, **extra}
+
+def _sse(sess: StreamSession, after: int = 0):
+    async def gen():
+        async for seq, event, data in sess.subscribe(after):
+            yield {"id": event_id(sess, seq), "event": event, "data": data}
+    return EventSourceResponse(gen(), media_type="text/event-stream")
+
+async def _replay(user: AuthedUser, prompt: str, answer: str, meta: dict):
+    # gotov odgovor (cache) se servira kao obični stream: isti eventi, bez upstreama
+    sess = stream_registry.create(user.id)
+    sess.publish("stream", json.dumps({"stream_id": sess.id, **meta}))
+    for text in streaming.replay_chunks(answer):
+        sess.publish("token", json.dumps({"token": text}), text)
+    await _save_query(user, prompt, answer)
+    sess.publish("end", "{}")
+    sess.finish()
+    return _sse(sess)
 
 @router.post("/stream")
-async def ai_stream(payload: PromptPayload, user: AuthedUser = Depends(get_current_user)):
+async def ai_stream(payload: PromptPayload, request: Request, user: AuthedUser = Depends(get_current_user)):
     if not OPENROUTER_KEY:
         raise HTTPException(status_code=500, detail="Server nema OPENROUTER_API_KEY")
-    model = (payload.model or DEFAULT_MODEL).strip()
-    max_tokens = payload.max_tokens or DEFAULT_MAX_TOKENS
+    # reconnect: replay propuštenih eventa pa nastavak na generaciju koja još traje
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        sess, after = stream_registry.resume(last_event_id, user.id)
+        if sess is not None:
+            return _sse(sess, after)
+    s = await _request_settings(payload, user)
+    model, max_tokens = s.model, s.max_tokens
+    conv, messages, context_tokens = await _conversation(payload, user, s)
+    key = _cache_key(payload, s) if conv is None else None
+    if key and payload.cache == "use":
+        hit = response_cache.get(key)
+        _cache_hit("response", hit)
+        if hit is not None:
+            return await _replay(user, payload.prompt, hit[0], {"cached": True})
+        near = _neardup_lookup(payload, s, user)
+        if NEARDUP_ENABLED:
+            _cache_hit("neardup", near)
+        if near is not None:
+            return await _replay(user, payload.prompt, near[0], {"cached": True, "approximate": True, "similarity": near[2]})
 
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": payload.prompt},
-        ],
-        "temperature": payload.temperature,
-        "max_tokens": max_tokens,   # <= i u streamu
-        "stream": True,
-    }
+    hedge = payload.hedge if payload.hedge is not None else HEDGE_ENABLED
+    # isti stream već teče: pretplata od početka (replay) pa uživo
+    fkey = _flight_key("stream", payload, s, hedge) if conv is None else None
+    if fkey:
+        sess = stream_flights.join(fkey, user)
+        if sess is not None:
+            return _sse(sess)
 
-    async def event_gen():
-        collected = ""
-        async with httpx.AsyncClient(timeout=None) as client:
-            async with client.stream("POST", "https://openrouter.ai/api/v1/chat/completions", headers=_headers(), json=data) as r:
+    # prije otvaranja SSE-a, da preopterećenje bude pravi 429 a ne error event
+    charged = _admit(user, payload.prompt, max_tokens, context_tokens)
+    try:
+        await upstream_scheduler.acquire(user.id, STREAM)
+    except BaseException:
+        user_limiter.refund(user.id, charged)  # shed / odustao u redu: ništa nije otišlo upstreamu
+        raise
+    slot_t0 = time.monotonic()
+
+    async def upstream_tokens(m: str):
+        if not model_router.allow(m):
+            raise streaming.UpstreamError(503, "circuit_open")
+        data = _chat_body(m, payload.prompt, s, stream=True, messages=messages)
+        loop = asyncio.get_running_loop()
+        t0, ttft, chars, recorded = loop.time(), None, 0, False
+        try:
+            async with openrouter.get_client().stream("POST", openrouter.OPENROUTER_URL, headers=_headers(), json=data,
+                                                      extensions=tracing.httpx_extensions(m)) as r:
+                metrics.openrouter_responses_total.labels(m, str(r.status_code)).inc()
                 if r.status_code != 200:
-                    yield {"event": "error", "data": json.dumps({"error": await r.aread().decode()})}
-                    return
-                async for line in r.aiter_lines():
-                    if not line or not line.startswith("data:"):
-                        continue
-                    chunk = line[5:].strip()
-                    if chunk == "[DONE]":
-                        await _save_query(user, payload.prompt, collected)
-                        yield {"event": "end", "data": "{}"}
-                        break
-                    try:
-                        part = json.loads(chunk)
-                        delta = ((part.get("choices") or [{}])[0].get("delta") or {}).get("content")
-                        if delta:
-                            collected += delta
-                            yield {"event": "token", "data": json.dumps({"token": delta})}
-                    except Exception:
-                        continue
-    return EventSourceResponse(event_gen(), media_type="text/event-stream")
-
-@router.get("/history")
-def history_list(user: AuthedUser = Depends(get_current_user)):
-    supabase.postgrest.auth(user.token)
-    res = supabase.table("queries").select("*").eq("user_id", user.id).order("created_at", desc=True).execute()
-    return {"items": res.data or []}
-
-@router.delete("/history")
-def history_delete_all(user: AuthedUser = Depends(get_current_user)):
-    supabase.postgrest.auth(user.token)
-    supabase.table("queries").delete().eq("user_id", user.id).execute()
-    return {"deleted": "all"}
-
-@router.delete("/history/{row_id}")
-def history_delete_one(row_id: str, user: AuthedUser = Depends(get_current_user)):
-    supabase.postgrest.auth(user.token)
-    supabase.table("queries").delete().eq("id", row_id).eq("user_id", user.id).execute()
-    return {"deleted": row_id}
-
-@router.get("/history/export.json")
-def history_export_json(user: AuthedUser = Depends(get_current_user)):
-    supabase.postgrest.auth(user.token)
-    res = (
-        supabase.table("queries")
-        .select("id,prompt,response,created_at")
-        .eq("user_id", user.id)
-        .order("created_at", desc=True)
-        .execute()
-    )
-    return JSONResponse(
-        content=(res.data or []),
-        headers={"Content-Disposition": "attachment; filename=history.json"},
-        media_type="application/json",
-    )
+                    raise streaming.UpstreamError(r.status_code, (await r.aread()).decode())
+                deltas = streaming.UpstreamDeltas(r)
+                async for text in streaming.coalesce(deltas):
+                    if ttft is None:
+                        ttft = loop.time() - t0
+                    chars += len(text)
+                    yield text
+                if not deltas.done:
+                    raise streaming.UpstreamError(502, "upstream stream ended without [DONE]")
+            # metrike tek na kraju streama: petlja po tokenima samo broji znakove
+            duration = loop.time() - t0
+            model_router.record_success(m, duration, chars // 4, ttft)
+            recorded = True
+            if ttft is not None:
+                metrics.openrouter_ttft_seconds.labels(m).observe(ttft)
+                tracing.add("ttft", ttft, m)
+            tracing.add("generation", duration, m)
+            _observe_generation(m, "stream", duration, chars // 4)
+        except streaming.UpstreamError as e:
+            model_router.record_error(m, e.status)
+            recorded = True
+            raise
+        except httpx.HTTPError:
+            model_router.record_error(m, 502)
+            metrics.openrouter_responses_total.labels(m, "502").inc()
+            recorded = True
+            raise
+        finally:
+            if not recorded:
+                model_router.abandon(m)
 
-@router.get("/history/export.csv")
-def history_export_csv(user: AuthedUser = Depends(get_current_user)):
-    supabase.postgrest.auth(user.token)
-    res = (
-        supabase.table("queries")
-        .select("id,prompt,response,created_at")
-        .eq("user_id", user.id)
-        .order("created_at", desc=True)
-        .execute()
-    )
-    rows = res.data or []
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["id", "created_at", "prompt", "response"])
-    for r in rows:
-        writer.writerow([r.get("id",""), r.get("created_at",""), r.get("prompt",""), r.get("response","")])
-    return Response(
-        content=buf.getvalue().encode("utf-8"),
-        headers={"Content-Disposition": "attachment; filename=history.csv"},
-        media_type="text/csv; charset=utf-8",
-    )
+    async def produce(sess: StreamSession):
+        # generacija živi neovisno o konekciji; bez slušatelja se otkazuje nakon STREAM_RESUME_GRACE
+        won, hedged = model, False
+        try:
+            if hedge:
+                won, tokens, hedged = await hedger.stream(model, upstream_tokens)
+            else:
+                tokens = upstream_tokens(model)
+            async for text in tokens:
+                sess.publish("token", json.dumps({"token": text}), text)
+        except streaming.UpstreamError as e:
+            sess.publish("error", json.dumps({"error": e.detail, "status": e.status}))
+            return
+        except Exception as e:
+            sess.publish("error", json.dumps({"error": str(e)}))
+            return
+        finally:
+            users = stream_flights.release(fkey, sess) if fkey else [user]
+        if key and won == model:
+            response_cache.put(key, sess.text(), model)
+            _neardup_add(payload, s, user, sess.text())
+        turn = conversations.record(conv, payload.prompt, sess.text(), _summarize) if conv is not None else None
+        for u in users:
+            await _save_query(u, payload.prompt, sess.text(), conv, turn)
+        sess.publish("end", json.dumps({"model": won, "requested_model": model, "hedged": hedged}) if hedge else "{}")
+
+    trace = tracing.current()
+
+    async def produce_traced(sess: StreamSession):
+        # zaglavlje ima samo faze do otvaranja streama; ostatak ide kao zadnji SSE event
+        try:
+            await produce(sess)
+        finally:
+            if trace is not None:
+                if tracing.SERVER_TIMING:
+                    sess.publish("timing", json.dumps(trace.summary()))
+                trace.close()
+
+    sess = stream_registry.create(user.id)
+    meta = {"stream_id": sess.id}
+    if conv is not None:
+        meta.update(conversation_id=conv.id, context_tokens=context_tokens)
+    sess.publish("stream", json.dumps(meta))
+    if fkey:
+        stream_flights.lead(fkey, sess, user)
+    if trace is not None:
+        trace.deferred = True
+    sess.start(produce_traced)
+    # slot se drži dok generacija traje (i kad klijent ode pa se čeka resume)
+    sess.task.add_done_callback(lambda _: upstream_scheduler.release(time.monotonic() - slot_t0))
+    sess.task.add_done_callback(lambda _: metrics.sse_frames_per_stream.observe(sess.seq))
+    return _sse(sess)
+
+@router.post("/conversations")
+async def conversation_create(user: AuthedUser = Depends(get_current_user)):
+    """Novi razgovor; njegov id ide u `conversation_id` od /ai/query i /ai/stream."""
+    conv = await conversations.create(user)
+    return {"conversation_id": conv.id}
+
+@router.get("/conversations/{conversation_id}")
+async def conversation_get(conversation_id: str, user: AuthedUser = Depends(get_current_user)):
+    """Rolling summary + turnovi koji još nisu sažeti (ono što ide u kontekst)."""
+    conv = await conversations.get(user, conversation_id)
+    return conv.info()
+
+@router.get("/stream/{stream_id}")
+async def ai_stream_resume(stream_id: str, request: Request, last_event_id: Optional[str] = None,
+                           user: AuthedUser = Depends(get_current_user)):
+    sess = stream_registry.get(stream_id, user.id)
+    if sess is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    _, after = stream_registry.resume(request.headers.get("last-event-id") or last_event_id or f"{stream_id}:0", user.id)
+    return _sse(sess, after)
+
+class BatchItem(BaseModel):
+    prompt: str = Field(..., min_length=1)
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
+    model: Optional[str] = None
+    max_tokens: Optional[int] = Field(None, ge=32, le=4096)
+
+class BatchPayload(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    # zadane vrijednosti za iteme koji ih ne navode
+    model: Optional[str] = None
+    temperature: Optional[float] = Field(None, ge=0.0, le=1.0)
+    max_tokens: Optional[int] = Field(None, ge=32, le=4096)
+    agent_id: Optional[str] = None
+    variables: Optional[Dict[str, str]] = None
+    concurrency: Optional[int] = Field(None, ge=1, description="paralelni pozivi, najviše BATCH_CONCURRENCY")
+    save: bool = True
+
+@router.post("/batch")
+async def ai_batch(payload: BatchPayload, user: AuthedUser = Depends(get_current_user), sb: ScopedPostgrest = Depends(get_db)):
+    """
+    Više prompta odjednom. Rezultati idu kao NDJSON redom završetka, svaki s
+    `index` ulaza; greška jednog itema ne prekida batch. History se sprema
+    jednim bulk insertom po BATCH_PERSIST_CHUNK uspješnih rezultata.
+    """
+    if not OPENROUTER_KEY:
+        raise HTTPException(status_code=500, detail="Server nema OPENROUTER_API_KEY")
+    user_limiter.check(user.id)  # cijeli batch je jedan zahtjev; tokeni se troše po itemu (vidi run_item)
+    workers_n = min(payload.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY, len(payload.items))
+    agent = await agent_registry.resolve(user, payload.agent_id)
+    agent.system_prompt(payload.variables)  # nedostajuće varijable → 422 prije streama
+
+    async def run_item(i: int, item: BatchItem) -> dict:
+        s = _settings(agent, payload.variables, item.model or payload.model,
+                      item.temperature if item.temperature is not None else payload.temperature,
+                      item.max_tokens or payload.max_tokens)
+        model = s.model
+        key = cache_key(model, item.prompt, s.system, s.temperature, s.max_tokens, s.stop) if response_cache.cacheable(s.temperature) else None
+        hit = response_cache.get(key) if key else None
+        if key:
+            _cache_hit("response", hit)
+        if hit is not None:
+            return {"index": i, "answer": hit[0], "model": hit[1], "cached": True}
+        try:
+            # isti TPM budžet kao /ai/query; batch čeka na bucket i slot umjesto da bude odbijen
+            await user_limiter.wait(user.id, estimate_tokens(item.prompt) + s.max_tokens)
+            async with upstream_scheduler.slot(user.id, BATCH, timeout=None):
+                status, answer = await _complete(_chat_body(model, item.prompt, s))
+        except Exception as e:
+            return {"index": i, "error": "upstream_error", "detail": str(e)}
+        if status != 200:
+            return {"index": i, "error": "openrouter_error", "status": status, "detail": answer}
+        if key:
+            response_cache.put(key, answer, model)
+        return {"index": i, "answer": answer, "model": model}
+
+    async def results():
+        queue: asyncio.Queue = asyncio.Queue()
+        todo = iter(enumerate(payload.items))  # dijeljeni iterator: svaki worker uzima sljedeći item
+
+        async def worker():
+            for i, item in todo:
+                try:
+                    res = await run_item(i, item)
+                except Exception as e:
+                    res = {"index": i, "error": "internal_error", "detail": str(e)}
+                queue.put_nowait(res)
+
+        workers = [asyncio.create_task(worker()) for _ in range(workers_n)]
+        rows: List[dict] = []
+        ok = errors = saved = save_failed = 0
+
+        async def persist():
+            nonlocal saved, save_failed, rows
+            chunk, rows = rows, []
+            if not chunk:
+                return
+            t0 = time.perf_counter()
+            try:
+                res = await sb.table("queries").insert(chunk).execute()
+                saved += len(chunk)
+            except Exception:
+                save_failed += len(chunk)
+                metrics.history_writes_dropped_total.labels("batch_insert_failed").inc(len(chunk))
+                return
+            finally:
+                metrics.supabase_insert_seconds.labels("batch").observe(time.perf_counter() - t0)
+            await search_index.add(res.data or [])
+
+        try:
+            for _ in range(len(payload.items)):
+                res = await queue.get()
+                if "error" in res:
+                    errors += 1
+                else:
+                    ok += 1
+                    if payload.save:
+                        rows.append({"user_id": user.id, "prompt": payload.items[res["index"]].prompt, "response": res["answer"]})
+                yield json.dumps(res) + "\n"
+                if len(rows) >= BATCH_PERSIST_CHUNK:
+                    await persist()
+            await persist()
+            yield json.dumps({"done": True, "total": len(payload.items), "ok": ok, "errors": errors,
+                              "saved": saved, "save_failed": save_failed}) + "\n"
+        finally:
+            # i kad se klijent odspoji usred batcha
+            for w in workers:
+                w.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# /history rute žive u app/history.py (jedna implementacija), ovdje se samo montiraju pod /ai
+router.include_router(history.router)
@@ -0,0 +1,217 @@
+# app/metrics.py — Prometheus tekst format bez vanjskih ovisnosti: countere, histogrami, gaugevi iz stats()
+#
+# Sve živi u jednom event loopu po workeru pa nema lockova; svaki worker
+# izlaže svoje brojeve (Prometheus ih zbraja po instance labeli). Na hot
+# pathu nema alokacija: child po labelama se kešira, observe je bisect + dva
+# inkrementa, a per-token brojanje radi pozivatelj u lokalnoj varijabli.
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import time
+
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TPS_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320, 640)
+FRAME_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    inner = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + inner + "}"
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # zadnji = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not labels:
+            self._default = self._new()
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new()
+        return child
+
+    def _items(self):
+        if not self.label_names:
+            return [((), self._default)]
+        return list(self._children.items())
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, n: float = 1) -> None:
+        self._default.inc(n)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for values, child in self._items():
+            yield f"{self.name}{_labels(self.label_names, values)} {_num(child.value)}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, v: float) -> None:
+        self._default.observe(v)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        names = self.label_names + ("le",)
+        for values, child in self._items():
+            acc = 0
+            for bound, n in zip(self.bounds + (float("inf"),), child.counts):
+                acc += n
+                le = "+Inf" if bound == float("inf") else _num(bound)
+                yield f"{self.name}_bucket{_labels(names, values + (le,))} {acc}"
+            base = _labels(self.label_names, values)
+            yield f"{self.name}_sum{base} {_num(child.sum)}"
+            yield f"{self.name}_count{base} {child.count}"
+
+class Gauge(_Metric):
+    """Vrijednost se čita tek pri scrapeu iz callbacka (npr. stats() singletona)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        super().__init__(name, help)
+        self.fn = fn
+
+    def _new(self):
+        return None
+
+    def render(self) -> Iterable[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield from super().render()
+        yield f"{self.name} {_num(value or 0)}"
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help, fn))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# --- metrike ---
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Trajanje HTTP zahtjeva do odgovora (zaglavlja)", ("route", "method", "status"))
+openrouter_ttft_seconds = registry.histogram(
+    "openrouter_ttft_seconds", "Vrijeme do prvog tokena (stream)", ("model",))
+openrouter_generation_seconds = registry.histogram(
+    "openrouter_generation_seconds", "Ukupno trajanje generacije", ("model", "mode"))
+openrouter_tokens_per_second = registry.histogram(
+    "openrouter_tokens_per_second", "Procijenjeni tokeni u sekundi", ("model", "mode"), TPS_BUCKETS)
+openrouter_responses_total = registry.counter(
+    "openrouter_responses_total", "Upstream odgovori po modelu i statusu", ("model", "status"))
+supabase_auth_seconds = registry.histogram(
+    "supabase_auth_seconds", "Validacija JWT-a", ("method",))
+supabase_insert_seconds = registry.histogram(
+    "supabase_insert_seconds", "Bulk insert u queries", ("source",))
+sse_frames_per_stream = registry.histogram(
+    "sse_frames_per_stream", "SSE frameova po generiranom streamu", (), FRAME_BUCKETS)
+cache_lookups_total = registry.counter(
+    "cache_lookups_total", "Cache pogoci / promašaji", ("cache", "result"))
+history_writes_dropped_total = registry.counter(
+    "history_writes_dropped_total", "History redovi koji nisu upisani (drop ili dead-letter)", ("reason",))
+
+# --- instrumentacija ruta ---
+
+class TimedRoute(APIRoute):
+    """route_class za APIRouter: latencija po predlošku rute (ne po stvarnom pathu → ograničen broj serija)."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def timed(request: Request):
+            t0 = time.perf_counter()
+            status = "500"
+            try:
+                response = await handler(request)
+                status = str(response.status_code)
+                return response
+            except Exception as e:
+                status = str(getattr(e, "status_code", 500))
+                raise
+            finally:
+                http_request_seconds.labels(route, request.method, status).observe(time.perf_counter() - t0)
+
+        return timed
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,176 @@
+# app/model_router.py — EWMA statistika po modelu, circuit breaker, "auto/fastest" routing i keširani katalog modela
+from typing import Dict, List, Optional
+import asyncio, os, time
+
+ROUTER_ALIASES = {a.strip() for a in os.getenv("ROUTER_ALIASES", "auto/fastest").split(",") if a.strip()}
+ROUTER_MODELS = [m.strip() for m in os.getenv(
+    "ROUTER_MODELS",
+    "meta-llama/llama-3.1-8b-instruct:free,qwen/qwen-2.5-7b-instruct:free,google/gemma-7b-it:free",
+).split(",") if m.strip()]
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_REF_TOKENS = int(os.getenv("ROUTER_REF_TOKENS", "256"))  # tipična duljina odgovora za score
+ROUTER_UNKNOWN_SCORE = float(os.getenv("ROUTER_UNKNOWN_SCORE", "5"))  # s, za model bez uzoraka
+ROUTER_BREAKER_THRESHOLD = int(os.getenv("ROUTER_BREAKER_THRESHOLD", "5"))  # uzastopne 429/5xx
+ROUTER_BREAKER_COOLDOWN = float(os.getenv("ROUTER_BREAKER_COOLDOWN", "30"))
+ROUTER_CATALOG_URL = os.getenv("ROUTER_CATALOG_URL", "https://openrouter.ai/api/v1/models")
+ROUTER_CATALOG_TTL = float(os.getenv("ROUTER_CATALOG_TTL", "3600"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+def estimate_tokens(text: str) -> int:
+    # brza lokalna procjena (~4 znaka po tokenu), bez tokenizera
+    return max(1, len(text) // 4) if text else 0
+
+class ModelStats:
+    __slots__ = ("ttft", "tps", "err", "samples", "failures", "state", "opened_at", "trial")
+
+    def __init__(self) -> None:
+        self.ttft: Optional[float] = None
+        self.tps: Optional[float] = None
+        self.err = 0.0
+        self.samples = 0
+        self.failures = 0  # uzastopne
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial = False
+
+def _ewma(old: Optional[float], new: float) -> float:
+    return new if old is None else old + ROUTER_EWMA_ALPHA * (new - old)
+
+class ModelRouter:
+    def __init__(self) -> None:
+        self._stats: Dict[str, ModelStats] = {}
+        self._catalog: List[dict] = []
+        self._catalog_at: Optional[float] = None
+        self._catalog_lock = asyncio.Lock()
+
+    def _get(self, model: str) -> ModelStats:
+        st = self._stats.get(model)
+        if st is None:
+            st = self._stats[model] = ModelStats()
+        return st
+
+    # --- mjerenja ---
+    def record_success(self, model: str, duration: float, tokens: int, ttft: Optional[float] = None) -> None:
+        """`ttft` je poznat samo za stream; za ne-stream pozive tps uključuje i čekanje (konzervativno)."""
+        st = self._get(model)
+        if ttft is not None:
+            st.ttft = _ewma(st.ttft, ttft)
+        gen = max(duration - (ttft or 0.0), 1e-3)
+        if tokens:
+            st.tps = _ewma(st.tps, tokens / gen)
+        st.err = _ewma(st.err, 0.0)
+        st.samples += 1
+        st.failures = 0
+        st.state, st.trial = CLOSED, False
+
+    def record_error(self, model: str, status: int) -> None:
+        st = self._get(model)
+        st.err = _ewma(st.err, 1.0)
+        st.samples += 1
+        counts = status == 429 or status >= 500
+        if counts:
+            st.failures += 1
+        if st.state == HALF_OPEN:
+            # svaki ishod probe razrješava breaker: 4xx znači da je model živ (zatvori), 429/5xx ga ponovo otvara
+            if counts:
+                st.state, st.opened_at = OPEN, time.monotonic()
+            else:
+                st.state, st.failures = CLOSED, 0
+        elif counts and st.failures >= ROUTER_BREAKER_THRESHOLD:
+            st.state, st.opened_at = OPEN, time.monotonic()
+        st.trial = False
+
+    # --- circuit breaker ---
+    def allow(self, model: str) -> bool:
+        """False dok je breaker otvoren; nakon cooldowna pušta jedan probni zahtjev (half-open)."""
+        st = self._stats.get(model)
+        if st is None or st.state == CLOSED:
+            return True
+        if st.state == OPEN:
+            if time.monotonic() - st.opened_at < ROUTER_BREAKER_COOLDOWN:
+                return False
+            st.state = HALF_OPEN
+        if st.trial:
+            return False
+        st.trial = True
+        return True
+
+    def abandon(self, model: str) -> None:
+        # probni zahtjev je otkazan bez ishoda (klijent otišao, hedge izgubio) → sljedeći smije probati
+        st = self._stats.get(model)
+        if st is not None and st.state == HALF_OPEN:
+            st.trial = False
+
+    def healthy(self, model: str) -> bool:
+        st = self._stats.get(model)
+        return st is None or st.state == CLOSED or (
+            st.state == OPEN and time.monotonic() - st.opened_at >= ROUTER_BREAKER_COOLDOWN
+        )
+
+    def retry_after(self, model: str) -> int:
+        st = self._stats.get(model)
+        if st is None or st.state != OPEN:
+            return 1
+        return max(1, int(ROUTER_BREAKER_COOLDOWN - (time.monotonic() - st.opened_at)) + 1)
+
+    # --- routing ---
+    def score(self, model: str) -> float:
+        """Očekivano vrijeme za tipičan odgovor (s), uvećano za stopu grešaka. Manje = bolje."""
+        st = self._stats.get(model)
+        if st is None or (st.ttft is None and st.tps is None):
+            return ROUTER_UNKNOWN_SCORE * (1 + 4 * (st.err if st else 0.0))
+        gen = ROUTER_REF_TOKENS / st.tps if st.tps else ROUTER_UNKNOWN_SCORE
+        return ((st.ttft or 0.0) + gen) * (1 + 4 * st.err)
+
+    def resolve(self, model: str, default: str) -> str:
+        if model not in ROUTER_ALIASES:
+            return model
+        candidates = [m for m in ROUTER_MODELS if self.healthy(m)]
+        if not candidates:
+            return default
+        return min(candidates, key=self.score)
+
+    def snapshot(self) -> dict:
+        out = {}
+        for m in sorted(set(ROUTER_MODELS) | set(self._stats)):
+            st = self._stats.get(m) or ModelStats()
+            out[m] = {
+                "score": round(self.score(m), 3),
+                "ttft_ewma": round(st.ttft, 3) if st.ttft is not None else None,
+                "tokens_per_sec_ewma": round(st.tps, 1) if st.tps is not None else None,
+                "error_rate_ewma": round(st.err, 3),
+                "samples": st.samples,
+                "breaker": st.state,
+            }
+        return out
+
+    # --- katalog ---
+    async def catalog(self, client, headers: dict) -> dict:
+        """Katalog s OpenRoutera, keširan ROUTER_CATALOG_TTL; zastarjeli se vraća ako osvježavanje ne uspije."""
+        if self._catalog_stale():
+            async with self._catalog_lock:
+                if self._catalog_stale():
+                    try:
+                        r = await client.get(ROUTER_CATALOG_URL, headers=headers)
+                        r.raise_for_status()
+                        self._catalog = [
+                            {
+                                "id": m.get("id"),
+                                "name": m.get("name"),
+                                "context_length": m.get("context_length"),
+                                "pricing": m.get("pricing"),
+                            }
+                            for m in r.json().get("data", [])
+                        ]
+                        self._catalog_at = time.monotonic()
+                    except Exception:
+                        # zadrži stari katalog i probaj ponovno za ~30 s, ne na svaki zahtjev
+                        self._catalog_at = time.monotonic() - ROUTER_CATALOG_TTL + min(30.0, ROUTER_CATALOG_TTL)
+        age = time.monotonic() - self._catalog_at if self._catalog else None
+        return {"models": self._catalog, "age_s": round(age, 1) if age is not None else None}
+
+    def _catalog_stale(self) -> bool:
+        return self._catalog_at is None or time.monotonic() - self._catalog_at >= ROUTER_CATALOG_TTL
+
+model_router = ModelRouter()
@@ -0,0 +1,143 @@
+# app/neardup.py — near-duplicate cache prompta: shingle → MinHash potpis → LSH (sve lokalno, bez embeddinga)
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+import os, random, re, time, zlib
+
+NEARDUP_ENABLED = os.getenv("NEARDUP_ENABLED", "0") == "1"
+NEARDUP_THRESHOLD = float(os.getenv("NEARDUP_THRESHOLD", "0.85"))  # procijenjena Jaccard sličnost
+NEARDUP_SCOPE = os.getenv("NEARDUP_SCOPE", "user")  # "user" | "global"
+NEARDUP_MAX_ENTRIES = int(os.getenv("NEARDUP_MAX_ENTRIES", "20000"))
+NEARDUP_TTL = float(os.getenv("NEARDUP_TTL", "3600"))
+NEARDUP_NUM_PERM = int(os.getenv("NEARDUP_NUM_PERM", "64"))
+NEARDUP_BANDS = int(os.getenv("NEARDUP_BANDS", "16"))
+NEARDUP_SHINGLE = int(os.getenv("NEARDUP_SHINGLE", "4"))  # znakova po shingleu
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+
+def normalize(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+def shingles(text: str, k: int = NEARDUP_SHINGLE) -> Set[int]:
+    t = normalize(text)
+    if len(t) <= k:
+        return {zlib.crc32(t.encode("utf-8"))}
+    return {zlib.crc32(t[i:i + k].encode("utf-8")) for i in range(len(t) - k + 1)}
+
+class MinHasher:
+    def __init__(self, num_perm: int = NEARDUP_NUM_PERM, seed: int = 1) -> None:
+        # fiksni seed: potpisi su usporedivi i između procesa (offline alat)
+        rnd = random.Random(seed)
+        self.perms = [(rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, hs: Set[int]) -> Tuple[int, ...]:
+        return tuple(min(((a * h + b) % _PRIME) & _MASK for h in hs) for a, b in self.perms)
+
+def similarity(s1: Tuple[int, ...], s2: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(s1, s2) if x == y) / len(s1)
+
+class NearDupIndex:
+    """
+    LSH indeks po scopeu (npr. model + korisnik). Kandidati dolaze iz LSH
+    bucketa, a pogodak je najsličniji kandidat iznad praga. LRU + TTL, max N unosa.
+    """
+
+    def __init__(
+        self,
+        threshold: float = NEARDUP_THRESHOLD,
+        max_entries: int = NEARDUP_MAX_ENTRIES,
+        ttl: float = NEARDUP_TTL,
+        num_perm: int = NEARDUP_NUM_PERM,
+        bands: int = NEARDUP_BANDS,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("NEARDUP_NUM_PERM mora biti djeljiv s NEARDUP_BANDS")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        # id -> (scope, signature, answer, model, expires_at)
+        self._entries: "OrderedDict[int, Tuple[Hashable, Tuple[int, ...], str, str, float]]" = OrderedDict()
+        self._buckets: Dict[Tuple[Hashable, int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _bands(self, sig: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        r = self.rows
+        return [(i, sig[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def signature(self, prompt: str) -> Tuple[int, ...]:
+        return self.hasher.signature(shingles(prompt))
+
+    def lookup(self, scope: Hashable, prompt: str, sig: Optional[Tuple[int, ...]] = None) -> Optional[Tuple[str, str, float]]:
+        """Vraća (answer, model, similarity) ili None."""
+        sig = sig or self.signature(prompt)
+        now = time.monotonic()
+        candidates: Set[int] = set()
+        for band in self._bands(sig):
+            candidates |= self._buckets.get((scope, *band), set())
+        best, best_sim = None, self.threshold
+        for eid in candidates:
+            entry = self._entries.get(eid)
+            if entry is None:
+                continue
+            if entry[4] <= now:
+                self._remove(eid)
+                continue
+            sim = similarity(sig, entry[1])
+            if sim >= best_sim:
+                best, best_sim = eid, sim
+        if best is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best)
+        self.hits += 1
+        entry = self._entries[best]
+        return entry[2], entry[3], best_sim
+
+    def add(self, scope: Hashable, prompt: str, answer: str, model: str, sig: Optional[Tuple[int, ...]] = None) -> None:
+        if not answer:
+            return
+        sig = sig or self.signature(prompt)
+        eid = self._next_id
+        self._next_id += 1
+        self._entries[eid] = (scope, sig, answer, model, time.monotonic() + self.ttl)
+        for band in self._bands(sig):
+            self._buckets.setdefault((scope, *band), set()).add(eid)
+        while len(self._entries) > self.max_entries:
+            old, _ = next(iter(self._entries.items()))
+            self._remove(old)
+            self.evictions += 1
+
+    def _remove(self, eid: int) -> None:
+        entry = self._entries.pop(eid, None)
+        if entry is None:
+            return
+        scope, sig = entry[0], entry[1]
+        for band in self._bands(sig):
+            key = (scope, *band)
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(eid)
+                if not bucket:
+                    del self._buckets[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": NEARDUP_ENABLED,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "scope": NEARDUP_SCOPE,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+neardup_index = NearDupIndex()
@@ -0,0 +1,56 @@
+# app/openrouter.py — jedan dijeljeni (pooled) httpx klijent za OpenRouter, vezan uz lifespan
+from contextlib import asynccontextmanager
+from typing import Optional
+import os
+
+import httpx
+
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")  # bench: lokalni mock
+
+OR_MAX_CONNECTIONS = int(os.getenv("OR_MAX_CONNECTIONS", "100"))
+OR_MAX_KEEPALIVE = int(os.getenv("OR_MAX_KEEPALIVE", "20"))
+OR_KEEPALIVE_EXPIRY = float(os.getenv("OR_KEEPALIVE_EXPIRY", "30"))
+OR_HTTP2 = os.getenv("OR_HTTP2", "0") == "1"
+OR_CONNECT_TIMEOUT = float(os.getenv("OR_CONNECT_TIMEOUT", "5"))
+OR_READ_TIMEOUT = float(os.getenv("OR_READ_TIMEOUT", "60"))  # za stream: max pauza između chunkova
+OR_POOL_TIMEOUT = float(os.getenv("OR_POOL_TIMEOUT", "10"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("OpenRouter klijent nije pokrenut (lifespan nije aktivan)")
+    return _client
+
+async def startup() -> None:
+    global _client
+    if _client is not None:
+        return
+    _client = httpx.AsyncClient(
+        http2=OR_HTTP2,
+        limits=httpx.Limits(
+            max_connections=OR_MAX_CONNECTIONS,
+            max_keepalive_connections=OR_MAX_KEEPALIVE,
+            keepalive_expiry=OR_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=OR_CONNECT_TIMEOUT,
+            read=OR_READ_TIMEOUT,
+            write=OR_CONNECT_TIMEOUT,
+            pool=OR_POOL_TIMEOUT,
+        ),
+    )
+
+async def shutdown() -> None:
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+@asynccontextmanager
+async def lifespan(app):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
@@ -0,0 +1,133 @@
+# app/resume.py — nastavljivi /ai/stream: id po streamu, seq po eventu, ring buffer za replay (Last-Event-ID)
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+import asyncio, json, os, time, uuid
+
+STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "2048"))  # eventi po streamu
+STREAM_REPLAY_TTL = float(os.getenv("STREAM_REPLAY_TTL", "120"))  # koliko dugo završeni stream čeka reconnect
+STREAM_REPLAY_MAX_STREAMS = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", "1000"))
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "10"))  # bez slušatelja → cancel upstreama nakon N s
+
+_Event = Tuple[int, str, str]  # (seq, event, data)
+
+class StreamSession:
+    def __init__(self, user_id: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.user_ids = {user_id}  # više korisnika kad se stream dijeli (single-flight)
+        self.events: deque = deque(maxlen=STREAM_REPLAY_EVENTS)
+        self.parts: List[str] = []  # cijeli tekst odgovora (za spremanje i "reset" nakon rupe u bufferu)
+        self.seq = 0
+        self.token_seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.expires_at = float("inf")
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._idle: Optional[asyncio.TimerHandle] = None
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def publish(self, event: str, data: str, text: Optional[str] = None) -> None:
+        self.seq += 1
+        if text is not None:
+            self.parts.append(text)
+            self.token_seq = self.seq
+        self.events.append((self.seq, event, data))
+        self._wake()
+
+    def finish(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.expires_at = time.monotonic() + STREAM_REPLAY_TTL
+        self._wake()
+
+    def start(self, produce: Callable[["StreamSession"], Awaitable[None]]) -> None:
+        async def run() -> None:
+            try:
+                await produce(self)
+            finally:
+                self.finish()
+        self.task = asyncio.create_task(run())
+
+    def _wake(self) -> None:
+        waiter, self._changed = self._changed, asyncio.Event()
+        waiter.set()
+
+    def _abandon(self) -> None:
+        self._idle = None
+        if self.subscribers == 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[_Event]:
+        """
+        Eventi sa seq > `after`: prvo iz buffera, zatim uživo. Ako je dio
+        eventa već ispao iz buffera, šalje se jedan "reset" s cijelim tekstom do tada.
+        """
+        self.subscribers += 1
+        if self._idle is not None:
+            self._idle.cancel()
+            self._idle = None
+        try:
+            while True:
+                waiter = self._changed
+                if self.events:
+                    first = self.events[0][0]
+                    if after < first - 1 and after < self.token_seq:
+                        yield (self.token_seq, "reset", json.dumps({"text": self.text()}))
+                        after = max(after, self.token_seq)
+                    start = max(0, after - first + 1)
+                    for ev in islice(self.events, start, None):
+                        yield ev
+                        after = ev[0]
+                if self.done and after >= self.seq:
+                    return
+                await waiter.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self._idle = asyncio.get_running_loop().call_later(STREAM_RESUME_GRACE, self._abandon)
+
+class StreamRegistry:
+    def __init__(self) -> None:
+        self._streams: "OrderedDict[str, StreamSession]" = OrderedDict()
+
+    def create(self, user_id: str) -> StreamSession:
+        self._evict()
+        sess = StreamSession(user_id)
+        self._streams[sess.id] = sess
+        return sess
+
+    def get(self, stream_id: str, user_id: str) -> Optional[StreamSession]:
+        sess = self._streams.get(stream_id)
+        if sess is None or user_id not in sess.user_ids or sess.expires_at <= time.monotonic():
+            return None
+        return sess
+
+    def resume(self, last_event_id: str, user_id: str) -> Tuple[Optional[StreamSession], int]:
+        """`Last-Event-ID` je oblika "<stream_id>:<seq>"."""
+        stream_id, _, seq = (last_event_id or "").strip().partition(":")
+        sess = self.get(stream_id, user_id)
+        try:
+            after = int(seq or 0)
+        except ValueError:
+            after = 0
+        return sess, after
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._streams.items() if s.expires_at <= now]:
+            del self._streams[sid]
+        # preko limita: najprije najstariji završeni streamovi
+        if len(self._streams) >= STREAM_REPLAY_MAX_STREAMS:
+            for sid in [sid for sid, s in self._streams.items() if s.done]:
+                del self._streams[sid]
+                if len(self._streams) < STREAM_REPLAY_MAX_STREAMS:
+                    break
+
+stream_registry = StreamRegistry()
+
+def event_id(sess: StreamSession, seq: int) -> str:
+    return f"{sess.id}:{seq}"
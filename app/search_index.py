@@ -0,0 +1,210 @@
+# app/search_index.py — lokalni full-text indeks historije (SQLite FTS5 na disku), inkrementalno + rebuild
+from typing import AsyncIterator, Iterable, List, Optional
+import asyncio, os, re, sqlite3, threading, time
+
+SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "1") == "1"
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "data/history_search.db")
+SEARCH_SNIPPET_TOKENS = int(os.getenv("SEARCH_SNIPPET_TOKENS", "16"))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    rowid INTEGER PRIMARY KEY,
+    row_id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS docs_user ON docs (user_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(prompt, response, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS indexed_users (user_id TEXT PRIMARY KEY, rebuilt_at REAL);
+"""
+
+def match_expr(q: str) -> Optional[str]:
+    """
+    Korisnički upit → sigurni FTS5 izraz: riječi u navodnicima (AND), zadnja
+    kao prefiks (search-as-you-type). Operatori i sintaksa iz upita se ignoriraju.
+    """
+    words = _WORD.findall(q)
+    if not words:
+        return None
+    terms = ['"' + w + '"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+class SearchIndex:
+    """
+    Jedna SQLite konekcija (WAL) iza zaključavanja; pozivi idu u thread da
+    ne blokiraju event loop. `docs` mapira Supabase id → FTS rowid i korisnika.
+    """
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.available = SEARCH_ENABLED
+        self.error: Optional[str] = None
+        self.indexed = 0
+        self.removed = 0
+        self.queries = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        if not self.available:
+            return None
+
+        def call():
+            with self._lock:
+                return fn(self._db(), *args)
+
+        try:
+            return await asyncio.to_thread(call)
+        except sqlite3.OperationalError as e:
+            # npr. SQLite bez FTS5 ili nedostupan disk: pretraga se gasi, ostatak servisa radi
+            if "fts5" in str(e) or "unable to open" in str(e):
+                self.available, self.error = False, str(e)
+                return None
+            raise
+
+    # --- upis ---
+    @staticmethod
+    def _add(conn: sqlite3.Connection, rows: List[dict]) -> int:
+        n = 0
+        conn.execute("BEGIN")
+        try:
+            for r in rows:
+                if r.get("id") is None or not r.get("user_id"):
+                    continue
+                row_id = str(r["id"])
+                old = conn.execute("SELECT rowid FROM docs WHERE row_id = ?", (row_id,)).fetchone()
+                if old is not None:
+                    conn.execute("DELETE FROM docs_fts WHERE rowid = ?", old)
+                    conn.execute("DELETE FROM docs WHERE rowid = ?", old)
+                cur = conn.execute(
+                    "INSERT INTO docs (row_id, user_id, created_at) VALUES (?, ?, ?)",
+                    (row_id, r["user_id"], r.get("created_at")),
+                )
+                conn.execute(
+                    "INSERT INTO docs_fts (rowid, prompt, response) VALUES (?, ?, ?)",
+                    (cur.lastrowid, r.get("prompt") or "", r.get("response") or ""),
+                )
+                n += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return n
+
+    async def add(self, rows: Iterable[dict]) -> None:
+        """Redovi kako ih vraća Supabase insert (s id i created_at)."""
+        rows = [r for r in rows if isinstance(r, dict)]
+        if rows:
+            self.indexed += await self._run(self._add, rows) or 0
+
+    @staticmethod
+    def _remove(conn: sqlite3.Connection, user_id: str, ids: Optional[List[str]]) -> int:
+        conn.execute("BEGIN")
+        try:
+            if ids is None:
+                found = conn.execute("SELECT rowid FROM docs WHERE user_id = ?", (user_id,)).fetchall()
+            else:
+                found = []
+                for row_id in ids:
+                    hit = conn.execute(
+                        "SELECT rowid FROM docs WHERE row_id = ? AND user_id = ?", (str(row_id), user_id)
+                    ).fetchone()
+                    if hit is not None:
+                        found.append(hit)
+            conn.executemany("DELETE FROM docs_fts WHERE rowid = ?", found)
+            conn.executemany("DELETE FROM docs WHERE rowid = ?", found)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(found)
+
+    async def remove(self, user_id: str, ids: Optional[Iterable[str]] = None) -> None:
+        """Briše dane id-eve korisnika iz indeksa; `ids=None` = cijeli korisnik."""
+        self.removed += await self._run(self._remove, user_id, None if ids is None else list(ids)) or 0
+
+    # --- rebuild ---
+    @staticmethod
+    def _mark(conn: sqlite3.Connection, user_id: str) -> None:
+        conn.execute(
+            "INSERT INTO indexed_users (user_id, rebuilt_at) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET rebuilt_at = excluded.rebuilt_at",
+            (user_id, time.time()),
+        )
+
+    @staticmethod
+    def _is_built(conn: sqlite3.Connection, user_id: str) -> bool:
+        return conn.execute("SELECT 1 FROM indexed_users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    async def is_built(self, user_id: str) -> bool:
+        return bool(await self._run(self._is_built, user_id))
+
+    async def rebuild(self, user_id: str, pages: AsyncIterator[List[dict]]) -> int:
+        """Indeks korisnika iznova iz Supabasea (stranice iz history.iter_history)."""
+        await self.remove(user_id)
+        n = 0
+        async for rows in pages:
+            await self.add([{**r, "user_id": user_id} for r in rows])
+            n += len(rows)
+        await self._run(self._mark, user_id)
+        return n
+
+    # --- pretraga ---
+    @staticmethod
+    def _search(conn: sqlite3.Connection, user_id: str, expr: str, limit: int, offset: int) -> List[dict]:
+        k = SEARCH_SNIPPET_TOKENS
+        cur = conn.execute(
+            f"""
+            SELECT d.row_id, d.created_at, bm25(docs_fts) AS rank,
+                   snippet(docs_fts, 0, '[', ']', '…', {k}),
+                   snippet(docs_fts, 1, '[', ']', '…', {k})
+            FROM docs_fts JOIN docs d ON d.rowid = docs_fts.rowid
+            WHERE docs_fts MATCH ? AND d.user_id = ?
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+            """,
+            (expr, user_id, limit, offset),
+        )
+        return [
+            {"id": r[0], "created_at": r[1], "score": round(-r[2], 4), "prompt": r[3], "response": r[4]}
+            for r in cur.fetchall()
+        ]
+
+    async def search(self, user_id: str, q: str, limit: int, offset: int = 0) -> Optional[List[dict]]:
+        expr = match_expr(q)
+        if expr is None:
+            return []
+        self.queries += 1
+        return await self._run(self._search, user_id, expr, limit, offset)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SEARCH_ENABLED,
+            "available": self.available,
+            "error": self.error,
+            "indexed": self.indexed,
+            "removed": self.removed,
+            "queries": self.queries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+search_index = SearchIndex()
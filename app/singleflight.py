@@ -0,0 +1,69 @@
+# app/singleflight.py — identični upiti u letu dijele jedan upstream poziv (query) / jednu generaciju (stream)
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio, os
+
+from app.auth import AuthedUser
+from app.resume import StreamSession
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+
+class QueryFlights:
+    """Prvi poziv (leader) pokreće task; ostali čekaju isti rezultat. Odustajanje jednog ne prekida ostale."""
+
+    def __init__(self) -> None:
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key) is t else None)
+            self.leaders += 1
+        else:
+            self.joined += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "leaders": self.leaders, "joined": self.joined}
+
+class StreamFlights:
+    """
+    Stream koji je u tijeku može dobiti nove pretplatnike: svaki dobije replay
+    dosadašnjih tokena iz StreamSession buffera pa nastavak uživo.
+    Popis korisnika služi da se po završetku spremi history red za svakoga.
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Tuple[StreamSession, List[AuthedUser]]] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    def join(self, key: str, user: AuthedUser) -> Optional[StreamSession]:
+        flight = self._flights.get(key)
+        if flight is None or flight[0].done:
+            return None
+        sess, users = flight
+        sess.user_ids.add(user.id)
+        users.append(user)
+        self.joined += 1
+        return sess
+
+    def lead(self, key: str, sess: StreamSession, user: AuthedUser) -> None:
+        self._flights[key] = (sess, [user])
+        self.leaders += 1
+
+    def release(self, key: str, sess: StreamSession) -> List[AuthedUser]:
+        flight = self._flights.get(key)
+        if flight is None or flight[0] is not sess:
+            return []
+        del self._flights[key]
+        return flight[1]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "joined": self.joined}
+
+query_flights = QueryFlights()
+stream_flights = StreamFlights()
@@ -0,0 +1,211 @@
+# app/spool.py — append-only write-ahead spool za history redove (preživi pad procesa i nedostupan Supabase)
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+import asyncio, glob, json, os, time
+
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "1") == "1"
+SPOOL_DIR = os.getenv("SPOOL_DIR", "data/spool")
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "1") == "1"  # group commit prije potvrde; 0 = samo flush u OS
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+SPOOL_MAX_AGE = float(os.getenv("SPOOL_MAX_AGE", str(7 * 24 * 3600)))  # s; stariji red ide u dead.log
+SPOOL_BACKOFF_MAX = float(os.getenv("SPOOL_BACKOFF_MAX", "60"))
+SPOOL_REPLAY_AFTER = float(os.getenv("SPOOL_REPLAY_AFTER", "5"))  # s; prije toga zapis šalje brzi put (queue)
+# ključ idempotencije: vrijednost ovog stupca generira klijent, ponovni upis se ignorira (on_conflict)
+SPOOL_IDEMPOTENCY_COLUMN = os.getenv("SPOOL_IDEMPOTENCY_COLUMN", "id")
+
+class _Record:
+    __slots__ = ("segment", "row", "at", "attempts", "next_at")
+
+    def __init__(self, segment: int, row: dict, at: float) -> None:
+        self.segment = segment
+        self.row = row
+        self.at = at  # wall clock upisa, preživi restart
+        self.attempts = 0
+        self.next_at = 0.0
+
+class Spool:
+    """
+    Segmenti `spool-<n>.log`, jedan JSON red po zapisu. Potvrđeni zapisi se
+    brišu samo iz memorije; segment se briše s diska kad su potvrđeni svi
+    njegovi zapisi. Nakon pada se svi preostali zapisi ponovno šalju.
+    Duplikati su bezopasni jer je upis idempotentan. Korisnikov JWT se ne
+    zapisuje: replay ide service-role sesijom, `user_id` je već u redu.
+    """
+
+    def __init__(self, directory: str = SPOOL_DIR) -> None:
+        self.dir = directory
+        self._records: "OrderedDict[str, _Record]" = OrderedDict()
+        self._segments: Dict[int, int] = {}  # segment -> broj nepotvrđenih zapisa
+        self._segment = 0
+        self._fh = None
+        self._bytes = 0
+        self._appended = 0
+        self._synced = 0
+        self._sync_task: Optional[asyncio.Task] = None
+        self.inflight: Set[str] = set()
+        self.recovered = 0
+        self.acked = 0
+        self.dead = 0
+        self.retries = 0
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.dir, f"spool-{segment:08d}.log")
+
+    # --- start / stop ---
+    def recover(self) -> int:
+        """Učita nepotvrđene zapise iz postojećih segmenata i otvori novi segment."""
+        os.makedirs(self.dir, mode=0o700, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(self.dir, "spool-*.log"))):
+            segment = int(os.path.basename(path)[6:-4])
+            self._segment = max(self._segment, segment)
+            count = 0
+            with open(path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        rec = json.loads(line)
+                        key, row, at = rec["k"], rec["r"], float(rec.get("a") or time.time())
+                    except (ValueError, KeyError, TypeError):
+                        continue  # nedovršen zadnji red (pad usred upisa)
+                    if key not in self._records:
+                        self._records[key] = _Record(segment, row, at)
+                        count += 1
+            if count:
+                self._segments[segment] = count
+            else:
+                os.unlink(path)
+        self.recovered = len(self._records)
+        self._open(self._segment + 1)
+        return self.recovered
+
+    def _open(self, segment: int) -> None:
+        self._segment = segment
+        self._fh = open(self._path(segment), "a", encoding="utf-8")
+        self._bytes = self._fh.tell()
+        self._segments.setdefault(segment, 0)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+            if not self._segments.get(self._segment):
+                self._segments.pop(self._segment, None)
+                os.unlink(self._path(self._segment))
+
+    # --- upis ---
+    async def append(self, row: dict) -> str:
+        """Zapiše red (flush + group fsync) prije nego što se upit potvrdi klijentu."""
+        key = str(row[SPOOL_IDEMPOTENCY_COLUMN])
+        if self._bytes >= SPOOL_SEGMENT_BYTES and (self._sync_task is None or self._sync_task.done()):
+            self._rotate()
+        at = time.time()
+        line = json.dumps({"k": key, "a": at, "r": row}, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._fh.write(line)
+        self._fh.flush()
+        self._bytes += len(line)
+        rec = self._records[key] = _Record(self._segment, row, at)
+        rec.next_at = time.monotonic() + SPOOL_REPLAY_AFTER
+        self._segments[self._segment] += 1
+        self._appended += 1
+        if SPOOL_FSYNC:
+            await self._sync(self._appended)
+        return key
+
+    async def _sync(self, target: int) -> None:
+        # group commit: jedan fsync (u threadu) pokriva sve zapise upisane do njegova početka
+        while self._synced < target:
+            if self._sync_task is None or self._sync_task.done():
+                self._sync_task = asyncio.create_task(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def _fsync(self) -> None:
+        upto = self._appended
+        await asyncio.to_thread(os.fsync, self._fh.fileno())
+        self._synced = max(self._synced, upto)
+
+    def _rotate(self) -> None:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        old = self._segment
+        self._open(old + 1)
+        self._drop_if_empty(old)
+
+    def _drop_if_empty(self, segment: int) -> None:
+        if segment != self._segment and self._segments.get(segment) == 0:
+            del self._segments[segment]
+            try:
+                os.unlink(self._path(segment))
+            except FileNotFoundError:
+                pass
+
+    # --- potvrde i retry ---
+    def _forget(self, key: str) -> bool:
+        self.inflight.discard(key)
+        rec = self._records.pop(key, None)
+        if rec is None:
+            return False
+        self._segments[rec.segment] -= 1
+        self._drop_if_empty(rec.segment)
+        return True
+
+    def ack(self, keys: List[str]) -> None:
+        for key in keys:
+            if self._forget(key):
+                self.acked += 1
+
+    def failed(self, keys: List[str], permanent: bool = False) -> None:
+        """
+        Eksponencijalni backoff po zapisu. U dead.log ide samo red koji upis
+        trajno odbija (`permanent`: loš red, ne auth / mreža / 5xx) ili je
+        stariji od SPOOL_MAX_AGE — ispad Supabasea ne troši pokušaje.
+        """
+        now = time.monotonic()
+        dead: List[str] = []
+        for key in keys:
+            self.inflight.discard(key)
+            rec = self._records.get(key)
+            if rec is None:
+                continue
+            rec.attempts += 1
+            self.retries += 1
+            if permanent or time.time() - rec.at >= SPOOL_MAX_AGE:
+                dead.append(key)
+            else:
+                rec.next_at = now + min(SPOOL_BACKOFF_MAX, 0.5 * 2 ** rec.attempts)
+        if dead:
+            with open(os.path.join(self.dir, "dead.log"), "a", encoding="utf-8") as fh:
+                for key in dead:
+                    rec = self._records[key]
+                    fh.write(json.dumps({"k": key, "r": rec.row, "attempts": rec.attempts,
+                                         "permanent": permanent}, ensure_ascii=False) + "\n")
+                    self._forget(key)
+            self.dead += len(dead)
+
+    def due(self, limit: int) -> List[dict]:
+        """Preuzme (inflight) zapise spremne za slanje: nisu u letu i backoff im je istekao."""
+        now = time.monotonic()
+        out: List[dict] = []
+        for key, rec in self._records.items():
+            if key in self.inflight or rec.next_at > now:
+                continue
+            out.append(rec.row)
+            self.inflight.add(key)
+            if len(out) >= limit:
+                break
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SPOOL_ENABLED,
+            "depth": len(self._records),
+            "segments": len(self._segments),
+            "inflight": len(self.inflight),
+            "recovered": self.recovered,
+            "acked": self.acked,
+            "retries": self.retries,
+            "dead": self.dead,
+        }
+
+spool = Spool()
@@ -0,0 +1,115 @@
+# app/streaming.py — parsiranje OpenRouter SSE streama + opcionalno spajanje tokena u veće frameove
+from typing import AsyncIterator, List
+import asyncio, json, os, re
+
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "0"))  # 0 = frame po tokenu
+STREAM_COALESCE_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "512"))  # približno: broji znakove
+
+_END = object()
+_WORD = re.compile(r"\S+\s*|\s+")
+
+class UpstreamError(Exception):
+    """OpenRouter je vratio ne-200 status (ili je stream prekinut prije [DONE])."""
+
+    def __init__(self, status: int, detail: str) -> None:
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+class UpstreamDeltas:
+    """
+    Async iterator po `delta.content` iz OpenRouter SSE odgovora.
+    `done` postaje True tek kad stigne `[DONE]` (tada se odgovor sprema).
+    """
+
+    def __init__(self, response) -> None:
+        self.response = response
+        self.done = False
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iter()
+
+    async def _iter(self) -> AsyncIterator[str]:
+        loads = json.loads
+        async for line in self.response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = line[5:].strip()
+            if chunk == "[DONE]":
+                self.done = True
+                return
+            try:
+                choices = loads(chunk).get("choices")
+            except (ValueError, AttributeError):
+                continue
+            if not choices:
+                continue
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+async def coalesce(
+    deltas: AsyncIterator[str],
+    window_ms: float = STREAM_COALESCE_MS,
+    max_bytes: int = STREAM_COALESCE_BYTES,
+) -> AsyncIterator[str]:
+    """
+    Spaja tokene koji stignu unutar `window_ms` (ili dok ne narastu na `max_bytes`)
+    u jedan komad. Upstream se čita u zasebnom tasku koji se otkazuje čim se
+    generator zatvori (npr. klijent se odspojio), pa se stream prema OpenRouteru prekida.
+    """
+    if window_ms <= 0:
+        async for d in deltas:
+            yield d
+        return
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        try:
+            async for d in deltas:
+                queue.put_nowait(d)
+        except Exception as e:
+            queue.put_nowait(e)
+        queue.put_nowait(_END)
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    task = asyncio.create_task(pump())
+    try:
+        ended = False
+        while not ended:
+            item = await queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            buf: List[str] = [item]
+            size = len(item)
+            deadline = loop.time() + window
+            while size < max_bytes:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = queue.get_nowait()
+                if item is _END:
+                    ended = True
+                    break
+                if isinstance(item, Exception):
+                    yield "".join(buf)
+                    raise item
+                buf.append(item)
+                size += len(item)
+            yield "".join(buf)
+    finally:
+        task.cancel()
+
+def replay_chunks(text: str) -> List[str]:
+    """Gotov odgovor (npr. iz cachea) razbijen na riječi za token evente."""
+    return _WORD.findall(text)
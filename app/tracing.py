@@ -0,0 +1,172 @@
+# app/tracing.py — fazni timer po zahtjevu (contextvar) → Server-Timing, SSE "timing" event, log sporih zahtjeva
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+import functools, inspect, json, logging, os, re, time
+
+from fastapi import Request
+
+from app.metrics import TimedRoute
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"  # 0 = faze samo u logu, ne klijentu
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+
+log = logging.getLogger("app.slow")
+
+_UNSAFE_DESC = re.compile(r"[^\w.\-/:]", re.ASCII)
+
+def _desc(d: str) -> str:
+    # desc može doći od klijenta (model): samo ASCII token, inače header puca (latin-1) ili se lomi na navodniku
+    return _UNSAFE_DESC.sub("_", d)[:64]
+
+class Trace:
+    """
+    Faze jednog zahtjeva kao (ime, ms, opis). Isto ime se smije ponoviti
+    (npr. hedge: dva upstream poziva s opisom = model).
+    """
+    __slots__ = ("route", "method", "t0", "phases", "status", "deferred", "closed")
+
+    def __init__(self, route: str, method: str) -> None:
+        self.route = route
+        self.method = method
+        self.t0 = time.perf_counter()
+        self.phases: List[Tuple[str, float, Optional[str]]] = []
+        self.status: Optional[int] = None
+        self.deferred = False  # stream: trace zatvara generacija, ne odgovor
+        self.closed = False
+
+    def add(self, name: str, seconds: float, desc: Optional[str] = None) -> None:
+        self.phases.append((name, seconds * 1000, desc))
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+    def spent_ms(self, name: str) -> float:
+        return sum(ms for n, ms, _ in self.phases if n == name)
+
+    def header(self) -> str:
+        parts = [
+            f'{n};dur={ms:.1f}' + (f';desc="{_desc(d)}"' if d else "")
+            for n, ms, d in self.phases
+        ]
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> dict:
+        return {
+            "total_ms": round(self.total_ms(), 1),
+            "phases": [{"name": n, "ms": round(ms, 1), **({"desc": d} if d else {})} for n, ms, d in self.phases],
+        }
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        total = self.total_ms()
+        if total >= SLOW_REQUEST_MS:
+            log.warning(json.dumps({
+                "event": "slow_request",
+                "route": self.route,
+                "method": self.method,
+                "status": self.status,
+                **self.summary(),
+            }))
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+def add(name: str, seconds: float, desc: Optional[str] = None) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds, desc)
+
+@contextmanager
+def phase(name: str, desc: Optional[str] = None):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - t0, desc)
+
+def httpx_extensions(desc: Optional[str] = None) -> Optional[dict]:
+    """
+    httpx `extensions={"trace": ...}` koji bilježi upstream_connect (TCP + TLS,
+    samo kad nema slobodne konekcije u poolu) i upstream_ttfb (slanje
+    zahtjeva → zaglavlja odgovora).
+    """
+    trace = _current.get()
+    if trace is None:
+        return None
+    marks: dict = {}
+
+    async def on_event(name: str, info: dict) -> None:
+        _, _, event = name.partition(".")
+        now = time.perf_counter()
+        if event == "connect_tcp.started":
+            marks["connect"] = now
+        elif event == "send_request_headers.started":
+            if "connect" in marks:
+                trace.add("upstream_connect", now - marks.pop("connect"), desc)
+            marks["send"] = now
+        elif event == "receive_response_headers.complete" and "send" in marks:
+            trace.add("upstream_ttfb", now - marks.pop("send"), desc)
+
+    return {"trace": on_event}
+
+def _mark_entry(endpoint: Callable) -> Callable:
+    # "validate" = od početka zahtjeva do ulaska u endpoint (čitanje tijela, pydantic, dependencyji) bez auth faze
+    if getattr(endpoint, "_traced", False):
+        return endpoint  # include_router ponovno gradi rute s istim endpointom
+
+    def mark() -> None:
+        trace = _current.get()
+        if trace is not None:
+            trace.add("validate", max(0.0, trace.total_ms() - trace.spent_ms("auth")) / 1000)
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def entered(*args, **kwargs):
+            mark()
+            return await endpoint(*args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def entered(*args, **kwargs):
+            mark()
+            return endpoint(*args, **kwargs)
+    entered._traced = True
+    return entered
+
+class TracedRoute(TimedRoute):
+    """route_class: TimedRoute metrike + Trace u contextvaru, Server-Timing na odgovoru, log sporih."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs) -> None:
+        super().__init__(path, _mark_entry(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def traced(request: Request):
+            trace = Trace(route, request.method)
+            token = _current.set(trace)
+            try:
+                response = await handler(request)
+                trace.status = response.status_code
+                if SERVER_TIMING:
+                    response.headers["Server-Timing"] = trace.header()
+                return response
+            except Exception as e:
+                trace.status = getattr(e, "status_code", 500)
+                raise
+            finally:
+                _current.reset(token)
+                if not trace.deferred:
+                    trace.close()
+
+        return traced
@@ -0,0 +1,10 @@
+# bench/asgi.py — ASGI app za load test: /ai router (s lifespanom) + /metrics
+#
+#   uvicorn bench.asgi:app --port 9100 --workers 2
+from fastapi import FastAPI
+
+from app import main, metrics
+
+app = FastAPI()
+app.include_router(main.router)
+app.include_router(metrics.router)
@@ -0,0 +1,97 @@
+# bench/history_export.py — vršna memorija exporta: stari (sve u memoriju) vs. streaming po stranicama
+#
+#   PYTHONPATH=. python bench/history_export.py --rows 1000,10000,50000 --format csv
+#   PYTHONPATH=. python bench/history_export.py --check   # izlaz 1 ako peak raste s brojem redova
+#
+# PostgREST je lažni (httpx.MockTransport): redove generira iz keyset uvjeta,
+# bez tablice u memoriji, pa se mjeri samo memorija exporta (tracemalloc peak).
+import argparse, asyncio, csv, datetime, io, os, re, sys, time, tracemalloc, urllib.parse
+
+os.environ.setdefault("SUPABASE_URL", "http://bench.local")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench")  # mora izgledati kao JWT
+
+import httpx
+
+from app import db, history
+
+BASE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+RESPONSE = "lorem ipsum dolor sit amet " * 40  # ~1 KB po odgovoru
+_KEYSET = re.compile(r'\(created_at\.lt\."([^"]*)",and\(created_at\.eq\."([^"]*)",id\.lt\."([^"]*)"\)\)')
+
+def make_handler(total: int):
+    # red i (0 = najnoviji): id = total - i, created_at pada po sekundu
+    def row(i: int) -> dict:
+        return {
+            "id": str(total - i),
+            "user_id": "bench",
+            "prompt": f"prompt {i}",
+            "response": RESPONSE,
+            "created_at": (BASE - datetime.timedelta(seconds=i)).isoformat(),
+        }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        params = dict(urllib.parse.parse_qsl(request.url.query.decode()))
+        start = 0
+        m = _KEYSET.fullmatch(params.get("or", ""))
+        if m:
+            start = total - int(m.group(3)) + 1
+        end = min(total, start + int(params.get("limit", total)))
+        cols = params.get("select", "*")
+        rows = [row(i) for i in range(start, end)]
+        if cols != "*":
+            rows = [{c: r[c] for c in cols.split(",")} for r in rows]
+        return httpx.Response(200, json=rows)
+
+    return handler
+
+async def legacy_csv(sb) -> int:
+    # kopija history_export_csv prije user-015: jedan upit, StringIO, pa bytes
+    res = await sb.table("queries").select("id,prompt,response,created_at").eq("user_id", "bench").order("created_at", desc=True).execute()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["id", "created_at", "prompt", "response"])
+    for r in res.data or []:
+        writer.writerow([r.get("id", ""), r.get("created_at", ""), r.get("prompt", ""), r.get("response", "")])
+    return len(buf.getvalue().encode("utf-8"))
+
+async def streamed(sb, fmt: str, gzip: bool) -> int:
+    size = 0
+    async for chunk in history.export_stream(sb, "bench", fmt, gzip):
+        size += len(chunk)
+    return size
+
+async def measure(name: str, rows: int, fn) -> float:
+    db._transport = httpx.MockTransport(make_handler(rows))
+    sb = db.session("bench")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    size = await fn(sb)
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<18} rows={rows:>7} out={size / 1e6:>8.2f} MB peak={peak / 1e6:>8.2f} MB {rows / wall:>9.0f} rows/s")
+    return peak
+
+async def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="1000,10000,50000")
+    ap.add_argument("--format", default="csv", choices=sorted(history.EXPORT_MEDIA))
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("--skip-legacy", action="store_true")
+    ap.add_argument("--check", action="store_true", help="peak streaminga ne smije rasti više od 1.5x")
+    a = ap.parse_args()
+    counts = [int(x) for x in a.rows.split(",")]
+    peaks = []
+    for n in counts:
+        if not a.skip_legacy and a.format == "csv":
+            await measure("legacy csv", n, legacy_csv)
+        label = f"stream {a.format}" + (" gz" if a.gzip else "")
+        peaks.append(await measure(label, n, lambda sb: streamed(sb, a.format, a.gzip)))
+    if a.check:
+        flat = max(peaks) <= 1.5 * peaks[0]
+        print("flat" if flat else "NOT flat", [round(p / 1e6, 2) for p in peaks])
+        return 0 if flat else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,333 @@
+# bench/load.py — load test /ai/query, /ai/stream, /ai/history i exporta protiv lokalnih mockova (bez mreže prema van)
+#
+#   PYTHONPATH=. python bench/load.py --scenarios query,stream,history,export --concurrency 1,8,32 --duration 10
+#   PYTHONPATH=. python bench/load.py --ttft-ms 800 --tps 30 --error-rate 0.05 --workers 2
+#   PYTHONPATH=. python bench/load.py --compare bench/results/<stariji>.json   # exit 1 ako je regresija
+#
+# Pokrene bench/mocks.py (OpenRouter + Supabase) i uvicorn bench.asgi:app kao
+# zasebne procese, pa zatvorenom petljom (N istovremenih klijenata) tjera
+# svaki scenarij. Mjeri throughput, p50/p95/p99 latenciju, TTFT (stream) te
+# CPU i RSS app workera (iz /proc, samo Linux). Rezultat ide u
+# bench/results/<utc>-<git sha>.json; isti format → usporedba između commitova.
+import argparse, asyncio, datetime, json, os, platform, random, shutil, socket, subprocess, sys, time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from jose import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+JWT_SECRET = "bench-secret"
+ANON_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench"  # supabase klijent traži nešto što izgleda kao JWT
+SCENARIOS = ("query", "stream", "history", "export")
+
+# --- procesi ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn(args: List[str], env: Optional[dict] = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable] + args, cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": ROOT, **(env or {})},
+    )
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as c:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"proces je izašao ({proc.returncode}) prije nego što je {url} odgovorio")
+            try:
+                await c.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} nije spreman nakon {timeout}s")
+
+# --- CPU / RSS app workera ---
+
+_TICK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _stat(pid: int) -> Optional[List[str]]:
+    try:
+        with open(f"/proc/{pid}/stat") as fh:
+            raw = fh.read()
+    except OSError:
+        return None
+    return raw[raw.rindex(")") + 2:].split()  # polja nakon "(comm)"; [1] = ppid
+
+def process_tree(root: int) -> List[int]:
+    """root + svi potomci (uvicorn --workers forka procese)."""
+    parents: Dict[int, int] = {}
+    for name in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if name.isdigit():
+            st = _stat(int(name))
+            if st:
+                parents[int(name)] = int(st[1])
+    tree, frontier = [root], [root]
+    while frontier:
+        frontier = [p for p, pp in parents.items() if pp in frontier]
+        tree.extend(frontier)
+    return tree
+
+def cpu_rss(pids: List[int]) -> tuple:
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        st = _stat(pid)
+        if st:
+            cpu += (int(st[11]) + int(st[12])) / _TICK  # utime + stime
+            rss += int(st[21]) * _PAGE
+    return cpu, rss
+
+class ResourceSampler:
+    def __init__(self, root: int) -> None:
+        self.root = root
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, cpu_rss(self.pids)[1])
+            await asyncio.sleep(0.25)
+
+    def start(self) -> None:
+        self.pids = process_tree(self.root)
+        self.cpu0, self.t0 = cpu_rss(self.pids)[0], time.monotonic()
+        self.peak_rss = 0
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> dict:
+        self._task.cancel()
+        cpu, rss = cpu_rss(self.pids)
+        wall = time.monotonic() - self.t0
+        return {"cpu_cores": round((cpu - self.cpu0) / wall, 3), "rss_mb_peak": round(max(self.peak_rss, rss) / 1e6, 1)}
+
+# --- scenariji: svaki vraća (ok, ttft ili None) ---
+
+def token(user: str) -> str:
+    return jwt.encode({"sub": user, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 86400},
+                      JWT_SECRET, algorithm="HS256")
+
+async def s_query(c: httpx.AsyncClient, h: dict, n: int):
+    r = await c.post("/ai/query", headers=h, json={"prompt": f"bench query {n} {random.random()}", "cache": "bypass"})
+    return r.status_code == 200, None
+
+async def s_stream(c: httpx.AsyncClient, h: dict, n: int):
+    t0, ttft, ok = time.perf_counter(), None, False
+    async with c.stream("POST", "/ai/stream", headers=h, json={"prompt": f"bench stream {n} {random.random()}", "cache": "bypass"}) as r:
+        if r.status_code != 200:
+            await r.aread()
+            return False, None
+        async for line in r.aiter_lines():
+            if line.startswith("event: token") and ttft is None:
+                ttft = time.perf_counter() - t0
+            elif line.startswith("event: end"):
+                ok = True
+            elif line.startswith("event: error"):
+                return False, ttft
+    return ok, ttft
+
+async def s_history(c: httpx.AsyncClient, h: dict, n: int):
+    r = await c.get("/ai/history", headers=h, params={"limit": 50})
+    return r.status_code == 200, None
+
+async def s_export(c: httpx.AsyncClient, h: dict, n: int):
+    async with c.stream("GET", "/ai/history/export.ndjson", headers=h) as r:
+        async for _ in r.aiter_raw():
+            pass
+    return r.status_code == 200, None
+
+SCENARIO_FNS: Dict[str, Callable] = {"query": s_query, "stream": s_stream, "history": s_history, "export": s_export}
+
+def pct(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * len(sorted_vals) + 0.5)) - 1))
+    return round(sorted_vals[i] * 1000, 1)
+
+async def run_scenario(base: str, name: str, concurrency: int, duration: float, warmup: float,
+                       tokens: List[str], sampler: ResourceSampler) -> dict:
+    fn = SCENARIO_FNS[name]
+    lat: List[float] = []
+    ttfts: List[float] = []
+    errors = 0
+    counter = iter(range(1 << 62))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as c:
+        start = time.monotonic()
+        measure_from, stop_at = start + warmup, start + warmup + duration
+        sampled = False
+
+        async def worker(w: int) -> None:
+            nonlocal errors, sampled
+            h = {"Authorization": "Bearer " + tokens[w % len(tokens)]}
+            while True:
+                now = time.monotonic()
+                if now >= stop_at:
+                    return
+                if now >= measure_from and not sampled:
+                    sampled = True
+                    sampler.start()
+                t0 = time.perf_counter()
+                try:
+                    ok, ttft = await fn(c, h, next(counter))
+                except httpx.HTTPError:
+                    ok, ttft = False, None
+                if time.monotonic() < measure_from:
+                    continue
+                lat.append(time.perf_counter() - t0)
+                if ttft is not None:
+                    ttfts.append(ttft)
+                if not ok:
+                    errors += 1
+
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        res = sampler.stop() if sampled else {"cpu_cores": None, "rss_mb_peak": None}
+    lat.sort()
+    ttfts.sort()
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(lat),
+        "errors": errors,
+        "rps": round(len(lat) / duration, 2),
+        "p50_ms": pct(lat, 50), "p95_ms": pct(lat, 95), "p99_ms": pct(lat, 99),
+        "ttft_p50_ms": pct(ttfts, 50), "ttft_p95_ms": pct(ttfts, 95),
+        **res,
+    }
+
+# --- izlaz i usporedba ---
+
+def git_meta() -> dict:
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD") or "unknown", "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+def print_table(rows: List[dict]) -> None:
+    cols = ("scenario", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "ttft_p50_ms", "cpu_cores", "rss_mb_peak")
+    print("  ".join(f"{c:>11}" for c in cols))
+    for r in rows:
+        print("  ".join(f"{'-' if r.get(c) is None else r[c]!s:>11}" for c in cols))
+
+def compare(old: dict, new: dict, tolerance: float) -> int:
+    """rps pao ili p95 narastao više od `tolerance` → regresija."""
+    before = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    regressions = 0
+    print(f"\nvs {old['meta'].get('commit')} ({old['meta'].get('created_at')})")
+    for r in new["results"]:
+        o = before.get((r["scenario"], r["concurrency"]))
+        if o is None:
+            continue
+        flags = []
+        if o["rps"] and r["rps"] < o["rps"] * (1 - tolerance):
+            flags.append("rps")
+        if o["p95_ms"] and r["p95_ms"] and r["p95_ms"] > o["p95_ms"] * (1 + tolerance):
+            flags.append("p95")
+        regressions += bool(flags)
+        print(f"{r['scenario']:>8} c={r['concurrency']:<4} rps {o['rps']:>9} → {r['rps']:<9} "
+              f"p95 {o['p95_ms']} → {r['p95_ms']} ms {'REGRESSION ' + ','.join(flags) if flags else ''}")
+    return 1 if regressions else 0
+
+async def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--duration", type=float, default=10, help="s mjerenja po scenariju i razini")
+    ap.add_argument("--warmup", type=float, default=2)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workeri appa")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--seed-rows", type=int, default=1000, help="history redova po korisniku u mock Supabaseu")
+    ap.add_argument("--ttft-ms", type=float, default=300)
+    ap.add_argument("--tps", type=float, default=60)
+    ap.add_argument("--tokens", type=int, default=200)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--frame-tokens", type=int, default=1)
+    ap.add_argument("--split-bytes", type=int, default=0)
+    ap.add_argument("--db-latency-ms", type=float, default=0)
+    ap.add_argument("--env", action="append", default=[], help="KEY=VAL za app proces (ponovljivo)")
+    ap.add_argument("--out", help="default bench/results/<utc>-<sha>.json")
+    ap.add_argument("--compare", help="raniji rezultat za usporedbu")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    a = ap.parse_args()
+
+    or_port, sb_port, app_port = free_port(), free_port(), free_port()
+    tmp = os.path.join(ROOT, "data", f"bench-{app_port}")
+    procs = [
+        spawn(["bench/mocks.py", "openrouter", "--port", str(or_port), "--ttft-ms", str(a.ttft_ms), "--tps", str(a.tps),
+               "--tokens", str(a.tokens), "--error-rate", str(a.error_rate), "--frame-tokens", str(a.frame_tokens),
+               "--split-bytes", str(a.split_bytes)]),
+        spawn(["bench/mocks.py", "supabase", "--port", str(sb_port), "--users", str(a.users),
+               "--seed-rows", str(a.seed_rows), "--latency-ms", str(a.db_latency_ms), "--jwt-secret", JWT_SECRET]),
+    ]
+    app_env = {
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_URL": f"http://127.0.0.1:{or_port}/api/v1/chat/completions",
+        "ROUTER_CATALOG_URL": f"http://127.0.0.1:{or_port}/api/v1/models",
+        "SUPABASE_URL": f"http://127.0.0.1:{sb_port}",
+        "SUPABASE_ANON_KEY": ANON_KEY,
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "RATE_LIMIT_RPM": "0",
+        "RATE_LIMIT_TPM": "0",
+        "SPOOL_DIR": os.path.join(tmp, "spool"),
+        "SEARCH_INDEX_PATH": os.path.join(tmp, "search.db"),
+        "SLOW_REQUEST_MS": "1e9",
+        **dict(kv.split("=", 1) for kv in a.env),
+    }
+    try:
+        await wait_ready(f"http://127.0.0.1:{or_port}/api/v1/models", procs[0])
+        await wait_ready(f"http://127.0.0.1:{sb_port}/auth/v1/.well-known/jwks.json", procs[1])
+        app = spawn(["-m", "uvicorn", "bench.asgi:app", "--host", "127.0.0.1", "--port", str(app_port),
+                     "--workers", str(a.workers), "--log-level", "warning"], app_env)
+        procs.append(app)
+        base = f"http://127.0.0.1:{app_port}"
+        await wait_ready(base + "/ai/health-check", app)
+
+        tokens = [token(f"bench-{u}") for u in range(a.users)]
+        sampler = ResourceSampler(app.pid)
+        results = []
+        for name in a.scenarios.split(","):
+            for conc in [int(x) for x in a.concurrency.split(",")]:
+                res = await run_scenario(base, name, conc, a.duration, a.warmup, tokens, sampler)
+                print(json.dumps(res), flush=True)
+                results.append(res)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "meta": {
+            **git_meta(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(a).items() if k not in ("out", "compare")},
+        },
+        "results": results,
+    }
+    out = a.out or os.path.join(RESULTS_DIR, f"{report['meta']['created_at'].replace(':', '')}-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print()
+    print_table(results)
+    print(f"\n→ {os.path.relpath(out, ROOT)}")
+    if a.compare:
+        with open(a.compare) as fh:
+            return compare(json.load(fh), report, a.tolerance)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
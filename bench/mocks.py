@@ -0,0 +1,228 @@
+# bench/mocks.py — lokalni stand-in za OpenRouter (TTFT, tokeni/s, greške, SSE framing) i Supabase (PostgREST + Auth)
+#
+#   PYTHONPATH=. python bench/mocks.py openrouter --port 9101 --ttft-ms 300 --tps 60 --error-rate 0.02
+#   PYTHONPATH=. python bench/mocks.py supabase --port 9102 --users 20 --seed-rows 2000
+#
+# Obično ih pokreće bench/load.py; ručno su korisni za profiliranje (/debug/profile) pod stalnim opterećenjem.
+import argparse, asyncio, datetime, itertools, json, random, re, urllib.parse, uuid
+from typing import Dict, List, Optional
+
+from jose import jwt
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# --- OpenRouter ---
+
+WORDS = "the of and to in is that for it as with was on be by this are from at or an".split()
+
+def openrouter_app(ttft_ms: float = 300, tps: float = 60, tokens: int = 200, error_rate: float = 0.0,
+                   error_status: int = 503, frame_tokens: int = 1, split_bytes: int = 0,
+                   keepalive_ms: float = 0, seed: int = 1) -> Starlette:
+    """
+    /api/v1/chat/completions (stream i ne-stream) i /api/v1/models.
+    frame_tokens = tokena po `data:` liniji; split_bytes > 0 reže SSE tekst
+    u chunkove te veličine (linije preko granice chunka); keepalive_ms šalje
+    `: OPENROUTER PROCESSING` komentare dok se čeka prvi token.
+    """
+    rng = random.Random(seed)
+
+    def text(n: int) -> List[str]:
+        return [rng.choice(WORDS) + " " for _ in range(n)]
+
+    async def completions(request: Request) -> Response:
+        body = await request.json()
+        n = min(tokens, int(body.get("max_tokens") or tokens))
+        if error_rate and rng.random() < error_rate:
+            await asyncio.sleep(ttft_ms / 1000)
+            return JSONResponse({"error": {"message": "injected", "code": error_status}}, status_code=error_status)
+        if not body.get("stream"):
+            await asyncio.sleep(ttft_ms / 1000 + n / tps)
+            return JSONResponse({"model": body.get("model"), "choices": [{"message": {"content": "".join(text(n))}}]})
+
+        async def frames():
+            waited = 0.0
+            while keepalive_ms and waited + keepalive_ms < ttft_ms:
+                await asyncio.sleep(keepalive_ms / 1000)
+                waited += keepalive_ms
+                yield b": OPENROUTER PROCESSING\n\n"
+            await asyncio.sleep((ttft_ms - waited) / 1000)
+            words = text(n)
+            for i in range(0, n, frame_tokens):
+                chunk = {"choices": [{"delta": {"content": "".join(words[i:i + frame_tokens])}}]}
+                yield ("data: " + json.dumps(chunk) + "\n\n").encode()
+                await asyncio.sleep(frame_tokens / tps)
+            yield b"data: [DONE]\n\n"
+
+        async def split(source):
+            buf = b""
+            async for part in source:
+                buf += part
+                while len(buf) >= split_bytes:
+                    yield buf[:split_bytes]
+                    buf = buf[split_bytes:]
+            if buf:
+                yield buf
+
+        gen = split(frames()) if split_bytes else frames()
+        return StreamingResponse(gen, media_type="text/event-stream")
+
+    async def models(request: Request) -> Response:
+        ids = ["openrouter/auto", "bench/fast", "bench/slow"]
+        return JSONResponse({"data": [{"id": m, "name": m, "context_length": 8192} for m in ids]})
+
+    return Starlette(routes=[
+        Route("/api/v1/chat/completions", completions, methods=["POST"]),
+        Route("/api/v1/models", models),
+    ])
+
+# --- Supabase (PostgREST podskup koji koristi app + Auth) ---
+
+_KEYSET = re.compile(r'\((\w+)\.lt\."([^"]*)",and\((\w+)\.eq\."([^"]*)",(\w+)\.lt\."([^"]*)"\)\)')
+_ILIKE_OR = re.compile(r'\((\w+)\.ilike\."\*([^"]*)\*",(\w+)\.ilike\."\*([^"]*)\*"\)')
+_RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns", "or"}
+
+class Tables:
+    """Redovi po tablici i po user_id (svi upiti appa filtriraju user_id=eq.)."""
+
+    def __init__(self) -> None:
+        self.rows: Dict[str, Dict[str, List[dict]]] = {}
+        self.ids = itertools.count(1)
+
+    def bucket(self, table: str, user_id: Optional[str]) -> List[dict]:
+        users = self.rows.setdefault(table, {})
+        if user_id is not None:
+            return users.setdefault(user_id, [])
+        return [r for rows in users.values() for r in rows]
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = {"id": str(uuid.uuid4()), "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), **row}
+        self.bucket(table, row.get("user_id")).append(row)
+        return row
+
+    def seed(self, users: int, rows: int) -> None:
+        base = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        for u in range(users):
+            for i in range(rows):
+                self.insert("queries", {
+                    "user_id": f"bench-{u}",
+                    "prompt": f"seed prompt {i} " + " ".join(random.choices(WORDS, k=8)),
+                    "response": " ".join(random.choices(WORDS, k=120)),
+                    "created_at": (base + datetime.timedelta(seconds=i)).isoformat(),
+                })
+
+def _match(row: dict, params: List[tuple]) -> bool:
+    for k, v in params:
+        if k in _RESERVED:
+            continue
+        op, _, val = v.partition(".")
+        rv = str(row.get(k))
+        if op == "eq" and rv != val:
+            return False
+        if op == "in" and rv not in [x.strip('"') for x in val.strip("()").split(",")]:
+            return False
+        if op == "lt" and not rv < val:
+            return False
+        if op == "gte" and not rv >= val:
+            return False
+    return True
+
+def _or_match(row: dict, expr: str) -> bool:
+    m = _KEYSET.fullmatch(expr)
+    if m:
+        a, x, _, _, b, y = m.groups()
+        ra, rb = str(row.get(a)), str(row.get(b))
+        return ra < x or (ra == x and rb < y)
+    m = _ILIKE_OR.fullmatch(expr)
+    if m:
+        a, x, b, y = m.groups()
+        return x.lower() in str(row.get(a)).lower() or y.lower() in str(row.get(b)).lower()
+    return True
+
+def supabase_app(users: int = 20, seed_rows: int = 1000, latency_ms: float = 0, jwt_secret: str = "bench-secret") -> Starlette:
+    db = Tables()
+    db.seed(users, seed_rows)
+
+    async def rest(request: Request) -> Response:
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        table = request.path_params["table"]
+        params = list(urllib.parse.parse_qsl(request.url.query))
+        pd = dict(params)
+        user = pd.get("user_id", "")[3:] if pd.get("user_id", "").startswith("eq.") else None
+        if request.method == "POST":
+            body = await request.json()
+            body = body if isinstance(body, list) else [body]
+            conflict = pd.get("on_conflict")
+            existing = {str(r.get(conflict)) for r in db.bucket(table, user)} if conflict else set()
+            out = [db.insert(table, b) for b in body if not conflict or str(b.get(conflict)) not in existing]
+            return JSONResponse(out, status_code=201)
+        rows = [r for r in db.bucket(table, user) if _match(r, params) and ("or" not in pd or _or_match(r, pd["or"]))]
+        total = len(rows)
+        for part in reversed(pd.get("order", "").split(",") if pd.get("order") else []):
+            col, *mods = part.split(".")
+            rows.sort(key=lambda r: str(r.get(col)), reverse="desc" in mods)
+        if request.method == "DELETE":
+            doomed = {id(r) for r in rows}
+            bucket = db.bucket(table, user)
+            bucket[:] = [r for r in bucket if id(r) not in doomed]
+            return JSONResponse(rows)
+        offset = int(pd.get("offset", 0))
+        rows = rows[offset:offset + int(pd["limit"])] if "limit" in pd else rows[offset:]
+        if pd.get("select") and pd["select"] != "*":
+            cols = pd["select"].split(",")
+            rows = [{c: r.get(c) for c in cols} for r in rows]
+        headers = {}
+        if "count=" in request.headers.get("prefer", ""):
+            headers["content-range"] = f"{offset}-{offset + max(0, len(rows) - 1)}/{total}"
+        return JSONResponse(rows, headers=headers)
+
+    async def auth_user(request: Request) -> Response:
+        token = request.headers.get("authorization", "")[7:]
+        try:
+            claims = jwt.decode(token, jwt_secret, algorithms=["HS256"], audience="authenticated")
+        except Exception:
+            return JSONResponse({"message": "invalid JWT"}, status_code=401)
+        return JSONResponse({"id": claims["sub"], "aud": "authenticated", "role": "authenticated",
+                             "app_metadata": {}, "user_metadata": {}, "created_at": "2026-01-01T00:00:00Z"})
+
+    async def jwks(request: Request) -> Response:
+        return JSONResponse({"keys": []})
+
+    return Starlette(routes=[
+        Route("/rest/v1/{table}", rest, methods=["GET", "POST", "DELETE", "PATCH"]),
+        Route("/auth/v1/user", auth_user),
+        Route("/auth/v1/.well-known/jwks.json", jwks),
+    ])
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="which", required=True)
+    o = sub.add_parser("openrouter")
+    o.add_argument("--port", type=int, default=9101)
+    o.add_argument("--ttft-ms", type=float, default=300)
+    o.add_argument("--tps", type=float, default=60)
+    o.add_argument("--tokens", type=int, default=200)
+    o.add_argument("--error-rate", type=float, default=0.0)
+    o.add_argument("--error-status", type=int, default=503)
+    o.add_argument("--frame-tokens", type=int, default=1)
+    o.add_argument("--split-bytes", type=int, default=0)
+    o.add_argument("--keepalive-ms", type=float, default=0)
+    s = sub.add_parser("supabase")
+    s.add_argument("--port", type=int, default=9102)
+    s.add_argument("--users", type=int, default=20)
+    s.add_argument("--seed-rows", type=int, default=1000)
+    s.add_argument("--latency-ms", type=float, default=0)
+    s.add_argument("--jwt-secret", default="bench-secret")
+    a = ap.parse_args()
+    if a.which == "openrouter":
+        app = openrouter_app(a.ttft_ms, a.tps, a.tokens, a.error_rate, a.error_status, a.frame_tokens, a.split_bytes, a.keepalive_ms)
+    else:
+        app = supabase_app(a.users, a.seed_rows, a.latency_ms, a.jwt_secret)
+    uvicorn.run(app, host="127.0.0.1", port=a.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench/sse_pipeline.py — stari event_gen vs. streaming.coalesce pipeline (frames/s, CPU po 1k tokena)
+#
+#   PYTHONPATH=. python bench/sse_pipeline.py --tokens 20000 --window-ms 25
+#
+# Upstream je lažni odgovor koji vraća OpenRouter SSE linije bez mreže; svaki
+# frame se i kodira kao SSE (sse_starlette), kao u pravom odgovoru.
+import argparse, asyncio, json, time
+
+from sse_starlette.sse import ServerSentEvent
+
+from app import streaming
+
+class FakeResponse:
+    def __init__(self, tokens: int, burst: int, gap_ms: float) -> None:
+        self.tokens, self.burst, self.gap = tokens, burst, gap_ms / 1000
+
+    async def aiter_lines(self):
+        for i in range(self.tokens):
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": f"tok{i % 97} "}}]})
+            yield ""
+            if self.burst and i % self.burst == self.burst - 1:
+                await asyncio.sleep(self.gap)
+        yield "data: [DONE]"
+
+async def legacy(r):
+    # kopija event_gen prije user-005: += akumulacija, json per token, frame per token
+    collected = ""
+    async for line in r.aiter_lines():
+        if not line or not line.startswith("data:"):
+            continue
+        chunk = line[5:].strip()
+        if chunk == "[DONE]":
+            yield {"event": "end", "data": "{}"}
+            break
+        try:
+            part = json.loads(chunk)
+            delta = ((part.get("choices") or [{}])[0].get("delta") or {}).get("content")
+            if delta:
+                collected += delta
+                yield {"event": "token", "data": json.dumps({"token": delta})}
+        except Exception:
+            continue
+
+async def pipeline(r, window_ms: float):
+    parts = []
+    deltas = streaming.UpstreamDeltas(r)
+    async for text in streaming.coalesce(deltas, window_ms=window_ms):
+        parts.append(text)
+        yield {"event": "token", "data": json.dumps({"token": text})}
+    if deltas.done:
+        # kao u appu: odgovor se sklopi jednom na kraju (za history), ne += po tokenu
+        answer = "".join(parts)
+        yield {"event": "end", "data": json.dumps({"chars": len(answer)})}
+
+async def run(name, gen, tokens):
+    frames = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    async for ev in gen:
+        ServerSentEvent(**ev).encode()
+        frames += 1
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(
+        f"{name:<22} frames={frames:>7} frames/s={frames / wall:>10.0f} "
+        f"tok/s={tokens / wall:>10.0f} cpu_ms/1k_tok={cpu * 1000 / tokens * 1000:>8.2f}"
+    )
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tokens", type=int, default=20000)
+    ap.add_argument("--burst", type=int, default=8, help="tokena po burstu upstreama")
+    ap.add_argument("--gap-ms", type=float, default=1.0, help="pauza između burstova")
+    ap.add_argument("--window-ms", type=float, default=25.0)
+    a = ap.parse_args()
+    mk = lambda: FakeResponse(a.tokens, a.burst, a.gap_ms)
+    await run("legacy", legacy(mk()), a.tokens)
+    await run("pipeline (no window)", pipeline(mk(), 0), a.tokens)
+    await run(f"pipeline ({a.window_ms:g} ms)", pipeline(mk(), a.window_ms), a.tokens)
+
+if __name__ == "__main__":
+    asyncio.run(main())
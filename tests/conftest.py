@@ -0,0 +1,20 @@
+# tests/conftest.py — okruženje bez vanjskih servisa: lažni Supabase/OpenRouter ključevi, bez spoola i search indeksa
+import os, time
+
+os.environ.update(
+    SUPABASE_URL="http://supabase.test",
+    SUPABASE_ANON_KEY="eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test",
+    SUPABASE_JWT_SECRET="test-secret",
+    OPENROUTER_API_KEY="test-key",
+    SPOOL_ENABLED="0",
+    SEARCH_ENABLED="0",
+)
+
+import pytest
+from jose import jwt
+
+@pytest.fixture
+def auth_headers() -> dict:
+    token = jwt.encode({"sub": "user-1", "aud": "authenticated", "exp": int(time.time()) + 600},
+                       "test-secret", algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
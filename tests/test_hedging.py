@@ -0,0 +1,82 @@
+import asyncio, time
+
+import pytest
+
+from app import hedging
+
+@pytest.fixture
+def hedger(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_FALLBACK_MODELS", ["fallback"])
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.01)
+    return hedging.Hedger()
+
+async def _collect(tokens) -> list:
+    return [t async for t in tokens]
+
+def test_stream_token_beats_error_in_same_round(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.01)
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def open_stream(m):
+            await gate.wait()  # oba kandidata se probude u istoj iteraciji petlje
+            if m == "primary":
+                raise RuntimeError("boom")
+            yield "tok"
+
+        async def release():
+            await asyncio.sleep(0.05)
+            gate.set()
+
+        asyncio.get_running_loop().create_task(release())
+        model, tokens, hedged = await hedger.stream("primary", open_stream)
+        return model, await _collect(tokens), hedged
+
+    for _ in range(20):
+        hedger._budget = 1
+        assert asyncio.run(run()) == ("fallback", ["tok"], True)
+
+def test_stream_primary_error_starts_fallback_immediately(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 5)
+
+    async def open_stream(m):
+        if m == "primary":
+            raise RuntimeError("circuit_open")
+        yield "tok"
+
+    async def run():
+        model, tokens, hedged = await hedger.stream("primary", open_stream)
+        return model, await _collect(tokens), hedged
+
+    t0 = time.monotonic()
+    assert asyncio.run(run()) == ("fallback", ["tok"], True)
+    assert time.monotonic() - t0 < 1
+
+def test_query_primary_error_starts_fallback_immediately(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 5)
+
+    async def call(m):
+        return (503, "circuit_open") if m == "primary" else (200, "answer")
+
+    t0 = time.monotonic()
+    assert asyncio.run(hedger.query("primary", call)) == ("fallback", 200, "answer", True)
+    assert time.monotonic() - t0 < 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+def test_query_both_fail_reports_primary_error(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 5)
+
+    async def call(m):
+        return (503, "circuit_open") if m == "primary" else (500, "down")
+
+    assert asyncio.run(hedger.query("primary", call)) == ("primary", 503, "circuit_open", True)
+
+def test_no_fallback_without_budget(hedger, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 5)
+    hedger._budget = 0
+
+    async def call(m):
+        return (503, "circuit_open") if m == "primary" else (200, "answer")
+
+    assert asyncio.run(hedger.query("primary", call)) == ("primary", 503, "circuit_open", False)
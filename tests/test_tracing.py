@@ -0,0 +1,32 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import main, openrouter
+
+@pytest.fixture
+def client(monkeypatch):
+    # OpenRouter odbija svaki model → 400 bez history upisa
+    start = openrouter.startup
+
+    async def startup():
+        await start()
+        openrouter._client._transport = httpx.MockTransport(
+            lambda req: httpx.Response(400, json={"error": {"message": "bad model"}}))
+
+    monkeypatch.setattr(openrouter, "startup", startup)
+    app = FastAPI()
+    app.include_router(main.router)
+    with TestClient(app) as c:
+        yield c
+
+@pytest.mark.parametrize("model", ["modèle-é", "模型", 'x"y', "a, b;dur=1"])
+def test_client_model_cannot_break_server_timing(client, auth_headers, model):
+    r = client.post("/ai/query", headers=auth_headers, json={"prompt": "hi", "model": model, "cache": "bypass"})
+    assert r.status_code == 400
+    header = r.headers["server-timing"]
+    header.encode("ascii")
+    upstream = next(p for p in header.split(", ") if p.startswith("upstream;"))
+    name, dur, desc = upstream.split(";")
+    assert desc.startswith('desc="') and desc.endswith('"') and '"' not in desc[6:-1]
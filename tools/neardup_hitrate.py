@@ -0,0 +1,57 @@
+# tools/neardup_hitrate.py — replay izvoza historije (/ai/history/export.json) kroz near-dup indeks
+#
+#   PYTHONPATH=. python tools/neardup_hitrate.py history.json [history2.json ...] --thresholds 0.7,0.8,0.85,0.9,0.95
+#
+# Prompti se puštaju kronološki; pogodak znači da je raniji, dovoljno sličan prompt
+# već bio u indeksu. Exact pogoci (isti normalizirani tekst) broje se odvojeno.
+# Svaka datoteka je zaseban scope (izvoz je po korisniku), osim uz --global.
+import argparse, json, sys
+
+from app.neardup import NearDupIndex, normalize
+
+def load(paths, global_scope):
+    rows = []
+    for n, path in enumerate(paths):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for r in data:
+            if r.get("prompt"):
+                rows.append((r.get("created_at") or "", "*" if global_scope else n, r["prompt"]))
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("exports", nargs="+")
+    ap.add_argument("--thresholds", default="0.6,0.7,0.8,0.85,0.9,0.95")
+    ap.add_argument("--global", dest="global_scope", action="store_true", help="jedan scope za sve datoteke")
+    ap.add_argument("--max-entries", type=int, default=1_000_000)
+    a = ap.parse_args()
+
+    rows = load(a.exports, a.global_scope)
+    if not rows:
+        sys.exit("nema prompta u izvozu")
+    thresholds = [float(t) for t in a.thresholds.split(",")]
+    indexes = {t: NearDupIndex(threshold=t, max_entries=a.max_entries, ttl=float("inf")) for t in thresholds}
+    exact_seen, exact_hits = set(), 0
+    hits = {t: 0 for t in thresholds}
+    for _, scope, prompt in rows:
+        norm = (scope, normalize(prompt))
+        exact_hits += norm in exact_seen
+        exact_seen.add(norm)
+        sig = None
+        for t, index in indexes.items():
+            sig = sig or index.signature(prompt)
+            if index.lookup(scope, prompt, sig) is not None:
+                hits[t] += 1
+            else:
+                index.add(scope, prompt, "-", "-", sig)
+
+    total = len(rows)
+    print(f"prompts={total} exact_normalized_hits={exact_hits} ({exact_hits / total:.1%})")
+    print(f"{'threshold':>10} {'hits':>8} {'hit_rate':>9} {'near_only':>10}")
+    for t in thresholds:
+        print(f"{t:>10.2f} {hits[t]:>8} {hits[t] / total:>9.1%} {max(0, hits[t] - exact_hits) / total:>10.1%}")
+
+if __name__ == "__main__":
+    main()